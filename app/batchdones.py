@@ -0,0 +1,196 @@
+'''
+Track which keys (e.g. tasks) are done in a table of a relational database,
+like the dones module, but check and mark many keys per query, and buffer
+marks in memory, writing them in one query when flushed, so thousands of
+processes marking millions of keys do not each make a database round-trip for
+every check and mark.
+
+Keys are serialized as json, so a tuple key and the equal list key are the
+same key.
+
+Marks are written when flush() is called, when maxPending marks are
+buffered, or when a mark is made flushSeconds after the oldest buffered mark.
+Buffered marks are lost if the process dies, so call flush() at the end of a
+unit of work (e.g. a job), and only buffer marks that are safe to lose, i.e.
+marks that only cause work to be done again.
+
+usage:
+
+    d = BatchDones(kvstore.make_closing_connect(openConn), ns='my_dones')
+    todo = [key for key, done in zip(keys, d.done_many(keys)) if not done]
+    for key in todo:
+        work(key)
+        d.mark(key)
+    d.flush()
+'''
+
+import json
+import time
+
+import dbutil
+
+
+# check this many keys per query
+SELECT_BATCH_SIZE = 1000
+
+
+def done_many(d, keys):
+    '''
+    Check whether many keys are done in any dones object d: a BatchDones, a
+    dones.DbDones, whose table is queried for many keys at once, or anything
+    else with a done() method, which is called for each key.
+    returns: a list of whether each key in keys is marked done in d.
+    '''
+    if isinstance(d, BatchDones):
+        return d.done_many(keys)
+    if hasattr(d, '_get_k'):
+        # a dones.DbDones keeps json encoded keys in the name column of the
+        # table of a KStore.  _get_k() creates the table if it does not exist.
+        store = d._get_k()
+        encodedKeys = [json.dumps(key) for key in keys]
+        found = selectNames(store.connect, store.table, sorted(set(encodedKeys)))
+        return [encodedKey in found for encodedKey in encodedKeys]
+    return [d.done(key) for key in keys]
+
+
+def selectNames(connect, table, names):
+    '''
+    returns: the set of names in the name column of table, SELECT_BATCH_SIZE
+    names per query.
+    '''
+    found = set()
+    with connect() as conn:
+        for i in range(0, len(names), SELECT_BATCH_SIZE):
+            batch = names[i:i + SELECT_BATCH_SIZE]
+            sql = 'SELECT name FROM {} WHERE name IN ({})'.format(table, ', '.join(['%s'] * len(batch)))
+            found.update(row[0] for row in dbutil.selectSQL(conn, sql, args=batch))
+    return found
+
+
+class BatchDones(object):
+
+    def __init__(self, connect, ns='batch_dones', fallback=None, maxPending=1000, flushSeconds=60):
+        '''
+        connect: A function which returns a context manager for getting a
+        DBAPI 2.0 connection.  See kvstore.KVStore.  Each check of many keys
+        and each flush uses a single connection.
+        ns: The "namespace" of the keys.  Should be a valid mysql table name.
+        fallback: if not None, a dones object (with done(), unmark() and
+        clear() methods) whose marks are also considered done, e.g. the dones
+        used before switching to BatchDones.  Only consulted for keys not done,
+        all at once.  See done_many().
+        maxPending: flush when this many marks are buffered.
+        flushSeconds: flush when marking this long after the oldest buffered mark.
+        '''
+        self.connect = connect
+        self.table = ns
+        self.fallback = fallback
+        self.maxPending = maxPending
+        self.flushSeconds = flushSeconds
+        self.pending = set() # encoded keys marked but not written
+        self.pendingTime = None # the time of the oldest pending mark
+        self.ready = False
+
+    def create(self):
+        sql = '''CREATE TABLE IF NOT EXISTS ''' + self.table + ''' (
+                 name VARCHAR(255) NOT NULL PRIMARY KEY,
+                 create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                 ) ENGINE = InnoDB '''
+        with self.connect() as conn:
+            with dbutil.doTransaction(conn):
+                dbutil.executeSQL(conn, sql)
+        self.ready = True
+        return self
+
+    def drop(self):
+        with self.connect() as conn:
+            with dbutil.doTransaction(conn):
+                dbutil.executeSQL(conn, 'DROP TABLE IF EXISTS ' + self.table)
+        self.ready = False
+        return self
+
+    def _ready(self):
+        if not self.ready:
+            self.create() # will create the table if it does not exist
+
+    def done(self, key):
+        '''
+        returns: True iff key is marked done.
+        '''
+        return self.done_many([key])[0]
+
+    def done_many(self, keys):
+        '''
+        returns: a list of whether each key in keys is marked done.
+        '''
+        encodedKeys = [json.dumps(key) for key in keys]
+        unknown = sorted(set(encodedKeys) - self.pending)
+        found = set()
+        if unknown:
+            self._ready()
+            found = selectNames(self.connect, self.table, unknown)
+        if self.fallback is not None:
+            # check each missing key once, in one call.
+            missing = dict((encodedKey, key) for key, encodedKey in zip(keys, encodedKeys)
+                           if encodedKey not in self.pending and encodedKey not in found)
+            if missing:
+                items = missing.items()
+                dones = done_many(self.fallback, [key for encodedKey, key in items])
+                found.update(encodedKey for (encodedKey, key), done in zip(items, dones) if done)
+        return [encodedKey in self.pending or encodedKey in found for encodedKey in encodedKeys]
+
+    def all_done(self, keys):
+        return all(self.done_many(keys))
+
+    def mark(self, key):
+        self.mark_many([key])
+
+    def mark_many(self, keys):
+        '''
+        Buffer marking keys done, flushing if enough marks are buffered or the
+        oldest buffered mark is old enough.
+        '''
+        if not self.pending:
+            self.pendingTime = time.time()
+        self.pending.update(json.dumps(key) for key in keys)
+        if (len(self.pending) >= self.maxPending or
+            time.time() - self.pendingTime >= self.flushSeconds):
+            self.flush()
+
+    def flush(self):
+        '''
+        Write all buffered marks in one query.
+        '''
+        if not self.pending:
+            return
+        self._ready()
+        sql = 'INSERT IGNORE INTO {} (name) VALUES (%s)'.format(self.table)
+        with self.connect() as conn:
+            with dbutil.doTransaction(conn):
+                dbutil.executeManySQL(conn, sql, args=[[encodedKey] for encodedKey in sorted(self.pending)])
+        self.pending.clear()
+        self.pendingTime = None
+
+    def unmark(self, key):
+        '''
+        Mark key not done, immediately.
+        '''
+        encodedKey = json.dumps(key)
+        self.pending.discard(encodedKey)
+        self._ready()
+        with self.connect() as conn:
+            with dbutil.doTransaction(conn):
+                dbutil.executeSQL(conn, 'DELETE FROM {} WHERE name = %s'.format(self.table), args=[encodedKey])
+        if self.fallback is not None:
+            self.fallback.unmark(key)
+
+    def clear(self):
+        '''
+        Unmark all keys.
+        '''
+        self.pending.clear()
+        self.drop().create()
+        if self.fallback is not None:
+            self.fallback.clear()
+
+    clean = clear
@@ -27,10 +27,15 @@ print kv.remove("bye")
 
 import contextlib
 import json
+import time
 
 import dbutil
 
 
+# get or put this many keys per query
+BATCH_SIZE = 1000
+
+
 def make_closing_connect(open_conn):
     '''
     Return a function which opens a connection and then returns a context
@@ -71,6 +76,53 @@ def make_reusing_connect(open_conn):
     return connect
 
 
+def make_pooled_connect(open_conn, max_idle=600):
+    '''
+    Return a function which returns a context manager which "yields" an
+    open database connection from a pool, opening one if the pool is empty,
+    and returns it to the pool when the context is exited, so connections are
+    reused instead of opened for every operation.  A connection idle in the
+    pool for more than max_idle seconds is closed instead of reused, since
+    the database might have closed it.  A connection used in a context that
+    raises an exception is closed instead of returned to the pool.  The
+    function has a close() attribute which closes the connections in the
+    pool, e.g.:
+
+        connect = make_pooled_connect(open_conn)
+        try:
+            ...
+        finally:
+            connect.close()
+
+    open_conn: a function which returns an open DBAPI 2.0 connection.
+    max_idle: seconds.
+    '''
+    conn_pool = [] # (connection, time returned to the pool) tuples
+    @contextlib.contextmanager
+    def connect():
+        conn = None
+        while conn_pool and conn is None:
+            conn, idle_since = conn_pool.pop()
+            if time.time() - idle_since > max_idle:
+                conn.close()
+                conn = None
+        if conn is None:
+            conn = open_conn()
+        try:
+            yield conn
+        except:
+            conn.close()
+            raise
+        conn_pool.append((conn, time.time()))
+
+    def close():
+        while conn_pool:
+            conn_pool.pop()[0].close()
+
+    connect.close = close
+    return connect
+
+
 class KVStore(object):
     '''
     A key-value store backed by a relational database. e.g. mysql.
@@ -129,6 +181,54 @@ class KVStore(object):
             return value
 
 
+    def get_many(self, keys, default=None):
+        '''
+        Get the values of many keys, BATCH_SIZE keys per query.
+        returns: a list of the value of each key, or default for missing keys.
+        '''
+        encodedKeys = [json.dumps(key) for key in keys]
+        encodedToValue = {}
+        with self.connect() as conn:
+            for i in range(0, len(encodedKeys), BATCH_SIZE):
+                batch = list(set(encodedKeys[i:i + BATCH_SIZE]))
+                sql = 'SELECT name, value FROM {} WHERE name IN ({})'.format(
+                    self.table, ', '.join(['%s'] * len(batch)))
+                for name, value in dbutil.selectSQL(conn, sql, args=batch):
+                    encodedToValue[name] = value
+        return [json.loads(encodedToValue[k]) if k in encodedToValue else default
+                for k in encodedKeys]
+
+
+    def scan(self, prefix=(), batch_size=BATCH_SIZE):
+        '''
+        Iterate over the list keys starting with the elements of prefix, and
+        their values, e.g. scan(['blast']) yields (['blast', 'A', 'B'], value)
+        but not (['rsd', 'A', 'B'], value).  The empty prefix yields every key.
+        Rows are read batch_size at a time, in key order, each batch starting
+        after the last key of the previous batch, so memory is bounded and no
+        query stays open while rows are consumed.
+        yields: (key, value) tuples.
+        '''
+        sql = 'SELECT name, value FROM ' + self.table + ' WHERE name > %s'
+        args = []
+        if prefix:
+            # the encoded key starts with the encoded prefix, minus its closing bracket.
+            encodedPrefix = json.dumps(list(prefix))[:-1]
+            escaped = encodedPrefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            sql += ' AND (name = %s OR name LIKE %s)'
+            args = [encodedPrefix + ']', escaped + ', %']
+        sql += ' ORDER BY name LIMIT %s'
+        lastName = ''
+        while True:
+            with self.connect() as conn:
+                results = dbutil.selectSQL(conn, sql, args=[lastName] + args + [batch_size])
+            for name, value in results:
+                yield json.loads(name), json.loads(value)
+            if len(results) < batch_size:
+                break
+            lastName = results[-1][0]
+
+
     def put(self, key, value):
         encodedKey = json.dumps(key)
         encodedValue = json.dumps(value)
@@ -138,6 +238,19 @@ class KVStore(object):
                 return dbutil.insertSQL(conn, sql, args=[encodedKey, encodedValue, encodedValue])
 
 
+    def put_many(self, items):
+        '''
+        Put many keys and values in one transaction, BATCH_SIZE per query.
+        items: a list of (key, value) tuples.
+        '''
+        args = [[json.dumps(key), json.dumps(value)] for key, value in items]
+        sql = 'INSERT INTO ' + self.table + ' (name, value) VALUES (%s, %s) ON DUPLICATE KEY UPDATE value=VALUES(value)'
+        with self.connect() as conn:
+            with dbutil.doTransaction(conn):
+                for i in range(0, len(args), BATCH_SIZE):
+                    dbutil.executeManySQL(conn, sql, args=args[i:i + BATCH_SIZE])
+
+
     def exists(self, key):
         encodedKey = json.dumps(key)
         with self.connect() as conn:
@@ -6,6 +6,7 @@ Helpful functions for interacting with LSF using python, and for setting up an e
 
 import collections
 import logging
+import math
 import os
 import re
 import shlex
@@ -32,6 +33,9 @@ DONE_STATUS = 'DONE'
 ZOMBIE_STATUS = 'ZOMBI'
 OFF_STATUSES = (DONE_STATUS, EXIT_STATUS, ZOMBIE_STATUS)
 
+# number of job ids per bjobs call.  see getOnJobIds
+JOB_ID_BATCH_SIZE = 500
+
 
 ##########################
 # JOB MONITORING FUNCTIONS
@@ -84,6 +88,33 @@ def getOnJobNames():
     return [name for name in jobNameToInfos if infosAreOn(jobNameToInfos[name])]
 
 
+def getOnJobIds(jobIds, batchSize=JOB_ID_BATCH_SIZE):
+    '''
+    Query only jobIds, batchSize job ids per bjobs call, instead of every job
+    on lsf.  A job lsf no longer knows about (e.g. finished long ago) is off.
+    jobIds: seq of job ids.  The id of a job of a job array includes its
+    index, e.g. '1234[5]'.  Each array is queried once.
+    returns: the set of job ids in jobIds that are "on" lsf.
+    '''
+    jobIds = set(str(j) for j in jobIds)
+    queryIds = sorted(set(j.split('[')[0] for j in jobIds))
+    onIds = set()
+    for i in range(0, len(queryIds), batchSize):
+        args = ['bjobs', '-a', '-u', 'all', '-w'] + queryIds[i:i + batchSize]
+        # bjobs exits with an error when some jobs are not found, but still
+        # prints the jobs it found.
+        proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, error = proc.communicate()
+        for info in parseJobInfos(output):
+            if info[STATUS] not in OFF_STATUSES:
+                # array jobs are named with their index, e.g. 'myarray[5]'.
+                m = re.search(r'(\[\d+\])$', info[JOB_NAME])
+                onIds.add(info[JOBID])
+                if m:
+                    onIds.add(info[JOBID] + m.group(1))
+    return onIds & jobIds
+
+
 def getJobNameToInfos():
     jobNameToInfos = collections.defaultdict(list)
     for info in getJobInfos():
@@ -138,14 +169,21 @@ def getJobInfos(jobIds=None, retry=False, delay=1.0):
 
 
 def getJobInfosSub(args):
+    output = subprocess.check_output(args)
+    return parseJobInfos(output)
+
+
+def parseJobInfos(output):
+    '''
+    output: the output of bjobs -w
+    returns: info for each job in output.
+    '''
     # jobid, userid, status, queue, submission host, execution host, command/jobname, month, day, time
     # example lines of bjobs -wu all
     # 209991  at55    RUN   all_12h    orchestra.med.harvard.edu cello153.cl.med.harvard.edu /home/np29/biology/admix/release7/mcmc -p parc2 Feb  7 13:42
     # 114345  td23    PEND  shared_unlimited orchestra.med.harvard.edu    -        /home/td23/dev/blastparallel/trunk/pblast.pl -d /groups/rodeo/databases/blast/Caenorhabditis_elegans.aa -p blastp -e 10 -matrix BLOSUM62 -i /home/td23/mito.faa --queue rodeo_unlimited Jul  5 14:22
     # captures: jobid, userid, status, queue, submission host, execution host, command/jobname, submission time
     bjobsRegex = '^(\S+)\s+(\S+)\s+(\S+)\s+(\S+)\s+(\S+)\s+(\S+)\s+(.*?)\s+(\S+\s+\S+\s+\S+)\s+$'
-
-    output = subprocess.check_output(args)
     jobs = output.splitlines(True) # keep line endings
 
     infos = []
@@ -214,6 +252,29 @@ def bsub(cmd, options=None):
     return jobid
 
 
+def makeResourceOptions(queue=None, seconds=None, memMB=None, tmpMB=None):
+    '''
+    Make bsub options for the queue and the resources of a job.  Options
+    that are None are left out.
+    queue: the name of a queue.
+    seconds: the run time limit of the job, rounded up to whole minutes.
+    memMB: the megabytes of memory to reserve.
+    tmpMB: the megabytes of local disk (tmp) to reserve.
+    returns: a list of bsub options, e.g. ['-q', 'long', '-W', '2:30', '-R', 'rusage[mem=2048,tmp=500]']
+    '''
+    options = []
+    if queue is not None:
+        options += ['-q', queue]
+    if seconds is not None:
+        minutes = max(1, int(math.ceil(seconds / 60.0)))
+        options += ['-W', '{}:{:02}'.format(minutes // 60, minutes % 60)]
+    rusage = ['{}={}'.format(name, int(math.ceil(mb))) for name, mb in
+              [('mem', memMB), ('tmp', tmpMB)] if mb is not None]
+    if rusage:
+        options += ['-R', 'rusage[{}]'.format(','.join(rusage))]
+    return options
+
+
 
 #############################
 # LSF CONFIGURATION FUNCTIONS
@@ -7,13 +7,25 @@ are done or already on lsf.  This allows one to pick up where one left off.
 Every task (either a command line or a function call) has a name assigned to
 it, which should be unique within a given namespace.  This namespace and
 name combination is used to track which tasks are done and which are on lsf.
+
+Tasks can also be run by other executors: in parallel processes on the local
+machine, or one at a time in the current process, e.g. to use every core of
+one big machine or to test without a cluster.  The executor is chosen by the
+executor argument of bsubmany, or else by the LSFDO_EXECUTOR environment
+variable ('lsf', 'local' or 'inline'), so it is inherited by subprocesses.
 '''
 
 import argparse
+import errno
+import hashlib
 import logging
+import multiprocessing.pool
+import os
+import re
 import subprocess
 import time
 
+import batchdones
 import cliutil
 import dones
 import lsf
@@ -23,6 +35,23 @@ import filemsg
 
 # Seconds to pause between polling lsf to see if jobs are done.
 DEFAULT_PAUSE = 10
+# While no jobs finish, the pause grows by this factor, up to MAX_PAUSE.
+BACKOFF = 1.5
+MAX_PAUSE = 300
+
+# Executors
+LSF_EXECUTOR = 'lsf'
+LOCAL_EXECUTOR = 'local'
+INLINE_EXECUTOR = 'inline'
+EXECUTORS = (LSF_EXECUTOR, LOCAL_EXECUTOR, INLINE_EXECUTOR)
+# Environment variables choosing the default executor and the number of
+# processes of the local executor.
+EXECUTOR_ENV = 'LSFDO_EXECUTOR'
+PROCESSES_ENV = 'LSFDO_PROCESSES'
+
+# The maximum number of tasks in a lsf job array.  LSF limits the size of
+# arrays and their indexes with MAX_JOB_ARRAY_SIZE, 1000 by default.
+ARRAY_SIZE = 1000
 
 
 def echo(msg):
@@ -157,27 +186,126 @@ def do(ns, task):
     print 'Done', task.name
 
 
-def bsub(ns, task, opt, pause=DEFAULT_PAUSE, timeout=-1):
-    return bsubmany(ns, [task], [opt], pause=pause, timeout=timeout)
+def bsub(ns, task, opt, pause=DEFAULT_PAUSE, timeout=-1, executor=None):
+    return bsubmany(ns, [task], [opt], pause=pause, timeout=timeout, executor=executor)
 
 
-def bsubmany(ns, tasks, opts, pause=DEFAULT_PAUSE, timeout=-1):
+def bsubmany(ns, tasks, opts, pause=DEFAULT_PAUSE, timeout=-1, executor=None, array=False):
     '''
     tasks: a list of Task objects which will be pickled.
     opts: list of lsf options, one for each task.
     pause: Number of seconds to wait between checking for running lsf jobs.
+    While no jobs finish, the pause grows, up to MAX_PAUSE.
     timeout: Number of seconds to wait for tasks to finish running on lsf
     before giving up.  A timeout < 0 means wait until no more tasks are running
     on lsf.  A timeout of 0 means do not wait at all for jobs to finish.
+    executor: an executor object, the name of one (see EXECUTORS) or None
+    for the default executor.  See get_executor().
+    array: if True, submit tasks to lsf as job arrays, one bsub per group of
+    up to ARRAY_SIZE tasks with the same options, instead of one bsub per
+    task.  Array jobs of tasks still running are only recognized by later
+    calls with the same list of tasks.
+    '''
+    if executor is None or isinstance(executor, basestring):
+        executor = get_executor(executor)
+    executor.runmany(ns, tasks, opts, pause=pause, timeout=timeout, array=array)
+
+    # Make sure all tasks are done.
+    if not all_done(ns, tasks):
+        raise NotDoneError('Not all tasks successfully done.', ns, tasks)
+
+
+def get_executor(name=None):
+    '''
+    name: one of EXECUTORS.  Defaults to the LSFDO_EXECUTOR environment
+    variable, or lsf if it is not set.
+    returns: an executor object.
+    '''
+    if name is None:
+        name = os.environ.get(EXECUTOR_ENV, LSF_EXECUTOR)
+    if name == LSF_EXECUTOR:
+        return LsfExecutor()
+    elif name == LOCAL_EXECUTOR:
+        processes = os.environ.get(PROCESSES_ENV)
+        return LocalExecutor(int(processes) if processes else None)
+    elif name == INLINE_EXECUTOR:
+        return InlineExecutor()
+    else:
+        raise Exception('Unrecognized executor.', name)
+
+
+##################
+# EXECUTOR CLASSES
+
+class LsfExecutor(object):
+    '''
+    Submit tasks as lsf jobs and wait for them to finish.
+    '''
+    def runmany(self, ns, tasks, opts, pause=DEFAULT_PAUSE, timeout=-1, array=False):
+        _lsf_runmany(ns, tasks, opts, pause, timeout, array)
+
+
+class LocalExecutor(object):
+    '''
+    Run tasks in parallel on the local machine, each in its own process, the
+    same way a lsf job runs a task.  Waits for every task to finish, so pause
+    and timeout are ignored, as are lsf options and array.
     '''
+    def __init__(self, processes=None):
+        '''
+        processes: the number of tasks to run at once.  Defaults to the number
+        of cpus.
+        '''
+        self.processes = processes or multiprocessing.cpu_count()
+
+    def runmany(self, ns, tasks, opts, pause=DEFAULT_PAUSE, timeout=-1, array=False):
+        done = _done_names(ns, tasks)
+        todo = [task for task in tasks if task.name not in done]
+        if not todo:
+            return
+        print 'Running {} tasks in {} local processes. ns={}'.format(len(todo), self.processes, ns)
+        pool = multiprocessing.pool.ThreadPool(min(self.processes, len(todo)))
+        try:
+            returncodes = pool.map(lambda task: subprocess.call(_task_cmd(ns, task)), todo)
+        finally:
+            pool.close()
+            pool.join()
+        for task, returncode in zip(todo, returncodes):
+            if returncode:
+                print 'Task failed. ns={}, name={}, returncode={}'.format(ns, task.name, returncode)
+
+
+class InlineExecutor(object):
+    '''
+    Run tasks one at a time in the current process.  A task that raises an
+    exception is logged and the rest are run.  pause, timeout, lsf options
+    and array are ignored.
+    '''
+    def runmany(self, ns, tasks, opts, pause=DEFAULT_PAUSE, timeout=-1, array=False):
+        for task in tasks:
+            try:
+                do(ns, task)
+            except Exception:
+                logging.exception('Task failed. ns={}, name={}'.format(ns, task.name))
+
+
+def _lsf_runmany(ns, tasks, opts, pause, timeout, array=False):
     # Submit tasks that are neither done nor running to LSF.
     done = _done_names(ns, tasks)
-    running = _running_names(ns, tasks)
+    nameToJobIds = _running_job_ids(ns, tasks)
     submitted = False
+    arrayFilenames = []
+    if array:
+        indices = [i for i, task in enumerate(tasks) if task.name not in done and
+                   task.name not in nameToJobIds]
+        arrayNameToJobIds, arrayFilenames = _bsub_arrays(ns, tasks, opts, indices)
+        nameToJobIds.update(arrayNameToJobIds)
+        submitted = bool(indices)
     for task, opt in zip(tasks, opts):
-        if task.name not in done and task.name not in running:
+        if task.name not in done and task.name not in nameToJobIds:
             print 'Submitting task to LSF. ns={}, name={}'.format(ns, task.name)
             jobid = _bsub_task(ns, task, opt)
+            nameToJobIds[task.name] = [jobid]
             submitted = True
             print 'Job id={}'.format(jobid)
 
@@ -196,23 +324,33 @@ def bsubmany(ns, tasks, opts, pause=DEFAULT_PAUSE, timeout=-1):
             print 'Waiting {} seconds for tasks to finish running.'.format(pause)
             time.sleep(pause)
 
-        while _any_running(ns, tasks):
+        # Only the jobs of tasks are monitored, not every job on lsf.
+        wait = pause
+        while True:
+            numRunning = len(nameToJobIds)
+            nameToJobIds = _running_jobs(ns, nameToJobIds)
+            if not nameToJobIds:
+                break
+
             # stop waiting when enough time has elapsed
             elapsed_time = time.time() - start
             if timeout > 0 and elapsed_time >= timeout:
                 break
 
+            # back off while no jobs finish.
+            wait = pause if len(nameToJobIds) < numRunning else min(wait * BACKOFF, max(pause, MAX_PAUSE))
             # avoid waiting past timeout
             remaining_time = timeout - elapsed_time
-            if timeout > 0 and remaining_time < pause:
-                pause = remaining_time
+            if timeout > 0 and remaining_time < wait:
+                wait = remaining_time
 
-            print 'Waiting {} seconds for tasks to finish running.'.format(pause)
-            time.sleep(pause)
+            print 'Waiting {} seconds for {} tasks to finish running.'.format(wait, len(nameToJobIds))
+            time.sleep(wait)
 
-    # Make sure all tasks are done.
-    if not all_done(ns, tasks):
-        raise NotDoneError('Not all tasks successfully done.', ns, tasks)
+        # the arrays are finished, so no job will read their files.
+        if not nameToJobIds:
+            for filename in arrayFilenames:
+                _remove_file(filename)
 
 
 def reset(ns):
@@ -237,6 +375,14 @@ def all_done(ns, tasks):
     return _get_dones(ns).all_done(names)
 
 
+def running_names(ns, tasks):
+    '''
+    Return the names of the tasks currently on lsf, including tasks submitted
+    in job arrays.
+    '''
+    return set(_running_job_ids(ns, tasks))
+
+
 def _lsf_job_name(ns, name):
     '''
     The combination of ns and name should be a globally unique string useful
@@ -245,17 +391,47 @@ def _lsf_job_name(ns, name):
     return '{}_{}'.format(ns, name)
 
 
-def _running_names(ns, tasks):
-    onJobNames = set(lsf.getOnJobNames())
-    return set(t.name for t in tasks if _lsf_job_name(ns, t.name) in
-               onJobNames)
+def _running_job_ids(ns, tasks):
+    '''
+    Find the jobs of tasks already on lsf, e.g. submitted by an earlier call
+    to bsubmany.  Lists every job on lsf, so it is only called once per call.
+    returns: a dict from the name of each task on lsf to its "on" job ids.
+    '''
+    nameToTask = dict((_lsf_job_name(ns, t.name), t) for t in tasks)
+    # array jobs are named by their array and index.  See _bsub_arrays().
+    for i, task in enumerate(tasks):
+        nameToTask['{}[{}]'.format(_array_job_name(ns, tasks, i // ARRAY_SIZE), i % ARRAY_SIZE + 1)] = task
+    nameToJobIds = {}
+    for jobName, infos in lsf.getJobNameToInfos().items():
+        if jobName in nameToTask:
+            jobIds = [_job_id(info) for info in infos if info[lsf.STATUS] not in lsf.OFF_STATUSES]
+            if jobIds:
+                nameToJobIds.setdefault(nameToTask[jobName].name, []).extend(jobIds)
+    return nameToJobIds
+
+
+def _job_id(info):
+    '''
+    returns: the job id of a lsf job info, including the index of an array
+    job, e.g. '1234[5]'.
+    '''
+    m = re.search(r'(\[\d+\])$', info[lsf.JOB_NAME])
+    return info[lsf.JOBID] + (m.group(1) if m else '')
 
 
-def _any_running(ns, tasks):
+def _running_jobs(ns, nameToJobIds):
     '''
-    Return true iff any of the tasks are currently on LSF.
+    Tasks mark themselves done when they finish, so tasks marked done are not
+    running, without asking lsf.  The dones of every task are checked at once,
+    and the jobs of the rest are queried by job id.
+    nameToJobIds: a dict from task names to their job ids.
+    returns: a dict of the tasks (and their job ids) of nameToJobIds that are
+    not done and still on lsf.
     '''
-    return bool(_running_names(ns, tasks))
+    done = _done_names(ns, nameToJobIds)
+    nameToJobIds = dict((name, ids) for name, ids in nameToJobIds.items() if name not in done)
+    onIds = lsf.getOnJobIds([i for ids in nameToJobIds.values() for i in ids])
+    return dict((name, ids) for name, ids in nameToJobIds.items() if any(i in onIds for i in ids))
 
 
 def _get_dones(ns):
@@ -263,27 +439,121 @@ def _get_dones(ns):
 
 
 def _done_names(ns, tasks):
-    d = _get_dones(ns)
-    return set(t.name for t in tasks if d.done(t.name))
+    '''
+    tasks: tasks or task names.
+    returns: the set of the names of tasks that are done, checked at once.
+    '''
+    names = [t if isinstance(t, basestring) else t.name for t in tasks]
+    return set(name for name, done in zip(names, batchdones.done_many(_get_dones(ns), names)) if done)
 
 
 def _bsub_task(ns, task, lsfopts, devnull=True):
     '''
     Submit a task to lsf
     '''
-    filename = filemsg.dump([ns, task])
-    cmd = cliutil.args(__file__) + ['run_task', filename]
+    cmd = _task_cmd(ns, task)
     devnull_option = ['-o', '/dev/null'] if devnull else []
     jobname_option = ['-J', _lsf_job_name(ns, task.name)]
     lsfopts = devnull_option + list(lsfopts) + jobname_option
     return lsf.bsub(cmd, lsfopts)
 
 
+def _array_job_name(ns, tasks, chunk):
+    '''
+    The name of the lsf job arrays of the chunk-th ARRAY_SIZE tasks of tasks.
+    The same list of tasks always gets the same names, so the tasks of arrays
+    still on lsf can be recognized.
+    '''
+    digest = hashlib.sha1('\n'.join(task.name for task in tasks)).hexdigest()
+    return _lsf_job_name(ns, 'array_{}_{}'.format(digest[:12], chunk))
+
+
+def _index_spec(indices):
+    '''
+    returns: a lsf job array index list for indices, e.g. '1-3,5' for [1, 2, 3, 5].
+    '''
+    ranges = []
+    for i in sorted(indices):
+        if ranges and ranges[-1][1] == i - 1:
+            ranges[-1][1] = i
+        else:
+            ranges.append([i, i])
+    return ','.join(str(a) if a == b else '{}-{}'.format(a, b) for a, b in ranges)
+
+
+def _bsub_arrays(ns, tasks, opts, indices):
+    '''
+    Submit the tasks at indices of tasks to lsf as job arrays: one array for
+    the tasks of each chunk of ARRAY_SIZE tasks with the same options.  The
+    index of a job in its array is the position of its task in the chunk,
+    plus one.
+    returns: a dict from the name of each submitted task to its job id, and a
+    list of the files of the tasks of the arrays.
+    '''
+    chunkOptToIndices = {}
+    for i in indices:
+        chunkOptToIndices.setdefault((i // ARRAY_SIZE, tuple(opts[i])), []).append(i)
+    nameToJobIds = {}
+    filenames = []
+    for (chunk, opt), chunkIndices in sorted(chunkOptToIndices.items()):
+        # every job of an array reads the same tasks, and which of them are
+        # in the array.  See _cli_run_array_task().
+        start = chunk * ARRAY_SIZE
+        filename = filemsg.dump([ns, tasks[start:start + ARRAY_SIZE], [i - start for i in chunkIndices]])
+        filenames.append(filename)
+        cmd = cliutil.args(__file__) + ['run_array_task', filename]
+        spec = _index_spec([i - start + 1 for i in chunkIndices])
+        name = '{}[{}]'.format(_array_job_name(ns, tasks, chunk), spec)
+        print 'Submitting {} tasks to LSF as a job array. ns={}, name={}'.format(len(chunkIndices), ns, name)
+        jobid = lsf.bsub(cmd, ['-o', '/dev/null'] + list(opt) + ['-J', name])
+        print 'Job id={}'.format(jobid)
+        for i in chunkIndices:
+            nameToJobIds[tasks[i].name] = ['{}[{}]'.format(jobid, i - start + 1)]
+    return nameToJobIds, filenames
+
+
+def _task_cmd(ns, task):
+    '''
+    returns: the command line which runs task in a new process.
+    '''
+    filename = filemsg.dump([ns, task])
+    return cliutil.args(__file__) + ['run_task', filename]
+
+
 def _cli_run_task(filename):
     ns, task = filemsg.load(filename)
     do(ns, task)
 
 
+def _cli_run_array_task(filename):
+    '''
+    Run the task of this lsf array job, using its array index.  The file is
+    shared by the jobs of the array, so it is deleted by the job that finds
+    every task of the array done, or by bsubmany once the array has finished.
+    '''
+    try:
+        ns, tasks, indices = filemsg.load(filename, delete=False)
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        print 'Every task of the array is done. filename={}'.format(filename)
+        return
+    do(ns, tasks[int(os.environ['LSB_JOBINDEX']) - 1])
+    if all_done(ns, [tasks[i] for i in indices]):
+        _remove_file(filename)
+
+
+def _remove_file(filename):
+    '''
+    Remove filename, unless another process already removed it.
+    '''
+    try:
+        os.remove(filename)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
 def main():
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers()
@@ -292,6 +562,10 @@ def main():
     subparser.add_argument('filename')
     subparser.set_defaults(func=_cli_run_task)
 
+    subparser = subparsers.add_parser('run_array_task')
+    subparser.add_argument('filename')
+    subparser.set_defaults(func=_cli_run_array_task)
+
     # parse command line arguments and invoke the appropriate handler.
     args = parser.parse_args()
     kws = dict(vars(args))
@@ -0,0 +1,123 @@
+'''
+A model of the running time of computing the orthologs of a pair of genomes
+(blasting each genome against the other and running rsd), fit to the running
+times of pairs in previous datasets.
+
+The model is a power law of the sizes of the genomes:
+
+    log(seconds) = c0 + c1 * log(qResidues * sResidues) + c2 * log(qSeqs * sSeqs)
+
+fit by least squares.  Running times span several orders of magnitude, so
+the fit is done on logs, and predictions are multiplied by the mean of the
+exponentiated residuals (Duan's smearing estimate), so they estimate the mean
+running time, not the median, and sum to sensible totals.
+
+A genome size is a (number of sequences, number of residues) tuple.
+'''
+
+import math
+
+
+class NoSamplesError(ValueError):
+    pass
+
+
+def features(qSize, sSize):
+    (qSeqs, qResidues), (sSeqs, sResidues) = qSize, sSize
+    return [1.0, math.log(max(1.0, float(qResidues) * sResidues)),
+            math.log(max(1.0, float(qSeqs) * sSeqs))]
+
+
+def fitModel(samples, ridge=1e-6):
+    '''
+    samples: an iterable of (qSize, sSize, seconds) tuples.
+    ridge: added to the diagonal of the normal equations, so the fit does not
+    fail when the features are (nearly) collinear, e.g. when all genomes have
+    the same mean sequence length.
+    returns: a RuntimeModel fit to the samples.
+    '''
+    xs = []
+    ys = []
+    for qSize, sSize, seconds in samples:
+        if seconds > 0:
+            xs.append(features(qSize, sSize))
+            ys.append(math.log(seconds))
+    if not xs:
+        raise NoSamplesError('No samples to fit a runtime model to.')
+    k = len(xs[0])
+    # normal equations: (X'X + ridge*I) c = X'y
+    a = [[sum(x[i] * x[j] for x in xs) + (ridge if i == j else 0.0) for j in range(k)] for i in range(k)]
+    b = [sum(x[i] * y for x, y in zip(xs, ys)) for i in range(k)]
+    coefs = solve(a, b)
+    residuals = [y - dot(coefs, x) for x, y in zip(xs, ys)]
+    smear = sum(math.exp(r) for r in residuals) / len(residuals)
+    mean = sum(ys) / len(ys)
+    total = sum((y - mean) ** 2 for y in ys)
+    r2 = 1.0 - sum(r * r for r in residuals) / total if total else 1.0
+    return RuntimeModel(coefs, smear, len(xs), r2)
+
+
+def solve(a, b):
+    '''
+    Solve the linear equations a x = b by gaussian elimination with partial
+    pivoting.  a is a list of rows.
+    '''
+    n = len(b)
+    m = [list(row) + [v] for row, v in zip(a, b)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        if m[pivot][col] == 0:
+            raise ValueError('Singular matrix.')
+        m[col], m[pivot] = m[pivot], m[col]
+        for r in range(col + 1, n):
+            f = m[r][col] / m[col][col]
+            for c in range(col, n + 1):
+                m[r][c] -= f * m[col][c]
+    x = [0.0] * n
+    for r in reversed(range(n)):
+        x[r] = (m[r][n] - sum(m[r][c] * x[c] for c in range(r + 1, n))) / m[r][r]
+    return x
+
+
+def dot(xs, ys):
+    return sum(x * y for x, y in zip(xs, ys))
+
+
+class RuntimeModel(object):
+    '''
+    A fitted runtime model.  genomeToSize maps the genomes of a dataset to
+    their sizes, for predict_pair_cost().
+    '''
+    def __init__(self, coefs, smear=1.0, numSamples=0, r2=None, genomeToSize=None):
+        self.coefs = coefs
+        self.smear = smear
+        self.numSamples = numSamples
+        self.r2 = r2
+        self.genomeToSize = genomeToSize or {}
+
+    def predict(self, qSize, sSize):
+        '''
+        returns: the predicted running time in seconds of a pair of genomes of
+        sizes qSize and sSize.
+        '''
+        return math.exp(dot(self.coefs, features(qSize, sSize))) * self.smear
+
+    def predict_pair_cost(self, qdb, sdb):
+        '''
+        returns: the predicted running time in seconds of the pair of genomes
+        qdb and sdb.
+        '''
+        return self.predict(self.genomeToSize[qdb], self.genomeToSize[sdb])
+
+    def toData(self):
+        '''
+        returns: the model as a dict that can be serialized as json.
+        '''
+        return {'coefs': self.coefs, 'smear': self.smear, 'num_samples': self.numSamples, 'r2': self.r2}
+
+
+def modelFromData(data, genomeToSize=None):
+    '''
+    data: a dict made by RuntimeModel.toData()
+    '''
+    return RuntimeModel(data['coefs'], data['smear'], data['num_samples'], data['r2'], genomeToSize)
@@ -35,13 +35,17 @@
 
 # standard library modules
 import argparse
+import atexit
 import collections
 import contextlib
 import datetime
 import glob
+import hashlib
 import itertools
 import json
 import logging
+import math
+import multiprocessing
 import os
 import random
 import re
@@ -58,22 +62,55 @@ if _root_module_dir not in sys.path:
     sys.path.append(_root_module_dir)
 
 # our modules
+import batchdones
 import config
 import dones
 import fasta
 import kvstore
+import lsf
 import lsfdo
 import nested
 import orthoxml
 import orthutil
 import roundup_common
 import rsd
+import stagecache
 import uniprot
 import util
+import workqueue
+import writerpool
+from roundup import costmodel
+from roundup import genetable
+from roundup import hitsfile
+from roundup import metadata
 
 
 DEFAULT_NUM_JOBS = 4000 # the default number of jobs used to compute orthologs
+SHORT_QUEUE_SECONDS = 12 * 3600 # the run time limit of the short lsf queue
+LONG_QUEUE_SECONDS = 720 * 3600 # the run time limit of the long lsf queue
+JOB_SECONDS_SAFETY_FACTOR = 2 # only use the short queue for jobs predicted to finish in half its limit
+# lsf resource reservations of jobs.  see getJobResourceOpts
+JOB_BASE_TMP_MB = 500 # local disk every job reserves, e.g. for blast output
+JOB_BASE_MEM_MB = 1024
+MEM_BYTES_PER_RESIDUE = 8 # memory per residue of the genomes of a pair, for blast and rsd
+HIT_BYTES = 40 # local disk per pickled blast hit.  see getPairHitsPaths
+FORMAT_JOB_OPTS = lsf.makeResourceOptions(queue='short', seconds=3600) # see format_genomes
+# batch blast keeps up to this many times rsd.MAX_HITS hits per query sequence
+# per subject genome from the combined database, so genomes with many similar
+# sequences do not crowd the hits of the others out.  see computeBatchBlastHits
+BATCH_BLAST_HITS_FACTOR = 10
+# blastp reports hits in at most this many database sequences per query
+# sequence (its default -max_target_seqs), and rsd.computeBlastHits does not
+# change it, so batch blast databases hold few enough genomes that the limit
+# only binds for query sequences with more than BATCH_BLAST_HITS_FACTOR times
+# rsd.MAX_HITS hits per genome.  see blastJobGenomes
+BLAST_MAX_TARGET_SEQS = 500
+BATCH_BLAST_MAX_GENOMES = max(1, BLAST_MAX_TARGET_SEQS // (rsd.MAX_HITS * BATCH_BLAST_HITS_FACTOR))
+PAIR_GROUPS_PER_JOB = 4 # group pairs sharing genomes into about this many groups per job. see groupPairsByGenomes
 MIN_GENOME_SIZE = 200 # ignore genomes with fewer sequences
+DAT_RANGES_PER_PROC = 4 # split dat files into this many byte ranges per process when parsing in parallel
+DAT_BUF_BYTES = 256 * 2**20 # buffer this many bytes of genome fasta and gene data before writing it out
+PAIR_QUEUE_BACKENDS = ['mysql', 'sqlite'] # the backends of queues of pairs jobs claim from. see prepare_jobs
 DIR_MODE = 0775 # directories in this dataset are world readable and group writable.
 
 # keys used for termToData and taxonToData  
@@ -95,6 +132,7 @@ GENOME_TO_GENES = 'genome_to_genes'
 TAXON_TO_DATA = 'taxon_to_data'
 BLAST_STATS = 'blast_stats'
 RSD_STATS = 'rsd_stats'
+PERFORMANCE_PERCENTILES = [50, 90, 99, 100] # of pair times.  see extract_performance_stats
 CHANGE_LOG = 'change_log'
 BIG_DATA_KEYS = [GENES, GENE_TO_GENOME, GENE_TO_NAME, GENE_TO_DESC,
         GENE_TO_GO_TERMS, GENE_TO_GENE_IDS, TERM_TO_DATA, GENOME_TO_GENES,
@@ -102,19 +140,30 @@ BIG_DATA_KEYS = [GENES, GENE_TO_GENOME, GENE_TO_NAME, GENE_TO_DESC,
 
 # For performance, use local disk during computation.
 LOCAL_DIR = '/tmp'
+# Genome fasta and blast index files are staged on the local disk of a node
+# once, for every job on the node, in a cache using at most this much disk.
+STAGE_CACHE_DIR = os.path.join(LOCAL_DIR, 'roundup_stage_cache')
+STAGE_CACHE_BYTES = 20 * 2**30
+# Blast hits are kept on the local disk of a node until the orthologs of their
+# pair are computed.
+LOCAL_HITS_DIR = os.path.join(LOCAL_DIR, 'roundup_hits')
+HITS_CACHE_BYTES = 500 * 2**30 # the disk quota of a persistent hits cache. see prepare_jobs
 
 
 ##################
 # DATASET CREATION
 
-def prepare_dataset(ds):
+def prepare_dataset(ds, backend=metadata.JSON_BACKEND):
     '''
     Make the directory structure, tables, etc., a new dataset needs.
+    backend: the metadata backend of the dataset, 'json' or 'sqlite'.
     '''
     for path in [ds, getGenomesDir(ds), getOrthologsDir(ds), getJobsDir(ds),
                  getSourcesDir(ds), getDownloadDir(ds)]:
         if not os.path.exists(path):
             os.makedirs(path, DIR_MODE)
+    if backend != metadata.getBackendName(ds):
+        convert_metadata(ds, backend)
 
 
 ########################################
@@ -214,7 +263,17 @@ def process_go_sources(ds):
         process_source(ds, f)
 
 
-def process_uniprot_sources(ds):
+def process_uniprot_sources(ds, gunzip=False):
+    '''
+    The uniprot dat files are parsed straight from the downloaded .dat.gz
+    files (see getDats()), so by default they are left compressed, saving
+    disk space and a full pass over the files.  gunzip=True writes
+    uncompressed dat files, which are needed to parse byte ranges of the dat
+    files in parallel or to use dat file indexes.
+    '''
+    if not gunzip:
+        print '...leaving uniprot dat files gzipped.'
+        return
     files = [
              'uniprot/uniprot_sprot.dat.gz', 
              'uniprot/uniprot_trembl.dat.gz', 
@@ -225,7 +284,7 @@ def process_uniprot_sources(ds):
 
 def process_sources(ds):
     '''
-    gunzip (and untar) some source files.
+    untar (and gunzip) some source files.
     '''
     print 'processing sources...'
     process_taxon_sources(ds)
@@ -305,7 +364,96 @@ def extract_gene_ontology_data(ds):
 # EXTRACT FASTA FILES AND OTHER DATA FROM UNIPROT DAT FILES
 
 
-def examine_dats(ds, dats=None, surprisesFile=None, countsFile=None):
+def _getDatRanges(dats, numProcs=1):
+    '''
+    dats: a list of dat file paths.
+    numProcs: if > 1, split each dat file into DAT_RANGES_PER_PROC * numProcs
+    byte ranges, so a pool of numProcs processes can parse them in parallel.
+    returns: a list of (path, start, end) tuples, suitable for
+    uniprot.genDatEntries().  end is None for a whole file.
+    '''
+    if numProcs <= 1:
+        return [(path, 0, None) for path in dats]
+    return [(path, start, end) for path in dats for start, end in
+            uniprot.splitDat(path, DAT_RANGES_PER_PROC * numProcs)]
+
+
+def _getIndexedDatRanges(dats, genomes):
+    '''
+    dats: a list of dat file paths, each indexed by index_dats().
+    genomes: only select the 'Complete proteome' entries of these genomes.
+    returns: a list of (path, start, end) tuples of the selected entries.
+    '''
+    ranges = []
+    for path in dats:
+        index = uniprot.DatIndex(getDatIndexPath(path))
+        try:
+            pathRanges = index.ranges(taxons=genomes, flags=uniprot.COMPLETE_FLAG)
+        finally:
+            index.close()
+        print 'selected {} byte ranges from {} entries in {}'.format(len(pathRanges), len(index), path)
+        ranges.extend((path, start, end) for start, end in pathRanges)
+    return ranges
+
+
+def _checkGzippedDats(dats, numProcs=1, useIndex=False):
+    '''
+    Gzipped dat files can not be seeked into, so they can not be split into
+    byte ranges or indexed.  Warn that they will be parsed whole if numProcs
+    > 1, and fail if useIndex is True, instead of quietly losing the speedup.
+    '''
+    gzipped = [path for path in dats if uniprot.isGzipped(path)]
+    if not gzipped:
+        return
+    if useIndex:
+        raise Exception('Gzipped dat files can not be indexed.  Gunzip them to use an index.', gzipped)
+    if numProcs > 1:
+        logging.warning('Gzipped dat files are parsed whole, by one process each, not in '
+                        'parallel byte ranges.  Gunzip them to parse them in parallel: {}'.format(gzipped))
+
+
+def _partSuffix(i, numProcs=1):
+    '''
+    returns: the suffix of the part files written for the ith byte range when
+    parsing in parallel, or '' when parsing serially, to write whole files.
+    '''
+    return '.part{:05d}'.format(i) if numProcs > 1 else ''
+
+
+def _mapDatRanges(func, tasks, numProcs=1):
+    '''
+    Apply func to each task, in this process if numProcs <= 1 or in a pool of
+    numProcs processes.  func must be a module-level function.
+    yields: the result of func for each task, in the order of tasks.
+    '''
+    if numProcs <= 1:
+        for task in tasks:
+            yield func(task)
+        return
+
+    pool = multiprocessing.Pool(numProcs)
+    try:
+        for result in pool.imap(func, tasks):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def index_dats(ds, dats=None):
+    '''
+    Write an index of each dat file, recording the byte offset, length,
+    taxon, organism code, and complete and reference flags of every entry, so
+    extract_from_dats(useIndex=True) can read just the entries it needs.
+    '''
+    if not dats:
+        dats = getDats(ds)
+    for path in dats:
+        uniprot.indexDat(path, getDatIndexPath(path))
+
+
+def examine_dats(ds, dats=None, surprisesFile=None, countsFile=None, numProcs=1, spool=False, bufBytes=DAT_BUF_BYTES):
     '''
     Investigate which genomes we should include in roundup.  Gather data about
     the sequences and genomes in the dat files, primarily counts per genome of
@@ -321,6 +469,14 @@ def examine_dats(ds, dats=None, surprisesFile=None, countsFile=None):
     parser by being formed in unexpected ways.
     countsFile: where to write the count of sequences for each genome,
     including total, complete, and reference counts.
+    numProcs: if > 1, split the dat files into byte ranges and parse the
+    ranges in a pool of this many processes.
+    spool: if True, also write the fasta lines and gene data of every
+    'Complete proteome' seq to per-genome shards in the spool dir, so
+    set_genomes_from_filter() can promote the shards of the chosen genomes
+    instead of extract_from_dats() reading the dat files a second time.
+    bufBytes: when spooling, the number of bytes to buffer in memory before
+    writing to the shards.  See writerpool.WriterPool.
     '''
     if not dats:
         dats = getDats(ds)
@@ -329,50 +485,35 @@ def examine_dats(ds, dats=None, surprisesFile=None, countsFile=None):
     if not countsFile:
         countsFile = os.path.join(ds, 'dat_genome_counts.txt')
     print 'dats:', dats
+    _checkGzippedDats(dats, numProcs)
     print 'surprisesFile:', surprisesFile
     print 'countsFile:', countsFile
 
-    genomeToCount = collections.defaultdict(int) # maps each genome to the number of sequences (in the dat files) for that genome.
-    genomeToCompleteCount = collections.defaultdict(int) # track number of seqs in the Complete proteome set of an organism
-    genomeToReferenceCount = collections.defaultdict(int) # track number of seqs in the Reference proteome set of an organism
-    genomeToSprotCount = collections.defaultdict(int) # track number of seqs from Swissprot
-    genomeToTremblCount = collections.defaultdict(int) # track number of seqs from Trembl
-    genomeToNames = collections.defaultdict(set)
-    genomeToTaxons = collections.defaultdict(set)
-    genomeToOrgCodes = collections.defaultdict(set) # maps each genome to a uniprot organism (species) id code. e.g. ECOLI, HUMAN, XENTR
-
     # collect exceptions to my assumptions about dat files
     # are genes or genomes missing something they should have?
     # do genes have more than one gene name, description?
     # do genomes have more than one version of a name, a taxon, a complete status?
     allSurprises = []
 
-    for path in dats:
-        for entryNum, data in enumerate(uniprot.genDatEntries(path)):
-            ns, gene, orgCode, orgName, taxon, geneName, geneDesc, complete, reference, geneIds, goTerms, fastaLines, surprises = data
-            allSurprises.extend(surprises)
-
-            # taxon used for genome b/c orgCode can be used for multiple organisms (e.g. subspecies).
-            # orgName used for genomeName
-            assert taxon
-            genome = taxon
-
-            # Ignore "9" org code seqs b/c they are not a species or subspecies. http://www.uniprot.org/help/taxonomy
-            if orgCode[0] == '9':
-                continue
-
-            genomeToOrgCodes[genome].add(orgCode)
-            genomeToNames[genome].add(orgName)
-            genomeToTaxons[genome].add(taxon)
-            genomeToCount[genome] += 1
-            if complete:
-                genomeToCompleteCount[genome] += 1
-            if reference:
-                genomeToReferenceCount[genome] += 1
-            if ns == 'sp':
-                genomeToSprotCount[genome] += 1
-            if ns == 'tr':
-                genomeToTremblCount[genome] += 1
+    spoolDir = getSpoolDir(ds) if spool else None
+    if spool and os.path.exists(spoolDir):
+        print 'removing old spool dir...', datetime.datetime.now()
+        shutil.rmtree(spoolDir)
+    counts = _newDatCounts()
+    ranges = _getDatRanges(dats, numProcs)
+    tasks = [(datRange, spoolDir, _partSuffix(i, numProcs), bufBytes) for i, datRange in enumerate(ranges)]
+    for rangeCounts, surprises in _mapDatRanges(_examineDatRange, tasks, numProcs):
+        _mergeDatCounts(counts, rangeCounts)
+        allSurprises.extend(surprises)
+
+    genomeToCount = counts['count'] # maps each genome to the number of sequences (in the dat files) for that genome.
+    genomeToCompleteCount = counts['complete_count'] # track number of seqs in the Complete proteome set of an organism
+    genomeToReferenceCount = counts['reference_count'] # track number of seqs in the Reference proteome set of an organism
+    genomeToSprotCount = counts['sprot_count'] # track number of seqs from Swissprot
+    genomeToTremblCount = counts['trembl_count'] # track number of seqs from Trembl
+    genomeToNames = counts['names']
+    genomeToTaxons = counts['taxons']
+    genomeToOrgCodes = counts['org_codes'] # maps each genome to a uniprot organism (species) id code. e.g. ECOLI, HUMAN, XENTR
 
     countList = []
     countData = {}
@@ -413,10 +554,96 @@ def examine_dats(ds, dats=None, surprisesFile=None, countsFile=None):
 
     setData(ds, 'dat_surprises', allSurprises)
     setData(ds, 'dat_genome_counts', countData)
+    setData(ds, 'dat_spool_suffixes', [task[2] for task in tasks] if spool else None)
+    setData(ds, 'dat_spool_promoted', False)
 
     print 'all done.', datetime.datetime.now()
 
 
+def _newDatCounts():
+    '''
+    returns: a dict of the empty per-genome counts and sets gathered by
+    examine_dats.
+    '''
+    counts = {}
+    for key in ['count', 'complete_count', 'reference_count', 'sprot_count', 'trembl_count']:
+        counts[key] = collections.defaultdict(int)
+    for key in ['names', 'taxons', 'org_codes']:
+        counts[key] = collections.defaultdict(set)
+    return counts
+
+
+def _mergeDatCounts(counts, more):
+    '''
+    Add the counts and sets in more to those in counts.
+    '''
+    for key in more:
+        for genome, value in more[key].iteritems():
+            if isinstance(value, set):
+                counts[key][genome] |= value
+            else:
+                counts[key][genome] += value
+
+
+def _examineDatRange(task):
+    '''
+    task: a tuple of (datRange, spoolDir, suffix, bufBytes).  datRange is a
+      (path, start, end) tuple.  See _getDatRanges().  If spoolDir is not
+      None, the fasta lines and gene data of 'Complete proteome' seqs are
+      written to shards in spoolDir, named with suffix.  See examine_dats()
+      for bufBytes.
+    Count the sequences of every genome in a byte range of a dat file.  This
+    is a module-level function so it can be run in a multiprocessing pool.
+    returns: a tuple of the counts (see _newDatCounts()) and a list of
+    surprises.
+    '''
+    (path, start, end), spoolDir, suffix, bufBytes = task
+    counts = _newDatCounts()
+    allSurprises = []
+    with writerpool.WriterPool(bufBytes) as pool:
+        for data in uniprot.genDatEntries(path, start, end):
+            _examineDatEntry(data, counts, allSurprises, spoolDir, suffix, pool)
+    return counts, allSurprises
+
+
+def _examineDatEntry(data, counts, allSurprises, spoolDir, suffix, pool):
+    '''
+    Count a dat entry and spool it to pool, if spoolDir is not None.  See
+    _examineDatRange().
+    '''
+    ns, gene, orgCode, orgName, taxon, geneName, geneDesc, complete, reference, geneIds, goTerms, fastaLines, surprises = data
+    allSurprises.extend(surprises)
+
+    # taxon used for genome b/c orgCode can be used for multiple organisms (e.g. subspecies).
+    # orgName used for genomeName
+    assert taxon
+    genome = taxon
+
+    # Ignore "9" org code seqs b/c they are not a species or subspecies. http://www.uniprot.org/help/taxonomy
+    if orgCode[0] == '9':
+        return
+
+    counts['org_codes'][genome].add(orgCode)
+    counts['names'][genome].add(orgName)
+    counts['taxons'][genome].add(taxon)
+    counts['count'][genome] += 1
+    if complete:
+        counts['complete_count'][genome] += 1
+    if reference:
+        counts['reference_count'][genome] += 1
+    if ns == 'sp':
+        counts['sprot_count'][genome] += 1
+    if ns == 'tr':
+        counts['trembl_count'][genome] += 1
+
+    if spoolDir and complete:
+        if counts['complete_count'][genome] == 1: # first spooled seq of genome in this range
+            makeGenomeSpoolDir(spoolDir, genome)
+        shardPath = os.path.join(spoolDir, genome, genome)
+        pool.writelines(shardPath + '.faa' + suffix, fastaLines)
+        pool.write(shardPath + '.genes' + suffix, genesLine(gene, geneName, geneDesc, geneIds, goTerms))
+
+
 def set_genomes_from_filter(ds):
     '''
     Set the genomes to be ones that:
@@ -454,6 +681,114 @@ def set_genomes_from_filter(ds):
     print 'after_taxon_category_filter', len(genomes3)
     setGenomes(ds, genomes3)
 
+    if getData(ds, 'dat_spool_suffixes'):
+        promoteSpooledGenomes(ds, genomes3)
+
+
+def promoteSpooledGenomes(ds, genomes):
+    '''
+    Promote the spooled shards of genomes, written by examine_dats(), to
+    genome fasta files and gene metadata, and discard the shards of every
+    other genome.  This does the work of extract_from_dats() without reading
+    the dat files again.
+    '''
+    spoolDir = getSpoolDir(ds)
+    suffixes = getData(ds, 'dat_spool_suffixes')
+    countData = getData(ds, 'dat_genome_counts')
+    genomeToCount = {g: countData[g]['complete_count'] for g in genomes}
+    genomeToOrgCode = {g: countData[g]['org_code'] for g in genomes}
+
+    print 'promoting spooled shards of {} genomes...'.format(len(genomes)), datetime.datetime.now()
+    genomeToGenesPaths = {}
+    for genome in genomes:
+        makeGenomeDir(ds, genome)
+        shardPath = os.path.join(spoolDir, genome, genome)
+        joinParts(getGenomeFastaPath(ds, genome), [shardPath + '.faa' + suffix for suffix in suffixes])
+        genomeToGenesPaths[genome] = [shardPath + '.genes' + suffix for suffix in suffixes]
+
+    print 'updating metadata...', datetime.datetime.now()
+    setGeneDataFromFiles(ds, genomeToGenesPaths)
+
+    print 'discarding spool dir...', datetime.datetime.now()
+    shutil.rmtree(spoolDir)
+
+    setData(ds, 'genomeToCount', genomeToCount)
+    setData(ds, 'genomeToOrgCode', genomeToOrgCode)
+    setData(ds, 'dat_spool_suffixes', None)
+    setData(ds, 'dat_spool_promoted', True)
+    print 'all done.', datetime.datetime.now()
+
+
+def makeGenomeSpoolDir(spoolDir, genome):
+    '''
+    Make the dir in spoolDir for the shards of genome, if it is missing.
+    '''
+    genomeDir = os.path.join(spoolDir, genome)
+    try:
+        os.makedirs(genomeDir, DIR_MODE)
+    except OSError:
+        # another process parsing another byte range may have made it.
+        if not os.path.isdir(genomeDir):
+            raise
+
+
+def genesLine(gene, geneName, geneDesc, geneIds, goTerms):
+    '''
+    returns: a line of json encoding the data of gene, as written to the files
+    read by setGeneDataFromFiles().
+    '''
+    return json.dumps([gene, geneName, geneDesc, geneIds, goTerms]) + '\n'
+
+
+def setGeneDataFromFiles(ds, genomeToPaths):
+    '''
+    genomeToPaths: a dict from genome to a list of files of the gene data of
+    the genome, made by genesLine().  Missing files are skipped.
+    Set the gene metadata (geneToGenome, geneToName, geneToDesc,
+    geneToGeneIds, geneToGoTerms and genomeToGenes) from the files, streaming
+    it to the metadata files and the gene table one genome at a time, so
+    memory use does not grow with the number of genes in the dataset.  The
+    files are removed.
+    '''
+    keys = [GENE_TO_GENOME, GENE_TO_NAME, GENE_TO_DESC, GENE_TO_GENE_IDS,
+            GENE_TO_GO_TERMS, GENOME_TO_GENES]
+    writers = {}
+    tableWriter = None
+    try:
+        for key in keys:
+            writers[key] = DataWriter(ds, key)
+        tableWriter = genetable.GeneTableWriter(getGeneTablePath(ds))
+        for genome in sorted(genomeToPaths):
+            tableWriter.addGenome(genome)
+            genes = []
+            for path in genomeToPaths[genome]:
+                if not os.path.exists(path):
+                    continue
+                with open(path) as fh:
+                    for line in fh:
+                        gene, geneName, geneDesc, geneIds, goTerms = json.loads(line)
+                        writers[GENE_TO_GENOME].write(gene, genome)
+                        writers[GENE_TO_NAME].write(gene, geneName)
+                        writers[GENE_TO_DESC].write(gene, geneDesc)
+                        writers[GENE_TO_GENE_IDS].write(gene, geneIds)
+                        writers[GENE_TO_GO_TERMS].write(gene, goTerms)
+                        tableWriter.addGene(gene, geneName, geneDesc, geneIds, goTerms)
+                        genes.append(gene)
+            writers[GENOME_TO_GENES].write(genome, genes)
+    except:
+        for writer in writers.values():
+            writer.abort()
+        if tableWriter:
+            tableWriter.abort()
+        raise
+    for key in keys:
+        writers[key].close()
+    tableWriter.close()
+    for paths in genomeToPaths.values():
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
 
 def make_genome_to_name(ds):
     '''
@@ -479,7 +814,7 @@ def make_genome_to_taxon(ds):
     setGenomeToTaxon(ds, genomeToTaxon)
 
 
-def extract_from_dats(ds, dats=None, writing=True, cleanDirs=False, bufSize=5000000):
+def extract_from_dats(ds, dats=None, writing=True, cleanDirs=False, bufBytes=DAT_BUF_BYTES, numProcs=1, useIndex=False):
     '''
     Gather data about each 'Complete proteome' sequence, including name, description, go terms, ncbi gene ids.  Gather data about each
     associated genome, including name, ncbi taxon id, and sequence counts.  Create fasta files containing the seqs, one for each genome,
@@ -489,35 +824,28 @@ def extract_from_dats(ds, dats=None, writing=True, cleanDirs=False, bufSize=5000
     dats: a list of dat file paths.  Defaults to the dat files in the dataset.
     writing: debugging. if False, fasta files will not be writen. Useful for debugging
     cleanDirs: optimization.  if True, all fasta files in the dataset will be removed before splitting the genomes, which takes time.
-    bufSize: number of fasta sequence to cache in memory before writing to files.  this is to avoid writing frequently to
-      files, b/c opening and closing files on Isilon fileserver is slow.
+    bufBytes: number of bytes of fasta and gene data to cache in memory before writing to files.  Files are kept open
+      between writes, b/c opening and closing files on Isilon fileserver is slow.  See writerpool.WriterPool.
+    numProcs: if > 1, split the dat files into byte ranges and parse the ranges in a pool of this many processes.  Each range
+      is written to its own part file for each genome and the parts are concatenated in order when all ranges are done.
+    useIndex: if True, use the dat file indexes written by index_dats() to read only the entries of the genomes, instead of
+      scanning the whole dat files.
     '''
 
+    if getData(ds, 'dat_spool_promoted'):
+        print 'skipping extract_from_dats because spooled genomes were already promoted.'
+        return
+
     if not dats:
         dats = getDats(ds)
     print 'dats:', dats
+    _checkGzippedDats(dats, numProcs, useIndex)
             
     # remove any pre-existing genomes.
     if cleanDirs:
         print 'cleaning genomes directory...', datetime.datetime.now()
         cleanGenomes(ds)
 
-    # helper function to write fasta lines to a genome file.
-    writeGenomes = set() # track which genomes we have already seen
-    def writeToGenome(genome, data):
-        ''' data: a list of fasta lines, including newlines '''
-        if not writing: # speed performance when not testing behavior that does not involve writing fasta
-            return        
-        if genome not in writeGenomes: # first time writing to the genome
-            makeGenomeDir(ds, genome) # make genome dir if missing
-            mode = 'w'
-            writeGenomes.add(genome)
-        else:
-            mode = 'a'
-        with open(getGenomeFastaPath(ds, genome), mode) as outfh:
-            output = ''.join(data)
-            outfh.write(output)
-
     # use count data to avoid rescanning dat files.
     countData = getData(ds, 'dat_genome_counts')
     genomes = getGenomes(ds)
@@ -528,60 +856,31 @@ def extract_from_dats(ds, dats=None, writing=True, cleanDirs=False, bufSize=5000
     for g in genomes:
         assert countData[g]['num_names'] == 1 and countData[g]['num_taxons'] == 1 and countData[g]['num_org_codes'] == 1
 
-    geneToGenome = {} # track which sequences belong to which genome.  store sequences of all complete genomes
-    geneToName = {}
-    geneToDesc = {}
-    geneToGeneIds = {}
-    geneToGoTerms = {}
-    genomeToGenes = collections.defaultdict(list)
-    genomeToLines = collections.defaultdict(list) # buffer fasta sequence lines for output
-
     # Pass 2: collect data about genes and genomes, but only for genomes that are not too small.
-    for path in dats:
-        for entryNum, data in enumerate(uniprot.genDatEntries(path)):
-            ns, gene, orgCode, orgName, taxon, geneName, geneDesc, complete, reference, geneIds, goTerms, fastaLines, surprises = data
-
-            # taxon used for genome b/c orgCode can be used for multiple organisms (e.g. subspecies).
-            genome = taxon
-
-            # Ignore "9" org code seqs b/c they are not a species or subspecies. http://www.uniprot.org/help/taxonomy
-            # Ignore seqs not marked "Complete proteome"
-            # Ignore seqs from too small genomes
-            if orgCode[0] == '9' or not complete or genome not in genomeToCount:
-                continue
-            
-            geneToGenome[gene] = genome
-            geneToName[gene] = geneName
-            geneToDesc[gene] = geneDesc
-            geneToGeneIds[gene] = geneIds
-            geneToGoTerms[gene] = goTerms
-            genomeToGenes[genome].append(gene)
-            genomeToLines[genome].extend(fastaLines)
-
-            # collect fasta lines for writing to fasta files
-            if entryNum % bufSize == 0:
-                # write out collected lines to the various genome fasta files
-                print 'writing collected lines to fasta files for {} genomes...'.format(len(genomeToLines)), datetime.datetime.now()
-                for genome in genomeToLines:
-                    writeToGenome(genome, genomeToLines[genome])
-                genomeToLines.clear()
-                print 'collecting more lines...', datetime.datetime.now()
-
-        # done with path.
-        # write out collected lines to the various genome fasta files
-        print 'finishing writing collected lines to fasta files for {} genomes...'.format(len(genomeToLines)), datetime.datetime.now()
-        for genome in genomeToLines:
-            writeToGenome(genome, genomeToLines[genome])
-        genomeToLines.clear()
-        print 'done writing collected lines.', datetime.datetime.now()
+    # Serially, every genome fasta file is written directly.  In parallel,
+    # each byte range writes its own part files, which are joined afterwards.
+    # Gene data is written to files alongside the fasta files, and streamed
+    # into the gene metadata afterwards, instead of being kept in memory.
+    if useIndex:
+        ranges = _getIndexedDatRanges(dats, genomeToCount)
+        rangeGroups = list(util.splitIntoN(ranges, DAT_RANGES_PER_PROC * numProcs)) if numProcs > 1 else [ranges]
+    else:
+        ranges = _getDatRanges(dats, numProcs)
+        rangeGroups = [[datRange] for datRange in ranges] if numProcs > 1 else [ranges]
+    tasks = [(ds, group, genomeToCount, _partSuffix(i, numProcs), writing, bufBytes) for i, group in enumerate(rangeGroups)]
+    partSuffixes = [task[3] for task in tasks]
+    extractedGenomes = set() # genomes with at least one seq
+    for rangeGenomes in _mapDatRanges(_extractDatRanges, tasks, numProcs):
+        extractedGenomes.update(rangeGenomes)
+
+    if writing and numProcs > 1:
+        print 'joining fasta part files for {} genomes...'.format(len(extractedGenomes)), datetime.datetime.now()
+        for genome in extractedGenomes:
+            joinGenomeFastaParts(ds, genome, partSuffixes)
 
     print 'updating metadata...', datetime.datetime.now()
-    setData(ds, GENE_TO_GO_TERMS, geneToGoTerms)
-    setData(ds, GENE_TO_GENE_IDS, geneToGeneIds)
-    setData(ds, GENE_TO_NAME, geneToName)
-    setData(ds, GENE_TO_DESC, geneToDesc)
-    setData(ds, GENE_TO_GENOME, geneToGenome)
-    setData(ds, GENOME_TO_GENES, genomeToGenes)
+    setGeneDataFromFiles(ds, {genome: [getGenomeGenesPath(ds, genome) + suffix for suffix in partSuffixes]
+                              for genome in extractedGenomes})
     setGenomes(ds)
     setData(ds, 'genomeToCount', genomeToCount)
     setData(ds, 'genomeToOrgCode', genomeToOrgCode)
@@ -589,6 +888,76 @@ def extract_from_dats(ds, dats=None, writing=True, cleanDirs=False, bufSize=5000
     print 'all done.', datetime.datetime.now()
 
 
+def _extractDatRanges(task):
+    '''
+    task: a tuple of (ds, datRanges, genomes, suffix, writing, bufBytes).
+      datRanges is a list of (path, start, end) tuples.  See _getDatRanges().
+      Only 'Complete proteome' seqs of genomes are extracted.  Fasta lines are
+      written to the genome fasta path plus suffix and gene data to the
+      genome genes path plus suffix.  See extract_from_dats() for writing and
+      bufBytes.
+    Extract the fasta lines and gene data of the sequences in some byte ranges
+    of the dat files.  This is a module-level function so it can be run in a
+    multiprocessing pool.
+    returns: a list of the genomes with at least one sequence.
+    '''
+    ds, datRanges, genomes, suffix, writing, bufBytes = task
+
+    genomeToPaths = {} # the genes and fasta paths of each genome seen so far
+    with writerpool.WriterPool(bufBytes) as pool:
+        for path, pathRanges in itertools.groupby(datRanges, key=lambda datRange: datRange[0]):
+            pathRanges = [(start, end) for p, start, end in pathRanges]
+            for data in uniprot.genDatEntriesAt(path, pathRanges):
+                ns, gene, orgCode, orgName, taxon, geneName, geneDesc, complete, reference, geneIds, goTerms, fastaLines, surprises = data
+
+                # taxon used for genome b/c orgCode can be used for multiple organisms (e.g. subspecies).
+                genome = taxon
+
+                # Ignore "9" org code seqs b/c they are not a species or subspecies. http://www.uniprot.org/help/taxonomy
+                # Ignore seqs not marked "Complete proteome"
+                # Ignore seqs from too small genomes
+                if orgCode[0] == '9' or not complete or genome not in genomes:
+                    continue
+
+                if genome not in genomeToPaths: # first time writing to the genome
+                    makeGenomeDir(ds, genome) # make genome dir if missing
+                    genomeToPaths[genome] = (getGenomeGenesPath(ds, genome) + suffix,
+                                             getGenomeFastaPath(ds, genome) + suffix)
+                genesPath, fastaPath = genomeToPaths[genome]
+                pool.write(genesPath, genesLine(gene, geneName, geneDesc, geneIds, goTerms))
+                if writing: # speed performance when not testing behavior that does not involve writing fasta
+                    pool.writelines(fastaPath, fastaLines)
+
+    return sorted(genomeToPaths)
+
+
+def joinGenomeFastaParts(ds, genome, suffixes):
+    '''
+    Concatenate the fasta part files of genome, in the order of suffixes, into
+    the genome fasta file and remove the part files.
+    '''
+    fastaPath = getGenomeFastaPath(ds, genome)
+    joinParts(fastaPath, [fastaPath + suffix for suffix in suffixes])
+
+
+def joinParts(path, partPaths):
+    '''
+    Concatenate the files in partPaths, in order, into path and remove them.
+    Missing parts (e.g. byte ranges without any seqs for a genome) are
+    skipped.  A lone part is simply renamed.
+    '''
+    partPaths = [p for p in partPaths if os.path.exists(p)]
+    if len(partPaths) == 1:
+        os.rename(partPaths[0], path)
+        return
+    with open(path, 'w') as outfh:
+        for partPath in partPaths:
+            with open(partPath) as infh:
+                shutil.copyfileobj(infh, outfh)
+    for partPath in partPaths:
+        os.remove(partPath)
+
+
 def updateGenomeCounts(ds):
     '''
     Update dataset metadata with the sequence count of each genome fasta file.
@@ -603,7 +972,8 @@ def updateGenomeCounts(ds):
 
 def format_genomes(ds):
     '''
-    Format genomes for blast, distributing the formatting via LSF.
+    Format genomes for blast, distributing the formatting via LSF, or the
+    lsfdo executor chosen by the environment.
     ds: dataset for which to format genomes
     '''
     print 'formatting genomes. {}'.format(ds)
@@ -611,11 +981,17 @@ def format_genomes(ds):
     genomes = getGenomes(ds)
     # Since the Orchestra LSF queues require jobs of a certain length, format a
     # batch of genomes as a single job.
+    batches = list(util.groupsOfN(genomes, 10))
     tasks = [lsfdo.FuncNameTask('format_some_genomes_{}'.format(i),
                                 'roundup.dataset.format_some_genomes',
                                 [ds, some])
-             for i, some in enumerate(util.groupsOfN(genomes, 10))]
-    opts = [['-q', 'short', '-W', '60'] for task in tasks]
+             for i, some in enumerate(batches)]
+    # formatting a genome reads it into memory, so reserve enough for the
+    # biggest genome of each batch.
+    genomeToBytes = dict((g, os.path.getsize(getGenomeFastaPath(ds, g))) for g in genomes)
+    opts = [FORMAT_JOB_OPTS + lsf.makeResourceOptions(
+                memMB=JOB_BASE_MEM_MB + 2 * max(genomeToBytes[g] for g in batch) / 2.0**20)
+            for batch in batches]
     lsfdo.bsubmany(ns, tasks, opts)
 
 
@@ -628,6 +1004,8 @@ def format_genome(ds, genome):
     fastaPath = getGenomeFastaPath(ds, genome)
     print 'format {}'.format(genome)
     rsd.formatForBlast(fastaPath)
+    # compute the checksum now, in parallel, for carry_over_orthologs.
+    getGenomeChecksum(ds, genome)
 
 
 #############################################
@@ -651,39 +1029,51 @@ def extract_performance_stats(ds, pairs=None):
     '''
     pairs: default is to collect stats for all pairs.  It can be useful for testing to set pairs to a specific list of pairs.
     times are in seconds.
+    Streams the stats from the database in one pass over the blast stats and
+    one over the rsd stats.  Pairs missing stats are skipped.  Percentiles of
+    pair times are approximated in bounded memory.  See util.LogHistogram.
     '''
     blastStats = {}
     rsdStats = {}
     totalTime = 0
     totalRsdTime = 0
     totalBlastTime = 0
+    pairTimes = util.LogHistogram()
 
-    if pairs is None:
-        pairs = getPairs(ds)
+    if pairs is not None:
+        pairs = set(tuple(pair) for pair in pairs)
 
     def elapsedTime(stats):
         return stats['endTime'] - stats['startTime']
 
     with statsCM(ds) as stats:
-        for qdb, sdb in pairs:
-            forwardTime = elapsedTime(stats.getBlast(qdb, sdb))
-            reverseTime = elapsedTime(stats.getBlast(sdb, qdb))
-            rsdTime = elapsedTime(stats.getRsd(qdb, sdb))
-
-            blastStats[json.dumps((qdb, sdb))] = forwardTime
-            blastStats[json.dumps((sdb, qdb))] = reverseTime
-            rsdStats[json.dumps((qdb, sdb))] = rsdTime
+        for (kind, qdb, sdb), blast in stats.scan('blast'):
+            if pairs is None or tuple(sorted((qdb, sdb))) in pairs:
+                blastStats[json.dumps((qdb, sdb))] = elapsedTime(blast)
+        for (kind, qdb, sdb), rsd in stats.scan('rsd'):
+            keys = [json.dumps((qdb, sdb)), json.dumps((sdb, qdb))]
+            if (pairs is not None and (qdb, sdb) not in pairs) or not all(k in blastStats for k in keys):
+                continue
+            forwardTime = blastStats[keys[0]]
+            reverseTime = blastStats[keys[1]]
+            rsdTime = elapsedTime(rsd)
+            rsdStats[keys[0]] = rsdTime
 
             totalTime += forwardTime + reverseTime + rsdTime
             totalBlastTime += forwardTime + reverseTime
             totalRsdTime += rsdTime
+            pairTimes.add(forwardTime + reverseTime + rsdTime)
 
+    print 'pairs with stats:', len(rsdStats)
     print 'total time:', totalTime
     print 'total blast time:', totalBlastTime
     print 'total rsd time:', totalRsdTime
+    percentiles = dict((str(p), pairTimes.percentile(p)) for p in PERFORMANCE_PERCENTILES)
+    print 'pair time percentiles:', ', '.join('{}%: {}'.format(p, percentiles[str(p)]) for p in PERFORMANCE_PERCENTILES)
     print 'saving stats'
     setData(ds, BLAST_STATS, blastStats)
     setData(ds, RSD_STATS, rsdStats)
+    setData(ds, 'pair_time_percentiles', percentiles)
 
 
 def make_change_log(ds, others):
@@ -1061,9 +1451,31 @@ def getDownloadDir(ds):
     return os.path.join(ds, 'download')
 
 
+def getDatIndexPath(datPath):
+    '''
+    location of the index of a dat file.  See index_dats().
+    '''
+    return datPath + '.idx'
+
+
+def getSpoolDir(ds):
+    '''
+    Where examine_dats() spools per-genome shards of fasta lines and gene data.
+    '''
+    return os.path.join(ds, 'spool')
+
+
 def getDats(ds):
+    '''
+    returns: the paths of the uniprot dat files, preferring the uncompressed
+    files if they exist and otherwise the gzipped ones.
+    '''
     sourcesDir = getSourcesDir(ds)
-    return [os.path.join(sourcesDir, 'uniprot', f) for f in ['uniprot_sprot.dat', 'uniprot_trembl.dat']]
+    dats = []
+    for f in ['uniprot_sprot.dat', 'uniprot_trembl.dat']:
+        path = os.path.join(sourcesDir, 'uniprot', f)
+        dats.append(path if os.path.exists(path) else path + '.gz')
+    return dats
 
 
 ###################
@@ -1121,63 +1533,468 @@ def cleanGenomes(ds):
 
 
 
+###############################
+# CARRY OVER UNCHANGED ORTHOLOGS
+
+def carry_over_orthologs(ds, previousDs):
+    '''
+    Copy the orthologs of every pair of genomes whose fasta files are
+    unchanged since previousDs from the orthologs files of previousDs to an
+    orthologs file of ds, so only pairs with a new or changed genome are
+    computed.  Pairs of unchanged genomes without orthologs for every
+    divergence and evalue in previousDs are computed too.
+    See getPairsToCompute().
+    '''
+    unchanged = set(getUnchangedGenomes(ds, previousDs))
+    print 'unchanged genomes: {} of {}'.format(len(unchanged), len(getGenomes(ds)))
+    divEvalues = set(roundup_common.divEvalues())
+    missing = set(getPairs(ds, sorted(unchanged)))
+    numUnchangedPairs = len(missing)
+    path = getCarriedOverOrthologsPath(ds)
+    with open(path + '.tmp', 'w') as fh:
+        for orthFile in sorted(getOrthologsFiles(previousDs)):
+            print datetime.datetime.now(), 'carrying over orthologs from', orthFile
+            # the orthologs of a pair are together in a file.
+            pairOrthDatas = itertools.groupby(orthutil.orthDatasFromFileGen(orthFile),
+                                              key=lambda orthData: tuple(orthData[0][:2]))
+            for pair, orthDatas in pairOrthDatas:
+                if pair not in missing:
+                    continue
+                orthDatas = [orthData for orthData in orthDatas if tuple(orthData[0][2:]) in divEvalues]
+                if set(tuple(orthData[0][2:]) for orthData in orthDatas) == divEvalues:
+                    orthutil.orthDatasToStream(orthDatas, fh)
+                    missing.discard(pair)
+    os.rename(path + '.tmp', path)
+    print 'carried over pairs: {}. missing pairs: {}'.format(
+        numUnchangedPairs - len(missing), len(missing))
+    setData(ds, 'unchanged_genomes', sorted(unchanged))
+    setData(ds, 'missing_carried_over_pairs', sorted(missing))
+
+
+def getUnchangedGenomes(ds, previousDs):
+    '''
+    returns: a sorted list of the genomes of ds in previousDs whose fasta
+    files have the same checksum in both.  previousDs is not modified.
+    '''
+    previousGenomes = set(getGenomes(previousDs))
+    return sorted(genome for genome in getGenomes(ds) if genome in previousGenomes and
+                  getGenomeChecksum(ds, genome) == getGenomeChecksum(previousDs, genome, save=False))
+
+
+def getPairsToCompute(ds):
+    '''
+    returns: a sorted list of the pairs of ds whose orthologs were not carried
+    over from a previous dataset by carry_over_orthologs.
+    '''
+    unchanged = set(getData(ds, 'unchanged_genomes', []))
+    missing = set(tuple(pair) for pair in getData(ds, 'missing_carried_over_pairs', []))
+    return [pair for pair in getPairs(ds) if
+            not (pair[0] in unchanged and pair[1] in unchanged) or pair in missing]
+
+
+def getCarriedOverOrthologsPath(ds):
+    return os.path.join(getOrthologsDir(ds), 'carried_over.orthologs.txt')
+
+
 ###############################
 # RUN ORTHOLOG COMPUTATION JOBS
 
-def prepare_jobs(ds, numJobs=DEFAULT_NUM_JOBS, pairs=None):
+def prepare_jobs(ds, numJobs=DEFAULT_NUM_JOBS, pairs=None, previousDs=None, jobSeconds=None, pairQueue=None,
+                 batchBlast=False, hitsCacheDir=None):
     '''
     ds: dataset to ready to compute pairs
     numJobs: split pairs into this many jobs.  More jobs = shorter jobs, better parallelism.
       Fewer jobs = fewer dirs and files to make isilon run slowly and overload lsf queue.
       Recommendation: <= 10000.
-    pairs: If None, compute orthologs for all pairs of genomes.  If not None, only compute these pairs.  useful for testing.  
+    pairs: If None, compute orthologs for all pairs of genomes, except those
+      carried over from a previous dataset (see getPairsToCompute).  If not
+      None, only compute these pairs.  useful for testing.
+    previousDs: a dataset whose performance stats are used to estimate the
+      running time of pairs.  See estimatePairCosts().
+    jobSeconds: if not None and pair running times can be estimated from
+      previousDs, use as many jobs as needed for each job to run for about this
+      many seconds, instead of numJobs.
+    pairQueue: if not None, the backend of a queue of pairs, 'mysql' or
+      'sqlite' (see PAIR_QUEUE_BACKENDS), from which jobs claim pairs until it
+      is empty, instead of each job computing a fixed list of pairs.  Sqlite
+      locking is unreliable on network filesystems, so only use 'sqlite' when
+      the jobs run on this machine, e.g. with the local lsfdo executor.
+    batchBlast: if True, jobs blast each of their genomes against all the
+      genomes it is paired with at once.  See blastJobGenomes().  Ignored by
+      jobs claiming pairs from a pair queue.  The e-values of batch blast hits
+      only approximate those of blasting each pair, so the orthologs can
+      differ slightly.  See computeBatchBlastHits().  Off by default.
+    hitsCacheDir: if not None, blast hits are kept in a cache in this dir,
+      using at most HITS_CACHE_BYTES, and reused instead of blasting again,
+      e.g. to compute orthologs for other divergences and evalues, or for
+      genomes that have not changed since another dataset using the cache.
+      See getHitsCache().
     '''
     print 'prepare jobs for {}'.format(ds)
 
     if pairs is None:
-        pairs = getPairs(ds)
+        pairs = getPairsToCompute(ds)
     print 'pair count:', len(pairs)
 
-    # create up to N jobs for the pairs to be computed.
-    # each job contain len(pairs)/N pairs, except if N does not divide len(pairs) evenly, some jobs get an extra pair.
-    # e.g. if you had 11 pairs (1,2,3,4,5,6,7,8,9,10,11) and 3 jobs, the pairs would be split
-    # into these jobs: (1,2,3,4),(5,6,7,8),(9,10,11)
-    # Distribute pairs randomly among jobs so that each job will have about the same running time.
-    # Ideally job running time would be explictly balanced, but currently pairs are just assigned randomly.
-    random.shuffle(pairs)
-    for i, jobPairs in enumerate(util.splitIntoN(pairs, numJobs)):
+    # Balance the running time of jobs, so a few jobs full of big genomes do
+    # not run for days after the rest are done.  Pairs are packed into jobs,
+    # longest first, each into the job with the least total estimated cost.
+    costs, inSeconds = estimatePairCosts(ds, pairs, previousDs)
+    if jobSeconds and inSeconds:
+        numJobs = max(1, int(math.ceil(sum(costs) / jobSeconds)))
+    numJobs = min(numJobs, len(pairs))
+    if pairQueue:
+        # Jobs claim pairs from a shared queue, longest first, so a job that
+        # finishes its pairs early helps with the rest, instead of idling.
+        queue = makePairQueue(ds, pairQueue).reset()
+        order = sorted(range(len(pairs)), key=lambda i: costs[i], reverse=True)
+        queue.putMany([pairs[i] for i in order])
+        jobsPairs = [[] for i in range(numJobs)]
+        jobsCosts = [float(sum(costs)) / max(1, numJobs)] * numJobs
+    else:
+        # Pack groups of pairs that share genomes, so each job stages fewer
+        # genomes on the local disk of its node.
+        pairToCost = dict(zip([tuple(pair) for pair in pairs], costs))
+        groups = groupPairsByGenomes(pairs, numJobs * PAIR_GROUPS_PER_JOB)
+        # split costly groups into chunks, so jobs stay balanced.
+        maxGroupCost = float(sum(costs)) / max(1, numJobs) / PAIR_GROUPS_PER_JOB
+        groups = [chunk for group in groups for chunk in
+                  splitByCost(group, [pairToCost[tuple(pair)] for pair in group], maxGroupCost)]
+        groupCosts = [sum(pairToCost[tuple(pair)] for pair in group) for group in groups]
+        jobsGroups, jobsCosts = util.packLongestFirst(groups, groupCosts, numJobs)
+        jobsPairs = [[pair for group in jobGroups for pair in group] for jobGroups in jobsGroups]
+    print 'job count:', numJobs
+    if numJobs:
+        print 'estimated job costs{}: max {}, mean {}'.format(
+            ' (seconds)' if inSeconds else '', max(jobsCosts), sum(jobsCosts) / numJobs)
+
+    jobToCost = {}
+    for i, (jobPairs, jobCost) in enumerate(zip(jobsPairs, jobsCosts)):
         if i % 100 == 0:
             print 'preparing job', i
         job = 'job_{}'.format(i)
-        print 'job:', job
-        print 'len(jobPairs)=', len(jobPairs)
-        jobDir = getJobDir(ds, job)
-        print 'jobDir:', jobDir
         os.makedirs(getJobDir(ds, job), 0770)
         setJobPairs(ds, job, jobPairs)
+        jobToCost[job] = jobCost
+    setData(ds, 'job_costs', jobToCost)
+    setData(ds, 'job_costs_in_seconds', inSeconds)
+    setData(ds, 'pair_queue', pairQueue)
+    setData(ds, 'batch_blast', batchBlast)
+    setData(ds, 'hits_cache_dir', hitsCacheDir)
 
     refreshJobs(ds) # refresh the cached metadata
 
 
+def groupPairsByGenomes(pairs, numGroups):
+    '''
+    Group pairs into about numGroups groups, such that the pairs of a group
+    share genomes: the genomes are split into blocks, and pairs are grouped
+    by the blocks of their genomes.  e.g. 100 genomes in 10 blocks make 55
+    groups of about 100 pairs of at most 20 genomes each.
+    returns: a list of lists of pairs.
+    '''
+    genomes = sorted(set(genome for pair in pairs for genome in pair))
+    # n blocks make n * (n + 1) / 2 groups.
+    numBlocks = max(1, int(math.sqrt(2 * numGroups)))
+    blockSize = max(1, int(math.ceil(len(genomes) / float(numBlocks))))
+    genomeToBlock = dict((genome, i // blockSize) for i, genome in enumerate(genomes))
+    blocksToPairs = collections.defaultdict(list)
+    for pair in pairs:
+        blocksToPairs[tuple(sorted(genomeToBlock[genome] for genome in pair))].append(pair)
+    return [blocksToPairs[blocks] for blocks in sorted(blocksToPairs)]
+
+
+def splitByCost(items, costs, maxCost):
+    '''
+    Split items, in order, into consecutive chunks costing at most maxCost,
+    unless a single item costs more.
+    returns: a list of lists of items.
+    '''
+    chunks = [[]]
+    total = 0
+    for item, cost in zip(items, costs):
+        if chunks[-1] and total + cost > maxCost:
+            chunks.append([])
+            total = 0
+        chunks[-1].append(item)
+        total += cost
+    return chunks
+
+
+def estimatePairCosts(ds, pairs, previousDs=None):
+    '''
+    Estimate the running time of computing each pair.  The cost of a pair is
+    the product of the sequence counts of its genomes, since every sequence of
+    one genome is compared to every sequence of the other.  If ds has a runtime
+    model (see fit_runtime_model), or previousDs has performance stats for
+    some pairs (see extract_performance_stats), the costs are in seconds:
+    pairs in the stats cost what they did in previousDs, scaled by the change
+    in their genome sizes, and the cost of other pairs is predicted by the
+    model, or if there is no model, scaled by the average seconds per unit of
+    cost of the pairs in the stats.
+    returns: a list of the cost of each pair and whether the costs are in seconds.
+    '''
+    genomeToCount = getGenomeToCount(ds)
+    sizes = [float(genomeToCount.get(q, 1)) * genomeToCount.get(s, 1) for q, s in pairs]
+    model = getRuntimeModel(ds)
+    if model:
+        predicted = [model.predict_pair_cost(q, s) for q, s in pairs]
+    if not previousDs:
+        return (predicted, True) if model else (sizes, False)
+
+    blastStats = getData(previousDs, BLAST_STATS, {})
+    rsdStats = getData(previousDs, RSD_STATS, {})
+    previousToCount = getGenomeToCount(previousDs)
+    known = {} # pair index -> seconds
+    for i, (q, s) in enumerate(pairs):
+        keys = [json.dumps((q, s)), json.dumps((s, q))]
+        if keys[0] in rsdStats and all(k in blastStats for k in keys) and q in previousToCount and s in previousToCount:
+            seconds = blastStats[keys[0]] + blastStats[keys[1]] + rsdStats[keys[0]]
+            known[i] = seconds * sizes[i] / (float(previousToCount[q]) * previousToCount[s])
+    print 'pairs with performance stats in {}: {}'.format(previousDs, len(known))
+    if model:
+        return [known.get(i, cost) for i, cost in enumerate(predicted)], True
+    if not known:
+        return sizes, False
+    secondsPerSize = sum(known.values()) / sum(sizes[i] for i in known)
+    return [known.get(i, size * secondsPerSize) for i, size in enumerate(sizes)], True
+
+
+def getGenomeToResidues(ds, save=True):
+    '''
+    save: if True, cache the residue counts in the metadata of ds the first
+    time they are counted.  Use False for a dataset that should not be
+    modified, e.g. a previous dataset.
+    returns: a dict from each genome to the number of residues in its fasta
+    file.
+    '''
+    genomeToResidues = dict(getData(ds, 'genomeToResidues', {}))
+    missing = [g for g in getGenomes(ds) if g not in genomeToResidues]
+    for genome in missing:
+        with open(getGenomeFastaPath(ds, genome)) as fh:
+            genomeToResidues[genome] = sum(len(line.strip()) for line in fh if not line.startswith('>'))
+    if missing and save:
+        setData(ds, 'genomeToResidues', genomeToResidues)
+    return genomeToResidues
+
+
+def getGenomeToSize(ds, save=True):
+    '''
+    save: see getGenomeToResidues().
+    returns: a dict from each genome to its size, a tuple of the number of
+    sequences and residues in the genome, as used by roundup.costmodel.
+    '''
+    genomeToCount = getGenomeToCount(ds)
+    genomeToResidues = getGenomeToResidues(ds, save=save)
+    return {g: (genomeToCount[g], genomeToResidues[g]) for g in genomeToResidues if g in genomeToCount}
+
+
+def genPairSeconds(ds):
+    '''
+    Yield the running time of every pair of ds that has performance stats:
+    from the metadata made by extract_performance_stats, or if there is none,
+    from the stats database, skipping pairs that have not been computed.
+    yields: (qdb, sdb, seconds) tuples.
+    '''
+    blastStats = getData(ds, BLAST_STATS)
+    rsdStats = getData(ds, RSD_STATS)
+    if blastStats is not None and rsdStats is not None:
+        for key, rsdTime in rsdStats.iteritems():
+            qdb, sdb = json.loads(key)
+            keys = [json.dumps((qdb, sdb)), json.dumps((sdb, qdb))]
+            if all(k in blastStats for k in keys):
+                yield qdb, sdb, blastStats[keys[0]] + blastStats[keys[1]] + rsdTime
+        return
+
+    def elapsedTime(stats):
+        return stats['endTime'] - stats['startTime']
+
+    with statsCM(ds) as stats:
+        for qdb, sdb, forward, reverse, rsd in genPairStats(stats, getPairs(ds)):
+            allStats = [forward, reverse, rsd]
+            if all(allStats):
+                yield qdb, sdb, sum(elapsedTime(s) for s in allStats)
+
+
+def genPairStats(stats, pairs, batchSize=1000):
+    '''
+    Get the stats of pairs in batches of batchSize pairs, instead of one query
+    per stat.
+    stats: a Stats object.
+    yields: (qdb, sdb, forward blast stats, reverse blast stats, rsd stats)
+    tuples, with an empty dict for missing stats.
+    '''
+    for i in range(0, len(pairs), batchSize):
+        batch = pairs[i:i + batchSize]
+        keys = [key for qdb, sdb in batch for key in [('blast', qdb, sdb), ('blast', sdb, qdb), ('rsd', qdb, sdb)]]
+        values = stats.getMany(keys)
+        for j, (qdb, sdb) in enumerate(batch):
+            yield (qdb, sdb) + tuple(values[3 * j:3 * j + 3])
+
+
+def fit_runtime_model(ds, previous_datasets):
+    '''
+    Fit a model of the running time of computing a pair of genomes to the
+    running times and genome sizes of the pairs in previous_datasets, and save
+    it in the metadata of ds.  See roundup.costmodel.  The previous datasets
+    are not modified.  If they have no performance stats, no model is saved,
+    and the costs of pairs are estimated without one (see estimatePairCosts).
+    returns: the model, or None if there was nothing to fit it to.
+    '''
+    def genSamples():
+        for other in previous_datasets:
+            genomeToSize = getGenomeToSize(other, save=False)
+            for qdb, sdb, seconds in genPairSeconds(other):
+                if qdb in genomeToSize and sdb in genomeToSize:
+                    yield genomeToSize[qdb], genomeToSize[sdb], seconds
+
+    try:
+        model = costmodel.fitModel(genSamples())
+    except costmodel.NoSamplesError:
+        print 'no performance stats in {} to fit a runtime model to.'.format(previous_datasets)
+        return None
+    print 'fit runtime model to {} pairs. r2 of log(seconds): {}'.format(model.numSamples, model.r2)
+    setData(ds, 'runtime_model', model.toData())
+    return getRuntimeModel(ds)
+
+
+def getRuntimeModel(ds):
+    '''
+    returns: the runtime model of ds, which predicts the running time of its
+    pairs with predict_pair_cost(qdb, sdb), or None if it has no model.
+    '''
+    data = getData(ds, 'runtime_model')
+    return costmodel.modelFromData(data, getGenomeToSize(ds)) if data else None
+
 
 def compute_jobs(ds):
     '''
     Submit all incomplete and non-running jobs to lsf, so they can compute
-    their respective pairs.
+    their respective pairs.  With a local lsfdo executor (see workflow), the
+    jobs are run on this machine and this waits for them to finish.
+    '''
+    ns = getComputeJobsNs(ds)
+    tasks, opts = getComputeJobTasks(ds)
+    # submit jobs with the same options as a job array, with one bsub.
+    lsfdo.bsubmany(ns, tasks, opts, timeout=0, array=True)
+
+
+def getComputeJobTasks(ds):
+    '''
+    returns: a list of the lsfdo task of every job of ds, and a list of the
+    lsf options of each task.
     '''
     # a job is a name of a directory and a set of genome pairs for ortholog computation.
     jobs = sorted(getJobs(ds))
 
     # create a "task" to run on lsf for each job
-    dsid = getDatasetId(ds)
-    ns = 'roundup_dataset_{}_compute_jobs'.format(dsid)
-    names = ['roundup_compute_job_{}_{}'.format(dsid, job) for job in jobs]
-    opts = [['-R', 'rusage[tmp=500]', '-q', 'long', '-W', '720:0'] for job in
-            jobs]
+    names = [getComputeJobTaskName(ds, job) for job in jobs]
+    opts = getJobResourceOpts(ds, jobs)
     tasks = [lsfdo.FuncNameTask(name, 'roundup.dataset.compute_job', [ds, job])
              for name, job in zip(names, jobs)]
+    return tasks, opts
+
+
+def getComputeJobsNs(ds):
+    return 'roundup_dataset_{}_compute_jobs'.format(getDatasetId(ds))
+
 
-    lsfdo.bsubmany(ns, tasks, opts, timeout=0)
+def getComputeJobTaskName(ds, job):
+    return 'roundup_compute_job_{}_{}'.format(getDatasetId(ds), job)
+
+
+def getJobQueueOpts(ds, job):
+    '''
+    returns: the lsf options for the queue and run time limit of job.  Jobs
+    predicted to finish well within the limit of the short queue use it,
+    since it schedules jobs sooner.  Other jobs use the long queue.  The run
+    time limit of a job with a predicted running time is a safe multiple of
+    it, since lsf schedules jobs with shorter limits sooner.
+    '''
+    seconds = getData(ds, 'job_costs', {}).get(job)
+    if not getData(ds, 'job_costs_in_seconds') or seconds is None:
+        return lsf.makeResourceOptions(queue='long', seconds=LONG_QUEUE_SECONDS)
+    # whole hours, so many jobs share options and are submitted in one array.
+    limit = 3600 * max(1, math.ceil(seconds * JOB_SECONDS_SAFETY_FACTOR / 3600.0))
+    if limit < SHORT_QUEUE_SECONDS:
+        return lsf.makeResourceOptions(queue='short', seconds=limit)
+    else:
+        return lsf.makeResourceOptions(queue='long', seconds=min(limit, LONG_QUEUE_SECONDS))
+
+
+def getJobResourceOpts(ds, jobs):
+    '''
+    Reserve the local disk and memory each job needs, from the sizes of its
+    genomes: the local disk for the genomes staged for blast (up to the quota
+    of the stage cache) and the blast hits of its pairs, and the memory for
+    its biggest pair.  Jobs of a pair queue can claim any pair, so they
+    reserve enough for every pair.  Reservations are rounded up to powers of
+    two megabytes, so many jobs share options and are submitted in one array.
+    returns: a list of the lsf options of each job in jobs, including those
+    of getJobQueueOpts.
+    '''
+    genomeToSize = getGenomeToSize(ds)
+    genomeToBytes = {}
+    def stagedBytes(genome):
+        if genome not in genomeToBytes:
+            paths = [getGenomeFastaPath(ds, genome)] + glob.glob(getGenomeIndexPath(ds, genome) + '.*')
+            genomeToBytes[genome] = sum(os.path.getsize(path) for path in paths)
+        return genomeToBytes[genome]
+
+    def size(genome):
+        return genomeToSize.get(genome, (0, 0))
+
+    def resourceOpts(pairs, batchBlast):
+        genomes = set(g for pair in pairs for g in pair)
+        staged = min(STAGE_CACHE_BYTES, sum(stagedBytes(g) for g in genomes))
+        # blast hits of each pair, forward and reverse.  batch blast keeps the
+        # hits of every pair of the job at once.
+        hits = [sum(size(g)[0] for g in pair) * rsd.MAX_HITS * HIT_BYTES for pair in pairs]
+        hits = sum(hits) if batchBlast else max(hits or [0])
+        residues = max([sum(size(g)[1] for g in pair) for pair in pairs] or [0])
+        return lsf.makeResourceOptions(
+            memMB=roundUpToPowerOf2(JOB_BASE_MEM_MB + residues * MEM_BYTES_PER_RESIDUE / 2.0**20),
+            tmpMB=roundUpToPowerOf2(JOB_BASE_TMP_MB + (staged + hits) / 2.0**20))
+
+    if getPairQueue(ds) is not None:
+        # queued pairs are computed one at a time.
+        queueOpts = resourceOpts(getPairsToCompute(ds), False)
+        return [getJobQueueOpts(ds, job) + queueOpts for job in jobs]
+    batchBlast = getData(ds, 'batch_blast')
+    return [getJobQueueOpts(ds, job) + resourceOpts(getJobPairs(ds, job), batchBlast) for job in jobs]
+
+
+def roundUpToPowerOf2(x):
+    return 2 ** int(math.ceil(math.log(max(1, x), 2)))
+
+
+def report_eta(ds, concurrency=None):
+    '''
+    Print the estimated time until all jobs are done, from the estimated
+    running time of the jobs that are not done.
+    concurrency: the number of jobs running at once.  Defaults to the number
+    of jobs of ds currently on lsf.
+    returns: the estimated number of seconds until all jobs are done, or None
+    if job running times were not estimated in seconds.
+    '''
+    if not getData(ds, 'job_costs_in_seconds'):
+        print 'job running times were not estimated in seconds.  See fit_runtime_model.'
+        return None
+    jobToCost = getData(ds, 'job_costs', {})
+    ns = getComputeJobsNs(ds)
+    jobDones = dones.get(ns)
+    remaining = [job for job in getJobs(ds) if not jobDones.done(getComputeJobTaskName(ds, job))]
+    if concurrency is None:
+        onNames = lsfdo.running_names(ns, getComputeJobTasks(ds)[0])
+        concurrency = sum(1 for job in remaining if getComputeJobTaskName(ds, job) in onNames)
+    concurrency = max(1, int(concurrency))
+    seconds = [jobToCost.get(job, 0) for job in remaining]
+    # the longest job bounds the time, even with unlimited concurrency.
+    eta = max([sum(seconds) / concurrency] + seconds)
+    print 'jobs remaining: {} of {}. concurrency: {}'.format(len(remaining), len(jobToCost), concurrency)
+    print 'estimated seconds remaining: {:.0f}. eta: {}'.format(
+        eta, datetime.datetime.now() + datetime.timedelta(seconds=eta))
+    return eta
 
 
 def compute_job(ds, job):
@@ -1185,14 +2002,35 @@ def compute_job(ds, job):
     job: identifies which job this is so it knows which pairs to compute.
     computes orthologs for every pair in the job.  merges the orthologs into a
     single file and puts that file in the dataset orthologs dir.
+    If the dataset has a pair queue, computes the pairs it claims from the
+    queue instead.  See computeQueuedPairs().
+    The stats of the pairs are buffered in the job dir.  See bufferedStats().
+    '''
+    queue = getPairQueue(ds)
+    with bufferedStats(ds, getJobDir(ds, job)):
+        if queue is not None:
+            computeQueuedPairs(ds, job, queue)
+        else:
+            computeJobPairs(ds, job)
+
+
+def computeJobPairs(ds, job):
+    '''
+    Compute the pairs of job and merge their orthologs.  See compute_job().
     '''
     pairs = getJobPairs(ds, job)
     jobDir = getJobDir(ds, job)
     print ds, job, pairs, jobDir
 
+    # check the dones of every pair at once
+    pairsDone = getDones(ds).done_many([('pair', pair) for pair in pairs])
+    todo = [pair for pair, done in zip(pairs, pairsDone) if not done]
+    if getData(ds, 'batch_blast'):
+        blastJobGenomes(ds, todo, jobDir)
+
     # compute orthologs for pairs
     for pair in pairs:
-        if not getDones(ds).done(('pair', pair)):
+        if pair in todo:
             orthologsPath = os.path.join(jobDir, '{}_{}.pair.orthologs.txt'.format(*pair))
             print orthologsPath
             computePair(ds, pair, jobDir, orthologsPath)
@@ -1205,6 +2043,8 @@ def compute_job(ds, job):
         orthDatasGen = orthutil.orthDatasFromFilesGen(pairsPaths)
         orthutil.orthDatasToFile(orthDatasGen, jobOrthologsPath)
         getDones(ds).mark(('job_ologs_merge', job))
+    # write the marks before the pair files they vouch for are deleted.
+    getDones(ds).flush()
         
     # delete the individual pair olog files
     for pair in pairs:
@@ -1213,41 +2053,111 @@ def compute_job(ds, job):
             os.remove(orthologsPath)
 
 
+def computeQueuedPairs(ds, job, queue):
+    '''
+    job: the worker claiming pairs.
+    queue: the pair queue of ds.
+    Claims pairs from queue and computes them until no unclaimed pairs are
+    left, appending the orthologs of each pair to the orthologs file of job.
+    '''
+    jobDir = getJobDir(ds, job)
+    jobOrthologsPath = getJobOrthologsPath(ds, job)
+    journalPath = os.path.join(jobDir, 'append_journal.json')
+    print ds, job, jobDir
+
+    # Only one instance of a job runs at a time, so pairs claimed but not done
+    # by this job were claimed by a previous run that died.
+    undoOrthologsAppend(queue, jobOrthologsPath, journalPath)
+    print 'released {} pairs'.format(queue.release(worker=job))
+
+    while True:
+        claimed = queue.claim(job)
+        if claimed is None:
+            break
+        itemId, pair, numClaims = claimed
+        pair = tuple(pair)
+        print datetime.datetime.now(), 'claimed pair', itemId, pair
+        if numClaims > 1:
+            # the blast hits of a released pair are in the dir of the job that
+            # claimed it before, so compute it from scratch.
+            for key in [('blast', pair[0], pair[1]), ('blast', pair[1], pair[0]), ('roundup', pair), ('pair', pair)]:
+                getDones(ds).unmark(key)
+        orthologsPath = os.path.join(jobDir, '{}_{}.pair.orthologs.txt'.format(*pair))
+        computePair(ds, pair, jobDir, orthologsPath)
+
+        # journal the append, so it can be undone if the job dies before the
+        # pair is done, and the pair is computed and appended again.
+        size = os.path.getsize(jobOrthologsPath) if os.path.exists(jobOrthologsPath) else 0
+        with open(journalPath, 'w') as fh:
+            json.dump({'id': itemId, 'size': size, 'path': orthologsPath}, fh)
+        with open(orthologsPath) as fin:
+            with open(jobOrthologsPath, 'a') as fout:
+                shutil.copyfileobj(fin, fout)
+        queue.done(itemId)
+        getDones(ds).mark(('pair', pair))
+        os.remove(orthologsPath)
+        os.remove(journalPath)
+    getDones(ds).flush()
+
+
+def undoOrthologsAppend(queue, orthologsPath, journalPath):
+    '''
+    If a job died while appending the orthologs of a pair to orthologsPath,
+    before the pair was done, truncate orthologsPath to its size before the
+    append.  See computeQueuedPairs().
+    '''
+    if not os.path.exists(journalPath):
+        return
+    with open(journalPath) as fh:
+        journal = json.load(fh)
+    if not queue.isDone(journal['id']) and os.path.exists(orthologsPath):
+        print 'truncating {} to {} bytes'.format(orthologsPath, journal['size'])
+        with open(orthologsPath, 'r+') as fh:
+            fh.truncate(journal['size'])
+    if os.path.exists(journal['path']):
+        os.remove(journal['path'])
+    os.remove(journalPath)
+
+
 def computePair(ds, pair, workingDir, orthologsPath):
     '''
     ds: the roundup dataset.
     pair: find orthologs for this pair of genomes.
-    workingDir: where to save blast hits and orthologs as they get completed.
+    workingDir: where to save orthologs as they get completed.  Blast hits are
+      saved in a dir on the local disk for workingDir.  See getPairHitsPaths().
     orthologsPath: where to write the orthologs.
     precompute blast hits for pair, then compute orthologs for pair, then write orthologs to a file and clean up other files.
     '''
     # a pair is complete when it has written its orthologs to a file and cleaned up its other data files.
     queryGenome, subjectGenome = pair
-    queryFastaPath = getGenomeFastaPath(ds, queryGenome)
-    subjectFastaPath = getGenomeFastaPath(ds, subjectGenome)
-    queryIndexPath = getGenomeIndexPath(ds, queryGenome)
-    subjectIndexPath = getGenomeIndexPath(ds, subjectGenome)
-    forwardHitsPath = os.path.join(workingDir, '{}_{}.forward_hits.pickle'.format(*pair))
-    reverseHitsPath = os.path.join(workingDir, '{}_{}.reverse_hits.pickle'.format(*pair))
-    maxEvalue = max([float(evalue) for evalue in roundup_common.EVALUES]) # evalues are strings like '1e-5'
-    divEvalues = roundup_common.divEvalues()
-    with nested.NestedTempDir(dir=LOCAL_DIR) as tmpDir:
-        logging.debug('computePair. tmpDir={}'.format(tmpDir))
-        if not getDones(ds).done(('blast', queryGenome, subjectGenome)):
-            startTime = time.time()
-            rsd.computeBlastHits(queryFastaPath, subjectIndexPath, forwardHitsPath, maxEvalue,
-                                 workingDir=tmpDir, copyToWorking=True)
-            getStats(ds).putBlast(queryGenome, subjectGenome, startTime=startTime, endTime=time.time())
-            getDones(ds).mark(('blast', queryGenome, subjectGenome))
-
-        if not getDones(ds).done(('blast', subjectGenome, queryGenome)):
-            startTime = time.time()
-            rsd.computeBlastHits(subjectFastaPath, queryIndexPath, reverseHitsPath, maxEvalue,
-                                 workingDir=tmpDir, copyToWorking=True)
-            getStats(ds).putBlast(subjectGenome, queryGenome, startTime=startTime, endTime=time.time())
-            getDones(ds).mark(('blast', subjectGenome, queryGenome))
+    forwardHitsPath, reverseHitsPath = getPairHitsPaths(ds, workingDir, pair)
+    # hits on the local disk of another node must be computed again.
+    # a done pair needs no genomes staged, only its hits cleaned up.
+    if not getDones(ds).done(('roundup', pair)):
+        maxEvalue = max([float(evalue) for evalue in roundup_common.EVALUES]) # evalues are strings like '1e-5'
+        divEvalues = roundup_common.divEvalues()
+        with nested.NestedTempDir(dir=LOCAL_DIR) as tmpDir, \
+                stagedGenome(ds, queryGenome) as (queryFastaPath, queryIndexPath), \
+                stagedGenome(ds, subjectGenome) as (subjectFastaPath, subjectIndexPath):
+            logging.debug('computePair. tmpDir={}'.format(tmpDir))
+            if not (getDones(ds).done(('blast', queryGenome, subjectGenome)) and os.path.exists(forwardHitsPath)) and \
+                    not getCachedHits(ds, queryGenome, subjectGenome, forwardHitsPath):
+                startTime = time.time()
+                rsd.computeBlastHits(queryFastaPath, subjectIndexPath, forwardHitsPath, maxEvalue,
+                                     workingDir=tmpDir, copyToWorking=False)
+                putCachedHits(ds, queryGenome, subjectGenome, forwardHitsPath)
+                getStats(ds).putBlast(queryGenome, subjectGenome, startTime=startTime, endTime=time.time())
+                getDones(ds).mark(('blast', queryGenome, subjectGenome))
+
+            if not (getDones(ds).done(('blast', subjectGenome, queryGenome)) and os.path.exists(reverseHitsPath)) and \
+                    not getCachedHits(ds, subjectGenome, queryGenome, reverseHitsPath):
+                startTime = time.time()
+                rsd.computeBlastHits(subjectFastaPath, queryIndexPath, reverseHitsPath, maxEvalue,
+                                     workingDir=tmpDir, copyToWorking=False)
+                putCachedHits(ds, subjectGenome, queryGenome, reverseHitsPath)
+                getStats(ds).putBlast(subjectGenome, queryGenome, startTime=startTime, endTime=time.time())
+                getDones(ds).mark(('blast', subjectGenome, queryGenome))
 
-        if not getDones(ds).done(('roundup', pair)):
             startTime = time.time()
             divEvalueToOrthologs = rsd.computeOrthologsUsingSavedHits(queryFastaPath, subjectFastaPath, divEvalues,
                                                                       forwardHitsPath, reverseHitsPath, workingDir=tmpDir)
@@ -1262,6 +2172,239 @@ def computePair(ds, pair, workingDir, orthologsPath):
         os.remove(reverseHitsPath)
 
 
+def getPairHitsPaths(ds, workingDir, pair):
+    '''
+    returns: the paths of the pickled blast hits of the first genome of pair
+    against the second and of the second against the first, on the local
+    disk, in a dir for workingDir (e.g. a job dir).  The hits are pickled, as
+    rsd.computeBlastHits() writes them and rsd.computeOrthologsUsingSavedHits()
+    reads them, so they are not converted on their way from blast to rsd.
+    '''
+    hitsDir = os.path.join(LOCAL_HITS_DIR, getDatasetId(ds), os.path.basename(workingDir))
+    if not os.path.exists(hitsDir):
+        try:
+            os.makedirs(hitsDir)
+        except OSError:
+            if not os.path.isdir(hitsDir): # made by another process
+                raise
+    return (os.path.join(hitsDir, '{}_{}.forward_hits.pickle'.format(*pair)),
+            os.path.join(hitsDir, '{}_{}.reverse_hits.pickle'.format(*pair)))
+
+
+def blastJobGenomes(ds, pairs, workingDir):
+    '''
+    Blast each genome of pairs against all the genomes it is paired with in
+    one pass, instead of once per pair, and save the hits of each pair where
+    computePair() expects them, so it skips blasting.  Jobs group pairs
+    sharing genomes (see groupPairsByGenomes), so each genome is paired with
+    many others in a job.
+    '''
+    queryToSubjects = collections.defaultdict(list)
+    # check the dones of every pair at once
+    keys = [key for q, s in pairs for key in [('roundup', (q, s)), ('blast', q, s), ('blast', s, q)]]
+    keyToDone = dict(zip(keys, getDones(ds).done_many(keys)))
+    for pair in pairs:
+        queryGenome, subjectGenome = pair
+        if keyToDone[('roundup', tuple(pair))]:
+            continue
+        forwardHitsPath, reverseHitsPath = getPairHitsPaths(ds, workingDir, pair)
+        for query, subject, hitsPath in [(queryGenome, subjectGenome, forwardHitsPath),
+                                         (subjectGenome, queryGenome, reverseHitsPath)]:
+            if (not (keyToDone[('blast', query, subject)] and os.path.exists(hitsPath)) and
+                not getCachedHits(ds, query, subject, hitsPath)):
+                queryToSubjects[query].append(subject)
+
+    # build each database once for all the queries blasted against it.
+    allSubjects = sorted(set(s for subjects in queryToSubjects.values() for s in subjects))
+    for i in range(0, len(allSubjects), BATCH_BLAST_MAX_GENOMES):
+        dbGenomes = allSubjects[i:i+BATCH_BLAST_MAX_GENOMES]
+        dbGenomeSet = set(dbGenomes)
+        with nested.NestedTempDir(dir=LOCAL_DIR) as dbDir:
+            db = makeBatchBlastDb(ds, dbGenomes, dbDir)
+            for query in sorted(queryToSubjects):
+                subjects = [s for s in queryToSubjects[query] if s in dbGenomeSet]
+                if not subjects:
+                    continue
+                hitsPaths = [getPairHitsPaths(ds, workingDir, pair)[0 if pair[0] == query else 1]
+                             for pair in [tuple(sorted((query, subject))) for subject in subjects]]
+                print datetime.datetime.now(), 'batch blast', query, len(subjects)
+                computeBatchBlastHits(ds, query, subjects, hitsPaths, db)
+
+
+def makeBatchBlastDb(ds, genomes, dbDir):
+    '''
+    Concatenate the fasta files of genomes into a blast database in dbDir.
+    returns: a tuple of the path of the database, a dict from each sequence id
+    in the database to its genome, for splitting hits, and the number of
+    residues in the database.
+    '''
+    genomeToResidues = getGenomeToResidues(ds)
+    dbPath = os.path.join(dbDir, 'subjects.faa')
+    geneToGenome = {}
+    with open(dbPath, 'w') as outfh:
+        for genome in genomes:
+            with open(getGenomeFastaPath(ds, genome)) as infh:
+                for line in infh:
+                    if line.startswith('>'):
+                        geneToGenome[fasta.idFromName(line)] = genome
+                    outfh.write(line)
+    rsd.formatForBlast(dbPath)
+    dbResidues = float(sum(max(1, genomeToResidues[genome]) for genome in genomes))
+    return dbPath, geneToGenome, dbResidues
+
+
+def computeBatchBlastHits(ds, queryGenome, subjectGenomes, hitsPaths, db):
+    '''
+    Blast queryGenome against db, a database made by makeBatchBlastDb() of
+    subjectGenomes and possibly other genomes, and split the hits into a
+    pickled hits map for each subject genome, in hitsPaths.  Hits in other
+    genomes of the database are dropped.
+
+    E-values grow with the size of the database, so the database is searched
+    with an e-value limit scaled up by its size relative to the smallest
+    subject genome, and the e-value of each hit is scaled down by the size of
+    its genome relative to the database.  This ignores blast's correction of
+    the effective lengths of the query and database, so the scaled e-values
+    only approximate the e-values of blasting each pair, and hits near the
+    e-value cutoffs, and the orthologs found with them, can differ from those
+    of blasting each pair.  Up to rsd.MAX_HITS hits per query sequence are
+    kept for each subject genome, as when blasting one subject.
+    The limit of hits from the whole database is BATCH_BLAST_HITS_FACTOR times
+    higher, so one subject genome with many paralogs or strains does not use
+    up the hits of the others.  blastp also limits the sequences hit, to
+    BLAST_MAX_TARGET_SEQS, which is why databases hold at most
+    BATCH_BLAST_MAX_GENOMES genomes.
+    '''
+    dbPath, geneToGenome, dbResidues = db
+    maxEvalue = max([float(evalue) for evalue in roundup_common.EVALUES])
+    genomeToResidues = getGenomeToResidues(ds)
+    subjectResidues = [max(1, genomeToResidues[genome]) for genome in subjectGenomes]
+    numDbGenomes = len(set(geneToGenome.values()))
+    with nested.NestedTempDir(dir=LOCAL_DIR) as tmpDir, \
+            stagedGenome(ds, queryGenome) as (queryFastaPath, queryIndexPath):
+        hitsPath = os.path.join(tmpDir, 'hits.pickle')
+        startTime = time.time()
+        rsd.computeBlastHits(queryFastaPath, dbPath, hitsPath, maxEvalue * dbResidues / min(subjectResidues),
+                             limitHits=rsd.MAX_HITS * BATCH_BLAST_HITS_FACTOR * numDbGenomes,
+                             workingDir=tmpDir, copyToWorking=False)
+        endTime = time.time()
+        genomeToScale = dict((genome, residues / dbResidues) for genome, residues in
+                             zip(subjectGenomes, subjectResidues))
+        genomeToHitsMap = splitBlastHits(util.loadObject(hitsPath), geneToGenome, genomeToScale,
+                                         maxEvalue, rsd.MAX_HITS)
+
+    for genome, residues, path in zip(subjectGenomes, subjectResidues, hitsPaths):
+        util.dumpObject(genomeToHitsMap[genome], path)
+        putCachedHits(ds, queryGenome, genome, path, genomeToHitsMap[genome])
+        # apportion the running time by the size of each subject genome.
+        getStats(ds).putBlast(queryGenome, genome, startTime=startTime,
+                              endTime=startTime + (endTime - startTime) * residues / sum(subjectResidues))
+        getDones(ds).mark(('blast', queryGenome, genome))
+
+
+def splitBlastHits(hitsMap, geneToGenome, genomeToScale, maxEvalue, limitHits):
+    '''
+    hitsMap: a dict from each query sequence id to a list of its (hit id,
+    evalue, ...) hits, best first, as saved by rsd.computeBlastHits().
+    geneToGenome: the genome of each hit id.
+    genomeToScale: multiply the evalues of hits in a genome by this.
+    returns: a dict from each genome in genomeToScale to a hits map of the
+    hits in that genome with scaled evalues <= maxEvalue.  Every query id is
+    in every hits map.  Hits in genomes not in genomeToScale are dropped.
+    '''
+    genomeToHitsMap = dict((genome, {}) for genome in genomeToScale)
+    for query, hits in hitsMap.iteritems():
+        for genomeHitsMap in genomeToHitsMap.itervalues():
+            genomeHitsMap[query] = []
+        for hit in hits:
+            genome = geneToGenome[hit[0]]
+            if genome not in genomeToScale:
+                continue
+            evalue = hit[1] * genomeToScale[genome]
+            genomeHits = genomeToHitsMap[genome][query]
+            if evalue <= maxEvalue and len(genomeHits) < limitHits:
+                genomeHits.append((hit[0], evalue) + tuple(hit[2:]))
+    return genomeToHitsMap
+
+
+def getHitsCache(ds):
+    '''
+    returns: the persistent cache of blast hits files of ds, or None if ds does
+    not cache hits.  Hits are keyed by their genomes, the checksums of the
+    genome fasta files and the max evalue of the hits, so they can be shared
+    by datasets.  Cached hits are stored compactly in hits files (see
+    roundup.hitsfile), and converted to and from the pickles rsd uses only
+    when they enter or leave the cache.
+    '''
+    hitsCacheDir = getData(ds, 'hits_cache_dir')
+    return stagecache.StageCache(hitsCacheDir, HITS_CACHE_BYTES) if hitsCacheDir else None
+
+
+def getHitsCacheKey(ds, queryGenome, subjectGenome):
+    maxEvalue = max([float(evalue) for evalue in roundup_common.EVALUES])
+    data = [queryGenome, subjectGenome, getGenomeChecksum(ds, queryGenome),
+            getGenomeChecksum(ds, subjectGenome), repr(maxEvalue)]
+    return '{}_{}_{}'.format(queryGenome, subjectGenome, hashlib.sha1(json.dumps(data)).hexdigest())
+
+
+def getCachedHits(ds, queryGenome, subjectGenome, hitsPath):
+    '''
+    Write the hits of queryGenome against subjectGenome from the hits cache
+    of ds to hitsPath, pickled, and mark them done, if they are in the cache.
+    returns: True iff the hits were in the cache.
+    '''
+    cache = getHitsCache(ds)
+    if cache is None:
+        return False
+    with cache.cached(getHitsCacheKey(ds, queryGenome, subjectGenome)) as paths:
+        if paths is None:
+            return False
+        util.dumpObject(hitsfile.loadHits(paths[0]), hitsPath)
+    print 'using cached hits', queryGenome, subjectGenome
+    getDones(ds).mark(('blast', queryGenome, subjectGenome))
+    return True
+
+
+def putCachedHits(ds, queryGenome, subjectGenome, hitsPath, hitsMap=None):
+    '''
+    Put the hits of queryGenome against subjectGenome in hitsPath into the
+    hits cache of ds, if it has one.
+    hitsMap: the hits pickled in hitsPath, if they are already loaded.
+    '''
+    cache = getHitsCache(ds)
+    if cache is None:
+        return
+    if hitsMap is None:
+        hitsMap = util.loadObject(hitsPath)
+    with nested.NestedTempDir(dir=LOCAL_DIR) as tmpDir:
+        path = os.path.join(tmpDir, os.path.basename(hitsPath)[:-len('.pickle')])
+        hitsfile.writeHits(hitsMap, path)
+        cache.put(getHitsCacheKey(ds, queryGenome, subjectGenome), [path])
+
+
+def getStageCache():
+    return stagecache.StageCache(STAGE_CACHE_DIR, STAGE_CACHE_BYTES)
+
+
+@contextlib.contextmanager
+def stagedGenome(ds, genome):
+    '''
+    Stage the fasta and blast index files of genome in the stage cache on
+    the local disk, so they are copied once per node instead of once per
+    blast.
+    yields: the local fasta path and index path of genome.
+    '''
+    fastaPath = getGenomeFastaPath(ds, genome)
+    indexPath = getGenomeIndexPath(ds, genome)
+    # the index files are named by adding extensions to the index path.
+    paths = sorted(set([fastaPath] + glob.glob(indexPath + '.*')))
+    key = '{}_{}'.format(getDatasetId(ds), genome)
+    with getStageCache().staged(key, paths) as stagedPaths:
+        stagedDir = os.path.dirname(stagedPaths[0])
+        yield (os.path.join(stagedDir, os.path.basename(fastaPath)),
+               os.path.join(stagedDir, os.path.basename(indexPath)))
+
+
 ######
 # JOBS
 ######
@@ -1299,6 +2442,25 @@ def getJobDir(ds, job):
     return os.path.join(getJobsDir(ds), job)
 
 
+def getPairQueue(ds):
+    '''
+    returns: the queue from which the jobs of ds claim pairs, or None if each
+    job computes a fixed list of pairs.  See prepare_jobs().
+    '''
+    backend = getData(ds, 'pair_queue')
+    return makePairQueue(ds, backend) if backend else None
+
+
+def makePairQueue(ds, backend):
+    if backend == 'mysql':
+        connect = kvstore.make_closing_connect(config.openDbConn)
+        return workqueue.WorkQueue(connect, ns='roundup_dataset_{}_pair_queue'.format(getDatasetId(ds)))
+    elif backend == 'sqlite':
+        return workqueue.SqliteWorkQueue(os.path.join(ds, 'pair_queue.sqlite'))
+    else:
+        raise Exception('Unrecognized pair queue backend.', backend)
+
+
 def getJobOrthologsPath(ds, job):
     return os.path.join(getOrthologsDir(ds), '{}.orthologs.txt'.format(job))
 
@@ -1356,6 +2518,32 @@ def getGenomeFastaPath(ds, genome):
     return os.path.join(getGenomePath(ds, genome), genome+'.faa')
 
 
+def getGenomeGenesPath(ds, genome):
+    '''
+    location of the gene data of the seqs of a genome, written while
+    extracting the genome from the dat files.  See setGeneDataFromFiles().
+    '''
+    return os.path.join(getGenomePath(ds, genome), genome+'.genes')
+
+
+def getGenomeChecksum(ds, genome, save=True):
+    '''
+    save: if True, save the digest next to the fasta file the first time it is
+    computed.  Use False for a dataset that should not be modified, e.g. a
+    previous dataset.
+    returns: the SHA digest of the fasta file of genome.
+    '''
+    path = getGenomeFastaPath(ds, genome) + '.sha1'
+    if not os.path.exists(path):
+        if not save:
+            return util.fileDigest(getGenomeFastaPath(ds, genome))
+        # jobs on many nodes might compute it at once.
+        tmpPath = '{}.{}.tmp'.format(path, random.getrandbits(64))
+        util.writeToFile(util.fileDigest(getGenomeFastaPath(ds, genome)), tmpPath)
+        os.rename(tmpPath, path)
+    return util.readFromFile(path)
+
+
 def getGenomeIndexPath(ds, genome):
     '''
     location of blast index files.
@@ -1431,9 +2619,17 @@ def getPairs(ds, genomes=None):
 # It is stored in files, so is not safe for concurrent writing.
 # The data is accessed as a key-value store, using setData and getData or
 # the convenience functions below.
-# Small bits of data are stored in a common file.
-# Large chunks of data (e.g. geneToGoTerms) are stored in their own file
-# for speed and memory restrictions.
+# It is stored by one of the backends in roundup.metadata:
+# - json: Small bits of data are stored in a common file.  Large chunks of
+#   data (e.g. geneToGoTerms) are stored in their own file for speed and
+#   memory restrictions.  This is the default.
+# - sqlite: All data is stored in a sqlite database in the dataset dir.
+#   Large dicts are stored one item per row, so getData returns a read-only
+#   dict that looks up items as they are used, getDataItem looks up one item
+#   without loading the rest, and setDataItems updates items without
+#   rewriting the rest.
+# A dataset uses the sqlite backend if it has a sqlite database, made by
+# prepare_dataset(backend='sqlite') or convert_metadata().
 # Why not store this in a database?
 # - To keep it simple, all dataset info (except when running a computation) is
 #   kept in the directory.
@@ -1444,51 +2640,121 @@ def getPairs(ds, genomes=None):
 # - If concurrent access was needed.
 # - Faster updates of small portions of the data, e.g. updating the go terms
 #   for a single gene (though this never happens in practice.)
+# - Looking up a few items (e.g. the names of the genes of one genome) without
+#   loading every item into memory.
+
+# Cached metadata is checked for changes when it is used, unless it was
+# checked in the last METADATA_CACHE_CHECK_SECONDS.  The website, where
+# metadata does not change, raises this with setMetadataCacheCheckSeconds(),
+# so most requests do not touch the filesystem.
+METADATA_CACHE_BYTES = 512 * 2**20 # approximate size of cached metadata
+METADATA_CACHE_CHECK_SECONDS = 0
+_metadatas = {} # (pid, ds, backend) -> backend object
+_metadataCache = metadata.MetadataCache(METADATA_CACHE_BYTES, METADATA_CACHE_CHECK_SECONDS)
+
+
+def getMetadata(ds):
+    '''
+    returns: the metadata backend of ds.  Backends are reused within a
+    process, but not shared with child processes, which get their own.
+    '''
+    backend = metadata.getBackendName(ds)
+    key = (os.getpid(), ds, backend)
+    if key not in _metadatas:
+        _metadatas[key] = metadata.openMetadata(ds, BIG_DATA_KEYS, backend)
+    return _metadatas[key]
+
+
+def setMetadataCacheCheckSeconds(seconds):
+    '''
+    Check cached metadata for changes at most every seconds.
+    '''
+    _metadataCache.checkSeconds = seconds
+
 
 def getData(ds, key, default=None):
     '''
     return: the data associated with key or default if key is not cached.
+    With the sqlite backend, big data dicts are returned as a read-only dict.
+    The data is cached in memory.  Callers get a copy of the data of small
+    keys, which they may modify, but share the data of BIG_DATA_KEYS, which
+    must not be modified, e.g. use dict(data) to get a modifiable copy.
     '''
-    if key in BIG_DATA_KEYS: # big data stored in separate files
-        return _getDataInFile(ds, key, default)
-    else: # small data all stored in one file
-        md = _getDataInFile(ds, DATASET, {})
-        return md.get(key, default)
+    return _metadataCache.get(getMetadata(ds), key, default)
 
 
 def setData(ds, key, data):
     '''
     Persist data, indexing it with key
     '''
-    if key in BIG_DATA_KEYS:
-        _setDataInFile(ds, key, data)
-    else: # small data all stored in one file
-        md = _getDataInFile(ds, DATASET, {})
-        md[key] = data
-        _setDataInFile(ds, DATASET, md)
+    _metadataCache.invalidate(ds, key)
+    getMetadata(ds).set(key, data)
     return data
 
 
-def _getDataInFile(ds, key, default=None):
+def getDataItem(ds, key, item, default=None):
     '''
-    Deserialize and return the data cached in the file indexed by key.
-    Return default if the file does not exist.
+    return: the value of item in the dict associated with key, or default if
+    there is no such item.  Only loads the item with the sqlite backend.
     '''
-    path = os.path.join(ds, 'metadata.{}.json'.format(key))
-    if os.path.exists(path):
-        with open(path) as fh:
-            return json.load(fh)
-    else:
-        return default
+    return getMetadata(ds).getItem(key, item, default)
 
 
-def _setDataInFile(ds, key, data):
+def setDataItems(ds, key, items):
     '''
-    Serialize and save data to the file indexed by key.
+    items: a dict or iterable of (item, value) pairs.
+    Add or replace the items in the dict associated with key, in batches.
     '''
-    path = os.path.join(ds, 'metadata.{}.json'.format(key))
-    with open(path, 'w') as fh:
-        json.dump(data, fh, indent=0)
+    _metadataCache.invalidate(ds, key)
+    getMetadata(ds).setItems(key, items)
+
+
+def DataWriter(ds, key):
+    '''
+    returns: a writer for the dict of big data indexed by key, for writing it
+    one item at a time with write(item, value), instead of building the whole
+    dict in memory and calling setData().  Call close() to replace the data
+    with the written items, or abort() to discard them.
+    '''
+    assert key in BIG_DATA_KEYS
+    return getMetadata(ds).writer(key)
+
+
+def convert_metadata(ds, backend=metadata.SQLITE_BACKEND):
+    '''
+    Copy the metadata of ds to backend and make ds use backend.  The metadata
+    of the old backend is removed.
+    '''
+    old = getMetadata(ds)
+    oldBackend = metadata.getBackendName(ds)
+    if oldBackend == backend:
+        return
+    new = metadata.openMetadata(ds, BIG_DATA_KEYS, backend)
+    try:
+        for key in old.keys():
+            print 'converting {} metadata to {}...'.format(key, backend), datetime.datetime.now()
+            data = old.get(key)
+            if key in BIG_DATA_KEYS and isinstance(data, collections.Mapping):
+                writer = new.writer(key)
+                for item, value in data.iteritems():
+                    writer.write(item, value)
+                writer.close()
+            else:
+                new.set(key, data)
+    except:
+        # a partial sqlite database would be used instead of the json files.
+        if backend == metadata.SQLITE_BACKEND:
+            new.close()
+            os.remove(new.path)
+        raise
+    if oldBackend == metadata.SQLITE_BACKEND:
+        old.close()
+        os.remove(old.path)
+    else:
+        for path in old.paths():
+            os.remove(path)
+    _metadatas.clear()
+    _metadataCache.invalidate(ds)
 
 
 def getUniprotRelease(ds):
@@ -1560,24 +2826,78 @@ def getDatasetStats(ds):
             'numOrthologs': getData(ds, 'numOrthologs')}
 
 
+# The gene metadata is also stored in a gene table, a compact file that is
+# mmapped instead of loaded into memory.  When a dataset has a gene table,
+# the functions below return read-only dicts backed by it.
+
+def getGeneTablePath(ds):
+    return os.path.join(ds, 'metadata.genes.table')
+
+
+_geneTables = {} # (pid, ds) -> (stamp, table)
+
+
+def getGeneTable(ds):
+    '''
+    returns: the open gene table of ds, reopened if the file has changed, or
+    None if ds has no gene table.
+    '''
+    path = getGeneTablePath(ds)
+    stamp = metadata.fileStamp(path)
+    key = (os.getpid(), ds)
+    if key in _geneTables and _geneTables[key][0] != stamp:
+        _geneTables.pop(key)[1].close()
+    if stamp and key not in _geneTables:
+        _geneTables[key] = (stamp, genetable.GeneTable(path))
+    return _geneTables[key][1] if stamp else None
+
+
+def make_gene_table(ds):
+    '''
+    Write the gene table of ds from its gene metadata, e.g. for a dataset
+    made before gene tables.
+    '''
+    genomeToGenes = getData(ds, GENOME_TO_GENES, {})
+    geneToName = getData(ds, GENE_TO_NAME, {})
+    geneToDesc = getData(ds, GENE_TO_DESC, {})
+    geneToGeneIds = getData(ds, GENE_TO_GENE_IDS, {})
+    geneToGoTerms = getData(ds, GENE_TO_GO_TERMS, {})
+    writer = genetable.GeneTableWriter(getGeneTablePath(ds))
+    try:
+        for genome in sorted(genomeToGenes):
+            writer.addGenome(genome)
+            for gene in genomeToGenes[genome]:
+                writer.addGene(gene, geneToName[gene], geneToDesc[gene],
+                               geneToGeneIds[gene], geneToGoTerms[gene])
+    except:
+        writer.abort()
+        raise
+    writer.close()
+
+
 def getGenomeToGenes(ds):
-    return getData(ds, GENOME_TO_GENES, {})
+    table = getGeneTable(ds)
+    return table.genomeToGenes() if table else getData(ds, GENOME_TO_GENES, {})
 
 
 def getGeneToName(ds):
-    return getData(ds, GENE_TO_NAME, {})
+    table = getGeneTable(ds)
+    return table.geneToName() if table else getData(ds, GENE_TO_NAME, {})
 
 
 def getGeneToGenome(ds):
-    return getData(ds, GENE_TO_GENOME, {})
+    table = getGeneTable(ds)
+    return table.geneToGenome() if table else getData(ds, GENE_TO_GENOME, {})
 
 
 def getGeneToGoTerms(ds):
-    return getData(ds, GENE_TO_GO_TERMS, {})
+    table = getGeneTable(ds)
+    return table.geneToGoTerms() if table else getData(ds, GENE_TO_GO_TERMS, {})
 
 
 def getGeneToGeneIds(ds):
-    return getData(ds, GENE_TO_GENE_IDS, {})
+    table = getGeneTable(ds)
+    return table.geneToGeneIds() if table else getData(ds, GENE_TO_GENE_IDS, {})
 
 
 def getTermToData(ds):
@@ -1596,21 +2916,49 @@ def getTaxonToData(ds):
 # Tracking jobs is useful to avoid rerunning jobs that are already done.
 # pros: concurrency. fast even with millions of dones.
 # cons: different mysql db for dev and prod, so must use the prod code on a prod dataset.
+# Marks are buffered and written in batches, so jobs flush them before they
+# finish.  Marks made before batching are still found in the old dones.
+
+DONES_CACHE = {}
+
 
 def getDones(ds):
-    ns = 'roundup_dataset_{}_dones'.format(getDatasetId(ds))
-    return dones.get(ns)
+    '''
+    returns: a BatchDones object of ds, shared by the process, whose
+    buffered marks are flushed when the process exits.
+    '''
+    if ds not in DONES_CACHE:
+        connect = kvstore.make_closing_connect(config.openDbConn)
+        fallback = dones.get('roundup_dataset_{}_dones'.format(getDatasetId(ds)))
+        ns = 'roundup_dataset_{}_batch_dones'.format(getDatasetId(ds))
+        DONES_CACHE[ds] = batchdones.BatchDones(connect, ns=ns, fallback=fallback)
+    return DONES_CACHE[ds]
 
 
-def reset_blast_dones(ds, query_genome, subject_genome, reverse=False):
+def flushDones():
+    '''
+    Write the buffered marks of every dataset.
+    '''
+    for d in DONES_CACHE.values():
+        d.flush()
+
+
+atexit.register(flushDones)
+
+
+def reset_blast_dones(ds, query_genome, subject_genome, reverse=False, uncache=False):
     '''
     Used from the command line to fix incorrectly marked blast dones.
+    uncache: if True, also remove the hits from the hits cache, so they are
+    computed again instead of reused.
     '''
 
     if reverse:
-        getDones(ds).unmark(('blast', subject_genome, query_genome))
-    else:
-        getDones(ds).unmark(('blast', query_genome, subject_genome))
+        query_genome, subject_genome = subject_genome, query_genome
+    getDones(ds).unmark(('blast', query_genome, subject_genome))
+    cache = getHitsCache(ds)
+    if uncache and cache is not None:
+        cache.remove(getHitsCacheKey(ds, query_genome, subject_genome))
 
 
 #######
@@ -1618,6 +2966,9 @@ def reset_blast_dones(ds, query_genome, subject_genome, reverse=False):
 #######
 
 STATS_CACHE = {}
+# buffered stats of a job, in the job dir.  See bufferedStats().
+STATS_BUFFER_FILENAME = 'stats_buffer.jsonl'
+STATS_BUFFER_SIZE = 1000 # write buffered stats after this many are put
 
 
 def stats_ns(ds):
@@ -1629,11 +2980,12 @@ def stats_ns(ds):
 
 def getStats(ds):
     '''
-    Return a Stats object with a connection context manager that proactively
-    closes connections to the database.
+    Return a Stats object, shared by the process, with a pool of connections
+    to the database.  A connection left idle in the pool for a long time is
+    closed, rather than reused, when the pool is next used.
     '''
     if ds not in STATS_CACHE:
-        connect = kvstore.make_closing_connect(config.openDbConn)
+        connect = kvstore.make_pooled_connect(config.openDbConn)
         kv = kvstore.KVStore(connect, ns=stats_ns(ds))
         STATS_CACHE[ds] = Stats(kv)
 
@@ -1649,15 +3001,29 @@ def statsCM(ds):
     This is useful when rapidly getting or putting stats, which would overwhelm
     the database if each action opened and closed a database connection.
     '''
-    reuser = None
+    connect = kvstore.make_pooled_connect(config.openDbConn)
     try:
-        connect = kvstore.make_reusing_connect(config.openDbConn)
         kv = kvstore.KVStore(connect, ns=stats_ns(ds))
         stats = Stats(kv)
         yield stats
     finally:
-        if reuser:
-            reuser.close()
+        connect.close()
+
+
+@contextlib.contextmanager
+def bufferedStats(ds, dir):
+    '''
+    A context manager that buffers the stats put by the process in a file in
+    dir and writes them to the database in batches, instead of one at a time,
+    and when exiting the context.  Stats buffered by a process that died are
+    written the next time the stats of dir are buffered.
+    '''
+    stats = getStats(ds)
+    stats.startBuffering(os.path.join(dir, STATS_BUFFER_FILENAME))
+    try:
+        yield stats
+    finally:
+        stats.stopBuffering()
 
 
 class Stats(object):
@@ -1671,6 +3037,8 @@ class Stats(object):
         '''
         self.kv = kv
         self.ready = False
+        self.bufferPath = None
+        self.numBuffered = 0
 
     def _get_kv(self):
         if not self.ready:
@@ -1693,11 +3061,67 @@ class Stats(object):
         '''
         return self._get_kv().get(key, default={})
 
+    def scan(self, kind):
+        '''
+        kind: 'blast' or 'rsd'
+        yields: ((kind, qdb, sdb), stats) tuples of every stored stats of kind,
+        read from the database in batches.
+        '''
+        for key, stats in self._get_kv().scan([kind]):
+            yield tuple(key), stats
+
+    def getMany(self, keys):
+        '''
+        returns: a list of the dict of stats of each key, an empty dict if a
+        key is not present.
+        '''
+        return self._get_kv().get_many(keys, default={})
+
     def put(self, key, stats):
         '''
         stats: a dict of statistics for blast, rsd, or a pair.
+        If buffering, stats are not in the database until flushed.
+        '''
+        if self.bufferPath is None:
+            self._get_kv().put(key, stats)
+            return
+        with open(self.bufferPath, 'a') as fh:
+            fh.write(json.dumps([key, stats]) + '\n')
+        self.numBuffered += 1
+        if self.numBuffered >= STATS_BUFFER_SIZE:
+            self.flush()
+
+    def startBuffering(self, path):
+        '''
+        Buffer stats put from now on by appending them to the file path, as
+        lines of json.  Stats already in the file are flushed.
+        '''
+        self.bufferPath = path
+        self.flush()
+
+    def stopBuffering(self):
+        self.flush()
+        self.bufferPath = None
+
+    def flush(self):
+        '''
+        Write the buffered stats to the database in one transaction and empty
+        the buffer.
         '''
-        self._get_kv().put(key, stats)
+        if self.bufferPath is None or not os.path.exists(self.bufferPath):
+            return
+        items = []
+        with open(self.bufferPath) as fh:
+            for line in fh:
+                try:
+                    key, stats = json.loads(line)
+                except ValueError: # a line cut short by a process dying
+                    continue
+                items.append((key, stats))
+        if items:
+            self._get_kv().put_many(items)
+        os.remove(self.bufferPath)
+        self.numBuffered = 0
 
     def putBlast(self, qdb, sdb, startTime, endTime):
         stats = {'type': 'blast', 'qdb': qdb, 'sdb': sdb, 'startTime': startTime, 'endTime': endTime}
@@ -1723,12 +3147,22 @@ class Stats(object):
 ##########
 # Workflow for constructing a dataset
 
-def workflow(ds, previous_dataset=None):
+def workflow(ds, previous_dataset=None, pair_queue=None, batch_blast=False, hits_cache_dir=None,
+             incremental=False, executor=None, fit_model=False):
     '''
     This function runs the entire workflow needed to create a new roundup dataset,
     from preparing the directories, to downloading genomes, to preprocessing,
     to computing orthologs, and to post-processing.
-    '''
+    fit_model: if True, predict the running times of pairs with a model fit
+    to the performance stats of previous_dataset.  See fit_runtime_model.
+    executor: if not None, run the tasks of parallel steps (e.g. formatting
+    genomes and computing jobs) with this lsfdo executor instead of on lsf.
+    '''
+    if executor is not None:
+        os.environ[lsfdo.EXECUTOR_ENV] = executor
+    if pair_queue == 'sqlite' and os.environ.get(lsfdo.EXECUTOR_ENV, lsfdo.LSF_EXECUTOR) == lsfdo.LSF_EXECUTOR:
+        # lsf jobs on many nodes would share the queue file over the network.
+        raise Exception('The sqlite pair queue requires the local or inline executor.', ds)
     dsid = getDatasetId(ds)
     ns = 'roundup_dataset_{}_workflow'.format(dsid)
 
@@ -1745,7 +3179,8 @@ def workflow(ds, previous_dataset=None):
     do('extract_gene_ontology', extract_gene_ontology_data, ds)
 
     # Scan dat files, compiling the counts of various genomes, completes, reference, sprot, etc.  This can take an hour or so.
-    do('examine_dats', examine_dats, ds)
+    # Spool the complete proteome seqs too, so the dat files are only read once.
+    do('examine_dats', examine_dats, ds, spool=True)
 
     # Some output from the examine_dats function showing that trembl 50-100 times bigger than sprot
     # td23@clarinet002-039:/groups/cbi/sites/roundup/datasets/4/code/app$     cd $DS_APP && time $DS_PYTHON roundup/dataset.py examine_dats(ds)
@@ -1817,14 +3252,24 @@ def workflow(ds, previous_dataset=None):
     do('make_genome_to_name', make_genome_to_name, ds)
 
     # Compile genome fasta files from the dat files.  This can take a while
+    # This is skipped if set_genomes_from_filter promoted the spooled genomes.
     do('extract_from_dats', extract_from_dats, ds)
 
     # Format the genomes for BLAST.  This also can take a while.  By default it
     # distributes the jobs onto orchestra, otherwise it takes a really long time.
     do('format_genomes', format_genomes, ds)
 
-    # Prepare jobs for computing all orthologs
-    do('prepare_jobs', prepare_jobs, ds)
+    # Copy the orthologs of pairs of genomes unchanged since the previous
+    # dataset, instead of computing them again.
+    if incremental and previous_dataset:
+        do('carry_over_orthologs', carry_over_orthologs, ds, previous_dataset)
+
+    # Prepare jobs for computing all (other) orthologs, balancing their running
+    # times using the running times of the previous dataset.
+    if fit_model and previous_dataset:
+        do('fit_runtime_model', fit_runtime_model, ds, [previous_dataset])
+    do('prepare_jobs', prepare_jobs, ds, previousDs=previous_dataset, pairQueue=pair_queue,
+       batchBlast=batch_blast, hitsCacheDir=hits_cache_dir)
 
     # Compute the orthologs by running lots of jobs on Orchestra.  This step is often
     # run several times, depending on how many times orchestra services melt down and
@@ -1873,6 +3318,31 @@ def main():
                            of the previous dataset, used to create a log of
                            changes between this dataset and the previous
                            one.''')
+    subparser.add_argument('--pair-queue', choices=PAIR_QUEUE_BACKENDS,
+                           help='''Jobs claim pairs from a queue using this
+                           backend until it is empty, instead of computing a
+                           fixed list of pairs.  sqlite requires --executor
+                           local or inline.''')
+    subparser.add_argument('--batch-blast', action='store_true', default=False,
+                           help='''Blast each genome of a job against all the
+                           genomes it is paired with at once.  Faster, but
+                           e-values, and so orthologs, are approximate.''')
+    subparser.add_argument('--incremental', action='store_true', default=False,
+                           help='''Copy the orthologs of pairs of genomes
+                           unchanged since the previous dataset instead of
+                           computing them.''')
+    subparser.add_argument('--hits-cache-dir', help='''Keep blast hits in a
+                           cache in this dir and reuse them instead of blasting
+                           again.''')
+    subparser.add_argument('--fit-model', action='store_true', default=False,
+                           help='''Predict the running times of pairs with a
+                           model fit to the performance stats of the previous
+                           dataset, when balancing jobs.''')
+    subparser.add_argument('--executor', choices=lsfdo.EXECUTORS,
+                           help='''Run parallel tasks with this executor, e.g.
+                           local to use the cores of this machine instead of
+                           lsf.  Defaults to the LSFDO_EXECUTOR environment
+                           variable or lsf.''')
 
     # convert_to_orthoxml
     subparser = add_ds_parser('convert_to_orthoxml', convert_to_orthoxml,
@@ -1882,6 +3352,28 @@ def main():
     subparser.add_argument('--database', required=True, help='The database name of the source of genomes. e.g. Uniprot')
     subparser.add_argument('--database-version', required=True, help='The version of the source genomes. e.g. 2012_04')
 
+    # fit_runtime_model
+    subparser = add_ds_parser('fit_runtime_model', fit_runtime_model,
+        help='Fit a model of the running time of pairs to previous datasets.')
+    subparser.add_argument('previous_datasets', metavar='previous_dataset', nargs='+',
+        help='previous datasets with performance stats.')
+
+    # report_eta
+    subparser = add_ds_parser('report_eta', report_eta,
+        help='Estimate when the jobs of the dataset will be done.')
+    subparser.add_argument('--concurrency', type=int,
+        help='number of jobs running at once.  Default: the number on lsf.')
+
+    # make_gene_table
+    add_ds_parser('make_gene_table', make_gene_table,
+                  help='Write the gene table of a dataset from its gene metadata.')
+
+    # convert_metadata
+    subparser = add_ds_parser('convert_metadata', convert_metadata,
+                              help='Store dataset metadata using another backend.')
+    subparser.add_argument('--backend', default=metadata.SQLITE_BACKEND,
+                           choices=[metadata.JSON_BACKEND, metadata.SQLITE_BACKEND])
+
     # make changelog
     subparser = add_ds_parser('make_change_log', make_change_log,
         help='Create list of differences between two datasets.')
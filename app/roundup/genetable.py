@@ -0,0 +1,418 @@
+'''
+A compact, read-only, columnar file of the gene metadata of a dataset:
+the genome, name, description, ncbi gene ids and go terms of every gene, and
+the genes of every genome.
+
+Compared to json dicts of python strings, which take gigabytes of memory
+for tens of millions of genes, the file is mmapped, so opening it is
+instantaneous and only the pages that are used are read into memory, and
+shared between processes.
+
+Genes are stored in rows, grouped by genome.  Strings are stored as utf-8 in
+string pools, a blob of concatenated strings and an array of the offset of
+every string.  Genomes are stored as integer codes, go terms as integer codes
+of an interned pool of distinct terms, and lists as offsets into an array of
+items.  Genes are found with a hash table of rows.
+
+GeneTable gives dict-like access to the columns, e.g.
+
+    table = GeneTable(path)
+    geneToName = table.geneToName()
+    geneToName['P29311'] # u'BMH1'
+'''
+
+import collections
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from array import array
+
+
+MAGIC = 'RGTB'
+VERSION = 1
+HEADER = struct.Struct('<4sIQQI') # magic, version, num genes, num genomes, num sections
+SECTION = struct.Struct('<16sQQ') # name, offset, length
+OFFSET = struct.Struct('<Q')
+CODE = struct.Struct('<I')
+CODE_TYPE = 'I'
+assert array(CODE_TYPE).itemsize == CODE.size
+
+
+def geneHash(gene):
+    '''
+    gene: a utf-8 encoded gene id.
+    '''
+    return zlib.crc32(gene) & 0xffffffff
+
+
+def utf8(s):
+    return s.encode('utf-8') if isinstance(s, unicode) else s
+
+
+############
+# WRITING
+
+class _PoolWriter(object):
+    '''
+    Write a string pool, the strings to a blob section and their offsets to
+    an offset section.  If intern is True, each distinct string is written
+    once and add() returns the same code for equal strings.
+    '''
+    def __init__(self, tmpDir, name, intern=False):
+        self.blobPath = os.path.join(tmpDir, name + '.blob')
+        self.offPath = os.path.join(tmpDir, name + '.off')
+        self.blobFh = open(self.blobPath, 'wb')
+        self.offFh = open(self.offPath, 'wb')
+        self.offFh.write(OFFSET.pack(0))
+        self.size = 0
+        self.count = 0
+        self.codes = {} if intern else None
+
+    def add(self, s):
+        '''
+        returns: the index (or code, if interned) of s in the pool.
+        '''
+        if self.codes is not None and s in self.codes:
+            return self.codes[s]
+        data = utf8(s)
+        self.blobFh.write(data)
+        self.size += len(data)
+        self.offFh.write(OFFSET.pack(self.size))
+        code = self.count
+        self.count += 1
+        if self.codes is not None:
+            self.codes[s] = code
+        return code
+
+    def close(self):
+        self.blobFh.close()
+        self.offFh.close()
+
+
+class _ListWriter(object):
+    '''
+    Write a column of lists of strings: the strings to a pool, the pool codes
+    of the items to an item section and the offset of every list in the items
+    to an offset section.
+    '''
+    def __init__(self, tmpDir, name, intern=False):
+        self.pool = _PoolWriter(tmpDir, name + 'pool', intern)
+        self.itemsPath = os.path.join(tmpDir, name + '.items')
+        self.offPath = os.path.join(tmpDir, name + '.off')
+        self.itemsFh = open(self.itemsPath, 'wb')
+        self.offFh = open(self.offPath, 'wb')
+        self.offFh.write(OFFSET.pack(0))
+        self.count = 0
+
+    def add(self, items):
+        codes = array(CODE_TYPE, [self.pool.add(item) for item in items])
+        codes.tofile(self.itemsFh)
+        self.count += len(codes)
+        self.offFh.write(OFFSET.pack(self.count))
+
+    def close(self):
+        self.pool.close()
+        self.itemsFh.close()
+        self.offFh.close()
+
+
+class GeneTableWriter(object):
+    '''
+    Write a gene table one gene at a time, without keeping the gene data in
+    memory.  Call addGenome() before adding the genes of each genome, and
+    close() to write the file or abort() to discard it.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.tmpDir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+        self.genes = _PoolWriter(self.tmpDir, 'gene')
+        self.genomes = _PoolWriter(self.tmpDir, 'genome')
+        self.names = _PoolWriter(self.tmpDir, 'name')
+        self.descs = _PoolWriter(self.tmpDir, 'desc')
+        self.geneIds = _ListWriter(self.tmpDir, 'geneids')
+        self.goTerms = _ListWriter(self.tmpDir, 'goterms', intern=True)
+        self.genomeCodesPath = os.path.join(self.tmpDir, 'genomecodes')
+        self.genomeCodesFh = open(self.genomeCodesPath, 'wb')
+        self.genomeStarts = [] # the first row of every genome
+        self.genomeCode = None
+        self.hashes = array(CODE_TYPE)
+
+    def addGenome(self, genome):
+        '''
+        genome: a genome id, which must not have been added before.  Genes
+        added after this are genes of genome.
+        '''
+        self.genomeCode = self.genomes.add(genome)
+        self.genomeStarts.append(self.genes.count)
+
+    def addGene(self, gene, geneName, geneDesc, geneIds, goTerms):
+        self.genes.add(gene)
+        self.hashes.append(geneHash(utf8(gene)))
+        self.names.add(geneName)
+        self.descs.add(geneDesc)
+        self.geneIds.add(geneIds)
+        self.goTerms.add(goTerms)
+        self.genomeCodesFh.write(CODE.pack(self.genomeCode))
+
+    def close(self):
+        try:
+            for w in [self.genes, self.genomes, self.names, self.descs, self.geneIds, self.goTerms]:
+                w.close()
+            self.genomeCodesFh.close()
+            sections = [('geneoff', self.genes.offPath), ('geneblob', self.genes.blobPath),
+                        ('genomeoff', self.genomes.offPath), ('genomeblob', self.genomes.blobPath),
+                        ('genomecodes', self.genomeCodesPath),
+                        ('nameoff', self.names.offPath), ('nameblob', self.names.blobPath),
+                        ('descoff', self.descs.offPath), ('descblob', self.descs.blobPath),
+                        ('geneidsoff', self.geneIds.offPath), ('geneidsitems', self.geneIds.itemsPath),
+                        ('geneidspooloff', self.geneIds.pool.offPath), ('geneidspoolblob', self.geneIds.pool.blobPath),
+                        ('gotermsoff', self.goTerms.offPath), ('gotermsitems', self.goTerms.itemsPath),
+                        ('gotermspooloff', self.goTerms.pool.offPath), ('gotermspoolblob', self.goTerms.pool.blobPath)]
+            self.genomeStarts.append(self.genes.count)
+            genomeStartsPath = os.path.join(self.tmpDir, 'genomestarts')
+            with open(genomeStartsPath, 'wb') as fh:
+                fh.write(struct.pack('<{}Q'.format(len(self.genomeStarts)), *self.genomeStarts))
+            hashPath = os.path.join(self.tmpDir, 'hash')
+            with open(hashPath, 'wb') as fh:
+                self._makeHashTable().tofile(fh)
+            sections += [('genomestarts', genomeStartsPath), ('hash', hashPath)]
+            self._writeFile(sections)
+        finally:
+            shutil.rmtree(self.tmpDir)
+
+    def abort(self):
+        for w in [self.genes, self.genomes, self.names, self.descs, self.geneIds, self.goTerms]:
+            w.close()
+        self.genomeCodesFh.close()
+        shutil.rmtree(self.tmpDir)
+
+    def _makeHashTable(self):
+        '''
+        returns: an open addressing hash table, with linear probing, of the
+        row + 1 of every gene.  0 marks an empty slot.
+        '''
+        size = 2
+        while size < 2 * len(self.hashes):
+            size *= 2
+        mask = size - 1
+        table = array(CODE_TYPE, [0]) * size
+        for row, h in enumerate(self.hashes):
+            slot = h & mask
+            while table[slot]:
+                slot = (slot + 1) & mask
+            table[slot] = row + 1
+        return table
+
+    def _writeFile(self, sections):
+        '''
+        Concatenate the sections, aligned to 8 bytes, after a header and
+        table of contents.
+        '''
+        offset = HEADER.size + SECTION.size * len(sections)
+        toc = []
+        for name, path in sections:
+            offset += -offset % 8
+            length = os.path.getsize(path)
+            toc.append((name, offset, length))
+            offset += length
+        tmpPath = self.path + '.tmp'
+        with open(tmpPath, 'wb') as out:
+            out.write(HEADER.pack(MAGIC, VERSION, self.genes.count, self.genomes.count, len(sections)))
+            for name, offset, length in toc:
+                out.write(SECTION.pack(name, offset, length))
+            for (name, path), (name, offset, length) in zip(sections, toc):
+                out.write('\0' * (offset - out.tell()))
+                with open(path, 'rb') as fh:
+                    shutil.copyfileobj(fh, out)
+        os.rename(tmpPath, self.path)
+
+
+############
+# READING
+
+class _Pool(object):
+    '''
+    The strings of a string pool, by index.
+    '''
+    def __init__(self, table, name):
+        self.mm = table.mm
+        self.offStart = table.sections[name + 'off'][0]
+        self.blobStart = table.sections[name + 'blob'][0]
+        self.count = table.sections[name + 'off'][1] // OFFSET.size - 1
+
+    def __getitem__(self, i):
+        start, = OFFSET.unpack_from(self.mm, self.offStart + i * OFFSET.size)
+        end, = OFFSET.unpack_from(self.mm, self.offStart + (i + 1) * OFFSET.size)
+        return self.mm[self.blobStart + start:self.blobStart + end].decode('utf-8')
+
+    def raw(self, i):
+        start, = OFFSET.unpack_from(self.mm, self.offStart + i * OFFSET.size)
+        end, = OFFSET.unpack_from(self.mm, self.offStart + (i + 1) * OFFSET.size)
+        return self.mm[self.blobStart + start:self.blobStart + end]
+
+    def __len__(self):
+        return self.count
+
+
+class _Lists(object):
+    '''
+    The lists of strings of a list column, by row.
+    '''
+    def __init__(self, table, name, cache=False):
+        self.mm = table.mm
+        self.offStart = table.sections[name + 'off'][0]
+        self.itemsStart = table.sections[name + 'items'][0]
+        self.pool = _Pool(table, name + 'pool')
+        # interned pools are small and repetitive, so decoded strings are cached.
+        self.cache = {} if cache else None
+
+    def __getitem__(self, row):
+        start, = OFFSET.unpack_from(self.mm, self.offStart + row * OFFSET.size)
+        end, = OFFSET.unpack_from(self.mm, self.offStart + (row + 1) * OFFSET.size)
+        codes = struct.unpack_from('<{}I'.format(end - start), self.mm, self.itemsStart + start * CODE.size)
+        if self.cache is None:
+            return [self.pool[code] for code in codes]
+        items = []
+        for code in codes:
+            if code not in self.cache:
+                self.cache[code] = self.pool[code]
+            items.append(self.cache[code])
+        return items
+
+
+class GeneTable(object):
+    '''
+    A gene table file, opened read-only with mmap.
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fh:
+            self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.numGenes, self.numGenomes, numSections = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise Exception('Unrecognized gene table file.', path, magic, version)
+        self.sections = {}
+        for i in range(numSections):
+            name, offset, length = SECTION.unpack_from(self.mm, HEADER.size + i * SECTION.size)
+            self.sections[name.rstrip('\0')] = (offset, length)
+        self.genes = _Pool(self, 'gene')
+        self.names = _Pool(self, 'name')
+        self.descs = _Pool(self, 'desc')
+        self.geneIds = _Lists(self, 'geneids')
+        self.goTerms = _Lists(self, 'goterms', cache=True)
+        genomePool = _Pool(self, 'genome')
+        self.genomes = [genomePool[i] for i in range(self.numGenomes)]
+        self.genomeToCode = {genome: i for i, genome in enumerate(self.genomes)}
+        self.genomeCodesStart = self.sections['genomecodes'][0]
+        self.genomeStartsStart = self.sections['genomestarts'][0]
+        self.hashStart, hashLength = self.sections['hash']
+        self.hashMask = hashLength // CODE.size - 1
+        self.lastGene = None # the most recently found gene and its row
+        self.lastRow = None
+
+    def close(self):
+        self.mm.close()
+
+    def row(self, gene):
+        '''
+        returns: the row of gene.  Raises KeyError if gene is not in the table.
+        '''
+        if gene == self.lastGene:
+            return self.lastRow
+        key = utf8(gene)
+        slot = geneHash(key) & self.hashMask
+        while True:
+            value, = CODE.unpack_from(self.mm, self.hashStart + slot * CODE.size)
+            if not value:
+                raise KeyError(gene)
+            if self.genes.raw(value - 1) == key:
+                self.lastGene, self.lastRow = gene, value - 1
+                return value - 1
+            slot = (slot + 1) & self.hashMask
+
+    def genomeRows(self, genome):
+        '''
+        returns: the range of the rows of the genes of genome.
+        '''
+        code = self.genomeToCode[genome]
+        start, = OFFSET.unpack_from(self.mm, self.genomeStartsStart + code * OFFSET.size)
+        end, = OFFSET.unpack_from(self.mm, self.genomeStartsStart + (code + 1) * OFFSET.size)
+        return xrange(start, end)
+
+    def genomeOf(self, row):
+        code, = CODE.unpack_from(self.mm, self.genomeCodesStart + row * CODE.size)
+        return self.genomes[code]
+
+    def geneToGenome(self):
+        return GeneColumn(self, self.genomeOf)
+
+    def geneToName(self):
+        return GeneColumn(self, self.names.__getitem__)
+
+    def geneToDesc(self):
+        return GeneColumn(self, self.descs.__getitem__)
+
+    def geneToGeneIds(self):
+        return GeneColumn(self, self.geneIds.__getitem__)
+
+    def geneToGoTerms(self):
+        return GeneColumn(self, self.goTerms.__getitem__)
+
+    def genomeToGenes(self):
+        return GenomeToGenes(self)
+
+
+class GeneColumn(collections.Mapping):
+    '''
+    A read-only dict from every gene in a table to its value in a column.
+    '''
+    def __init__(self, table, getValue):
+        self.table = table
+        self.getValue = getValue
+
+    def __getitem__(self, gene):
+        return self.getValue(self.table.row(gene))
+
+    def __contains__(self, gene):
+        try:
+            self.table.row(gene)
+            return True
+        except KeyError:
+            return False
+
+    def __iter__(self):
+        genes = self.table.genes
+        for row in xrange(self.table.numGenes):
+            yield genes[row]
+
+    def __len__(self):
+        return self.table.numGenes
+
+    def iteritems(self):
+        genes = self.table.genes
+        for row in xrange(self.table.numGenes):
+            yield genes[row], self.getValue(row)
+
+
+class GenomeToGenes(collections.Mapping):
+    '''
+    A read-only dict from every genome in a table to the list of its genes.
+    '''
+    def __init__(self, table):
+        self.table = table
+
+    def __getitem__(self, genome):
+        genes = self.table.genes
+        return [genes[row] for row in self.table.genomeRows(genome)]
+
+    def __contains__(self, genome):
+        return genome in self.table.genomeToCode
+
+    def __iter__(self):
+        return iter(self.table.genomes)
+
+    def __len__(self):
+        return self.table.numGenomes
@@ -0,0 +1,163 @@
+'''
+A compact, read-only file of the blast hits of a query genome against a
+subject genome, an alternative to pickling the hits map.
+
+A hits map is a dict from each query sequence id to a list of its hits, best
+first, each a tuple of the hit (subject) sequence id and the evalue (and any
+other numbers, e.g. the bitscore) of the hit.
+
+Sequence ids are stored once each, in string pools.  Hits are stored as
+arrays of integer subject sequence indexes and float64 values, with an
+offset table of the hits of each query.  The file is mmapped, so only the
+hits that are used are read and decoded.  Values are stored exactly, so
+comparing evalues to cutoffs like 1e-10 gives the same results as comparing
+the evalues blast reported.
+
+usage:
+
+    writeHits(hitsMap, path)
+    hits = HitsFile(path)
+    hits['P29311'] # [('Q6FJ19', 1e-50), ...]
+'''
+
+import collections
+import mmap
+import os
+import struct
+from array import array
+
+
+MAGIC = 'RHIT'
+VERSION = 2
+HEADER = struct.Struct('<4sIIIIII') # magic, version, num queries, num subjects, num hits, num values per hit, num sections
+SECTION = struct.Struct('<16sQQ') # name, offset, length
+OFFSET = struct.Struct('<Q')
+CODE_TYPE = 'I'
+VALUE_TYPE = 'd'
+assert array(CODE_TYPE).itemsize == 4 and array(VALUE_TYPE).itemsize == 8
+
+
+def writeHits(hitsMap, path):
+    '''
+    hitsMap: a dict from query ids to lists of (subject id, value, ...) hits.
+    Every hit must have the same number of values.
+    Write hitsMap to a hits file at path.
+    '''
+    queries = sorted(hitsMap)
+    subjectToCode = {}
+    subjects = []
+    hitOffsets = [0]
+    codes = array(CODE_TYPE)
+    values = array(VALUE_TYPE)
+    numValues = None
+    for query in queries:
+        for hit in hitsMap[query]:
+            if numValues is None:
+                numValues = len(hit) - 1
+            elif len(hit) - 1 != numValues:
+                raise Exception('Hits have different numbers of values.', query, hit)
+            if hit[0] not in subjectToCode:
+                subjectToCode[hit[0]] = len(subjects)
+                subjects.append(hit[0])
+            codes.append(subjectToCode[hit[0]])
+            values.extend(hit[1:])
+        hitOffsets.append(len(codes))
+    sections = (_poolSections('query', queries) + _poolSections('subject', subjects) +
+                [('hitoff', struct.pack('<{}Q'.format(len(hitOffsets)), *hitOffsets)),
+                 ('subjects', codes.tostring()), ('values', values.tostring())])
+
+    # concatenate the sections, aligned to 8 bytes, after a header and table of contents.
+    offset = HEADER.size + SECTION.size * len(sections)
+    toc = []
+    for name, data in sections:
+        offset += -offset % 8
+        toc.append((name, offset, len(data)))
+        offset += len(data)
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, VERSION, len(queries), len(subjects), len(codes),
+                              numValues or 0, len(sections)))
+        for name, offset, length in toc:
+            out.write(SECTION.pack(name, offset, length))
+        for (name, data), (name, offset, length) in zip(sections, toc):
+            out.write('\0' * (offset - out.tell()))
+            out.write(data)
+    os.rename(tmpPath, path)
+
+
+def _poolSections(name, strings):
+    '''
+    returns: the offset and blob sections of a pool of strings.
+    '''
+    offsets = [0]
+    for s in strings:
+        offsets.append(offsets[-1] + len(s))
+    return [(name + 'off', struct.pack('<{}Q'.format(len(offsets)), *offsets)),
+            (name + 'blob', ''.join(strings))]
+
+
+def loadHits(path):
+    '''
+    returns: the hits map in the hits file at path, as a dict.
+    '''
+    hits = HitsFile(path)
+    try:
+        return dict(hits.iteritems())
+    finally:
+        hits.close()
+
+
+class HitsFile(collections.Mapping):
+    '''
+    A hits file, opened read-only with mmap, as a mapping from query ids to
+    lists of hits.
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fh:
+            self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, numQueries, numSubjects, self.numHits, self.numValues,
+         numSections) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise Exception('Unrecognized hits file.', path, magic, version)
+        self.sections = {}
+        for i in range(numSections):
+            name, offset, length = SECTION.unpack_from(self.mm, HEADER.size + i * SECTION.size)
+            self.sections[name.rstrip('\0')] = (offset, length)
+        self.queries = self._pool('query', numQueries)
+        self.queryToIndex = dict((query, i) for i, query in enumerate(self.queries))
+        self.subjects = self._pool('subject', numSubjects)
+        self.hitOffStart = self.sections['hitoff'][0]
+        self.subjectsStart = self.sections['subjects'][0]
+        self.valuesStart = self.sections['values'][0]
+
+    def _pool(self, name, count):
+        offStart = self.sections[name + 'off'][0]
+        blobStart = self.sections[name + 'blob'][0]
+        offsets = struct.unpack_from('<{}Q'.format(count + 1), self.mm, offStart)
+        return [self.mm[blobStart + start:blobStart + end] for start, end in zip(offsets, offsets[1:])]
+
+    def close(self):
+        self.mm.close()
+
+    def __getitem__(self, query):
+        i = self.queryToIndex[query]
+        start, end = struct.unpack_from('<2Q', self.mm, self.hitOffStart + i * OFFSET.size)
+        n = end - start
+        codes = struct.unpack_from('<{}I'.format(n), self.mm, self.subjectsStart + start * 4)
+        k = self.numValues
+        values = struct.unpack_from('<{}d'.format(n * k), self.mm, self.valuesStart + start * k * 8)
+        return [(self.subjects[code],) + values[j * k:(j + 1) * k] for j, code in enumerate(codes)]
+
+    def __contains__(self, query):
+        return query in self.queryToIndex
+
+    def __iter__(self):
+        return iter(self.queries)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def iteritems(self):
+        for query in self.queries:
+            yield query, self[query]
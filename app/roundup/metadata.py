@@ -0,0 +1,447 @@
+'''
+Backends for storing the metadata of a dataset.  See the METADATA section of
+roundup.dataset for how metadata is used.
+
+JsonMetadata stores each big data key in its own json file and all the small
+keys together in one json file.  Reading any key loads the whole file.
+
+SqliteMetadata stores all the keys in one sqlite database.  Every item of a
+big data dict is a row, so an item can be looked up or written without
+loading or rewriting the whole dict, and reading a big data dict returns a
+LazyData mapping, which looks items up as they are used.  Sqlite locking is
+unreliable on some network filesystems, so the database should only be
+written by one process at a time, like the json files.
+
+MetadataCache keeps the data read from backends in memory, so it is not
+reread and parsed every time it is used.  Callers get a copy of small data,
+but share big data, which is too big to copy every time it is read.
+'''
+
+import collections
+import itertools
+import json
+import os
+import sqlite3
+import time
+
+
+JSON_BACKEND = 'json'
+SQLITE_BACKEND = 'sqlite'
+SQLITE_FILENAME = 'metadata.sqlite'
+BATCH_SIZE = 10000 # number of rows to insert at a time
+
+
+def getBackendName(ds):
+    '''
+    returns: the name of the backend storing the metadata of ds.  Datasets
+    with a sqlite database use it.  Otherwise, json files are used.
+    '''
+    if os.path.exists(os.path.join(ds, SQLITE_FILENAME)):
+        return SQLITE_BACKEND
+    else:
+        return JSON_BACKEND
+
+
+def openMetadata(ds, bigKeys, backend=None):
+    '''
+    ds: a dataset dir
+    bigKeys: keys whose data is big, e.g. a dict item for every gene.
+    backend: the name of a backend.  Defaults to getBackendName(ds).
+    returns: a metadata backend object.
+    '''
+    if backend is None:
+        backend = getBackendName(ds)
+    if backend == SQLITE_BACKEND:
+        return SqliteMetadata(ds, bigKeys)
+    elif backend == JSON_BACKEND:
+        return JsonMetadata(ds, bigKeys)
+    else:
+        raise ValueError('Unknown metadata backend.', backend)
+
+
+class JsonMetadata(object):
+    '''
+    Big data keys are stored in their own json file.  Small keys are stored
+    together in one json file, keyed by DATASET.
+    '''
+    DATASET = 'dataset'
+
+    def __init__(self, ds, bigKeys):
+        self.ds = ds
+        self.bigKeys = set(bigKeys)
+
+    def path(self, key):
+        return os.path.join(self.ds, 'metadata.{}.json'.format(key))
+
+    def paths(self):
+        '''
+        returns: the paths of the existing metadata files.
+        '''
+        keys = [self.DATASET] + sorted(self.bigKeys)
+        return [self.path(key) for key in keys if os.path.exists(self.path(key))]
+
+    def keys(self):
+        keys = [key for key in self.bigKeys if os.path.exists(self.path(key))]
+        return keys + self._load(self.DATASET, {}).keys()
+
+    def get(self, key, default=None):
+        if key in self.bigKeys: # big data stored in separate files
+            return self._load(key, default)
+        else: # small data all stored in one file
+            return self._load(self.DATASET, {}).get(key, default)
+
+    def set(self, key, data):
+        if key in self.bigKeys:
+            self._dump(key, data)
+        else: # small data all stored in one file
+            md = self._load(self.DATASET, {})
+            md[key] = data
+            self._dump(self.DATASET, md)
+
+    def getItem(self, key, item, default=None):
+        return self.get(key, {}).get(item, default)
+
+    def setItems(self, key, items):
+        data = self.get(key, {})
+        data.update(items)
+        self.set(key, data)
+
+    def writer(self, key):
+        return JsonDataWriter(self.path(key))
+
+    def stamp(self, key):
+        '''
+        returns: a value that changes when the data of key changes.
+        '''
+        return fileStamp(self.path(key if key in self.bigKeys else self.DATASET))
+
+    def cost(self, key):
+        '''
+        returns: the approximate size of the data of key, in bytes.
+        '''
+        stamp = self.stamp(key)
+        return stamp[-1] if stamp else 0
+
+    def _load(self, key, default=None):
+        '''
+        Deserialize and return the data cached in the file indexed by key.
+        Return default if the file does not exist.
+        '''
+        path = self.path(key)
+        if os.path.exists(path):
+            with open(path) as fh:
+                return json.load(fh)
+        else:
+            return default
+
+    def _dump(self, key, data):
+        '''
+        Serialize and save data to the file indexed by key.  The data is
+        written to a temporary file and renamed, so readers in other processes
+        never read a partly written file, and its stamp always changes.
+        '''
+        path = self.path(key)
+        with open(path + '.tmp', 'w') as fh:
+            json.dump(data, fh, indent=0)
+        os.rename(path + '.tmp', path)
+
+
+class JsonDataWriter(object):
+    '''
+    Write a dict to a json file one item at a time, instead of building the
+    whole dict in memory.  It is written to a temporary file which close()
+    renames over path, so a partly written file is never read.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.tmpPath = path + '.tmp'
+        self.fh = open(self.tmpPath, 'w')
+        self.fh.write('{')
+        self.count = 0
+
+    def write(self, item, value):
+        self.fh.write('\n' if not self.count else ', \n')
+        self.fh.write(json.dumps(item) + ': ' + json.dumps(value))
+        self.count += 1
+
+    def close(self):
+        self.fh.write('\n}')
+        self.fh.close()
+        os.rename(self.tmpPath, self.path)
+
+    def abort(self):
+        '''
+        Discard the written items, leaving the file at path untouched.
+        '''
+        self.fh.close()
+        os.remove(self.tmpPath)
+
+
+class SqliteMetadata(object):
+    '''
+    Metadata stored in a sqlite database in the dataset dir.  Small keys and
+    big data that is not a dict are stored as one json value in the data
+    table.  The items of a big data dict are stored as rows of the items
+    table.
+    '''
+    def __init__(self, ds, bigKeys):
+        self.ds = ds
+        self.bigKeys = set(bigKeys)
+        self.path = os.path.join(ds, SQLITE_FILENAME)
+        self.version = 0 # incremented by every write
+        self.conn = sqlite3.connect(self.path)
+        with self.conn:
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS data (
+                              key TEXT PRIMARY KEY, value TEXT)''')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS items (
+                              key TEXT, item TEXT, value TEXT, PRIMARY KEY (key, item))''')
+            # the big data keys stored as items.
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS dicts (key TEXT PRIMARY KEY)''')
+
+    def close(self):
+        self.conn.close()
+
+    def keys(self):
+        sql = 'SELECT key FROM data UNION SELECT key FROM dicts'
+        return [row[0] for row in self.conn.execute(sql)]
+
+    def isDict(self, key):
+        return bool(self.conn.execute('SELECT 1 FROM dicts WHERE key = ?', (key,)).fetchone())
+
+    def get(self, key, default=None):
+        if key in self.bigKeys and self.isDict(key):
+            return LazyData(self, key)
+        row = self.conn.execute('SELECT value FROM data WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key, data):
+        self.version += 1
+        with self.conn:
+            self._delete(key)
+            if key in self.bigKeys and isinstance(data, collections.Mapping):
+                self.conn.execute('INSERT INTO dicts (key) VALUES (?)', (key,))
+                self._insertItems(key, data.iteritems())
+            else:
+                self.conn.execute('INSERT INTO data (key, value) VALUES (?, ?)', (key, json.dumps(data)))
+
+    def getItem(self, key, item, default=None):
+        if key in self.bigKeys and self.isDict(key):
+            sql = 'SELECT value FROM items WHERE key = ? AND item = ?'
+            row = self.conn.execute(sql, (key, item)).fetchone()
+            return json.loads(row[0]) if row else default
+        return self.get(key, {}).get(item, default)
+
+    def setItems(self, key, items):
+        '''
+        items: a dict or an iterable of (item, value) pairs to add to or
+        replace in the big data dict of key.
+        '''
+        if isinstance(items, collections.Mapping):
+            items = items.iteritems()
+        if key not in self.bigKeys:
+            data = self.get(key, {})
+            data.update(items)
+            return self.set(key, data)
+        self.version += 1
+        with self.conn:
+            if not self.isDict(key):
+                self._delete(key)
+                self.conn.execute('INSERT INTO dicts (key) VALUES (?)', (key,))
+            self._insertItems(key, items)
+
+    def writer(self, key):
+        return SqliteDataWriter(self, key)
+
+    def stamp(self, key):
+        '''
+        returns: a value that changes when the database changes.  The version
+        catches writes by this object that do not change the file mtime.
+        '''
+        return (self.version, fileStamp(self.path))
+
+    def cost(self, key):
+        '''
+        returns: the approximate size of the data of key, in bytes.  LazyData
+        holds no items, so big data dicts cost next to nothing.
+        '''
+        row = self.conn.execute('SELECT length(value) FROM data WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    def _delete(self, key):
+        self.conn.execute('DELETE FROM data WHERE key = ?', (key,))
+        self.conn.execute('DELETE FROM items WHERE key = ?', (key,))
+        self.conn.execute('DELETE FROM dicts WHERE key = ?', (key,))
+
+    def _insertItems(self, key, items):
+        sql = 'INSERT OR REPLACE INTO items (key, item, value) VALUES (?, ?, ?)'
+        rows = ((key, item, json.dumps(value)) for item, value in items)
+        while True:
+            batch = list(itertools.islice(rows, BATCH_SIZE))
+            if not batch:
+                break
+            self.conn.executemany(sql, batch)
+
+
+class SqliteDataWriter(object):
+    '''
+    Write a big data dict to a SqliteMetadata one item at a time, in batches,
+    replacing any previous data of key when close() commits.
+    '''
+    def __init__(self, md, key):
+        self.md = md
+        self.key = key
+        self.batch = []
+        # the delete begins a transaction, committed by close().
+        self.md._delete(key)
+        self.md.conn.execute('INSERT INTO dicts (key) VALUES (?)', (key,))
+
+    def write(self, item, value):
+        self.batch.append((item, value))
+        if len(self.batch) >= BATCH_SIZE:
+            self.md._insertItems(self.key, self.batch)
+            self.batch = []
+
+    def close(self):
+        self.md._insertItems(self.key, self.batch)
+        self.md.conn.commit()
+        self.md.version += 1
+
+    def abort(self):
+        self.md.conn.rollback()
+
+
+class LazyData(collections.Mapping):
+    '''
+    A read-only dict of the items of a big data key in a SqliteMetadata, which
+    looks up items as they are used instead of loading them all.  Use dict()
+    to get a modifiable copy.
+    '''
+    def __init__(self, md, key):
+        self.md = md
+        self.key = key
+
+    def __getitem__(self, item):
+        sql = 'SELECT value FROM items WHERE key = ? AND item = ?'
+        row = self.md.conn.execute(sql, (self.key, item)).fetchone()
+        if not row:
+            raise KeyError(item)
+        return json.loads(row[0])
+
+    def __contains__(self, item):
+        sql = 'SELECT 1 FROM items WHERE key = ? AND item = ?'
+        return bool(self.md.conn.execute(sql, (self.key, item)).fetchone())
+
+    def __iter__(self):
+        for row in self.md.conn.execute('SELECT item FROM items WHERE key = ?', (self.key,)):
+            yield row[0]
+
+    def __len__(self):
+        return self.md.conn.execute('SELECT COUNT(*) FROM items WHERE key = ?', (self.key,)).fetchone()[0]
+
+    def iteritems(self):
+        sql = 'SELECT item, value FROM items WHERE key = ?'
+        for item, value in self.md.conn.execute(sql, (self.key,)):
+            yield item, json.loads(value)
+
+    def items(self):
+        return list(self.iteritems())
+
+    def itervalues(self):
+        for item, value in self.iteritems():
+            yield value
+
+    def values(self):
+        return list(self.itervalues())
+
+
+def fileStamp(path):
+    '''
+    returns: the inode, modification time and size of the file at path, which
+    change when the file is rewritten or replaced, or None if there is no file.
+    '''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime, st.st_size)
+
+
+def copyData(data):
+    '''
+    returns: a copy of data, deserialized json, that shares no lists or dicts
+    with it.  Faster than copy.deepcopy for json data.
+    '''
+    if isinstance(data, dict):
+        return dict((k, copyData(v)) for k, v in data.iteritems())
+    elif isinstance(data, list):
+        return [copyData(v) for v in data]
+    else:
+        return data
+
+
+_MISSING = object()
+
+
+class MetadataCache(object):
+    '''
+    A per-process cache of data read from metadata backends, keyed by dataset
+    and key.  Data is reread when the stamp of its backend changes, e.g. when
+    its file is modified, but the stamp is only checked if the data was last
+    checked more than checkSeconds ago, so frequently used data does not touch
+    the filesystem.  When the approximate size of the cached data exceeds
+    maxBytes, the least recently used data is evicted.  get() returns a copy
+    of the data of small keys, which callers may modify.  The data of big keys
+    (see openMetadata) is shared by all callers, so it must not be modified,
+    except to set it.
+    '''
+    def __init__(self, maxBytes, checkSeconds=0):
+        self.maxBytes = maxBytes
+        self.checkSeconds = checkSeconds
+        self.entries = collections.OrderedDict() # (pid, ds, key) -> (stamp, checkTime, cost, data), least recently used first
+        self.numBytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, md, key, default=None):
+        '''
+        md: a metadata backend
+        returns: the data of key from the cache, or from md if the data is not
+        cached or has changed.
+        '''
+        # child processes do not use data cached by their parent, which may be
+        # tied to the database connection of the parent.
+        cacheKey = (os.getpid(), md.ds, key)
+        now = time.time()
+        entry = self.entries.pop(cacheKey, None)
+        if entry:
+            stamp, checkTime, cost, data = entry
+            if now - checkTime >= self.checkSeconds:
+                checkTime = now if stamp == md.stamp(key) else None
+            if checkTime is not None:
+                self.hits += 1
+                self.entries[cacheKey] = (stamp, checkTime, cost, data) # most recently used
+                return default if data is _MISSING else self._copy(md, key, data)
+            self.numBytes -= cost
+        self.misses += 1
+        stamp = md.stamp(key)
+        data = md.get(key, _MISSING)
+        cost = md.cost(key)
+        if cost <= self.maxBytes:
+            self.entries[cacheKey] = (stamp, now, cost, data)
+            self.numBytes += cost
+            while self.numBytes > self.maxBytes:
+                lruKey, (lruStamp, lruTime, lruCost, lruData) = self.entries.popitem(last=False)
+                self.numBytes -= lruCost
+        return default if data is _MISSING else self._copy(md, key, data)
+
+    def _copy(self, md, key, data):
+        return data if key in md.bigKeys else copyData(data)
+
+    def invalidate(self, ds=None, key=None):
+        '''
+        Drop the cached data of key in ds, all the data of ds if key is None,
+        or all data if ds is None.
+        '''
+        for cacheKey in self.entries.keys():
+            if (ds is None or cacheKey[1] == ds) and (key is None or cacheKey[2] == key):
+                self.numBytes -= self.entries.pop(cacheKey)[2]
@@ -23,6 +23,10 @@ import util
 import settings # django settings
 
 
+# dataset metadata does not change while the website is serving it.
+roundup.dataset.setMetadataCacheCheckSeconds(webconfig.METADATA_CACHE_CHECK_SECONDS)
+
+
 #################################
 # DATASET FILE DOWNLOAD FUNCTIONS
 
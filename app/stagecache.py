@@ -0,0 +1,266 @@
+'''
+A cache of files staged (copied) from a shared filesystem to a local disk,
+shared by the processes on a node, so files used over and over (e.g. blast
+indexes of genomes) are copied once per node instead of once per use.
+
+Each entry is a dir containing copies of a set of files, named by a key.  When
+the entries use more than maxBytes of disk, the least recently used entries
+are removed, except entries in use, which are locked with shared flocks.  The
+total size of the entries is kept in a file, so entries are only listed when
+the cache is over its quota, not every time one is added.
+
+usage:
+
+    cache = StageCache('/tmp/stage_cache', maxBytes=10 * 2**30)
+    with cache.staged('YEAST', ['/share/YEAST.faa', '/share/YEAST.faa.pin']) as paths:
+        # paths are the local copies, in the same order.
+        ...
+
+Files made by a computation can be cached too, with put() and cached().
+Locking uses flock, so the cache dir should be on a filesystem supporting
+it, e.g. a local disk.
+'''
+
+import contextlib
+import fcntl
+import os
+import shutil
+import uuid
+
+
+LOCK_FILENAME = '.lock'
+SIZE_FILENAME = '.size'
+TMP_PREFIX = '.tmp_'
+ENTRY_LOCK_SUFFIX = '.lock'
+
+
+class StageCache(object):
+
+    def __init__(self, dir, maxBytes):
+        '''
+        dir: the local dir of the cache.  Created if it does not exist.
+        maxBytes: the disk quota of the cache.  Entries in use are never
+        removed, so the cache can exceed maxBytes while they are used.
+        '''
+        self.dir = dir
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+
+    @contextlib.contextmanager
+    def staged(self, key, paths):
+        '''
+        key: names the entry of the files.  Files with the same key must have
+        the same contents, e.g. include a dataset id in the key.
+        paths: the files to stage.  Their basenames must be unique.
+        yields: the paths of the local copies of the files, which are not
+        removed until the context exits.
+        '''
+        entryDir = os.path.join(self.dir, key)
+        tmpDir = None
+        if not os.path.isdir(entryDir):
+            # copy outside the cache lock, so processes can copy at once.
+            tmpDir = self._copy(paths)
+
+        with self._lock():
+            added = 0
+            if os.path.isdir(entryDir):
+                self.hits += 1
+            else:
+                if tmpDir is None: # removed since checked
+                    tmpDir = self._copy(paths)
+                added = _dirSize(tmpDir)
+                os.rename(tmpDir, entryDir)
+                tmpDir = None
+                self.misses += 1
+            # hold a shared lock while in use, so the entry is not removed.
+            entryLock = open(entryDir + ENTRY_LOCK_SUFFIX, 'a')
+            fcntl.flock(entryLock, fcntl.LOCK_SH)
+            os.utime(entryDir, None) # mark as recently used
+            self._addSize(added)
+
+        try:
+            if tmpDir is not None:
+                # another process staged the files first.
+                shutil.rmtree(tmpDir)
+            yield [os.path.join(entryDir, os.path.basename(path)) for path in paths]
+        finally:
+            fcntl.flock(entryLock, fcntl.LOCK_UN)
+            entryLock.close()
+
+    def put(self, key, paths):
+        '''
+        Copy the files in paths into the entry key, unless it already exists.
+        '''
+        tmpDir = self._copy(paths)
+        entryDir = os.path.join(self.dir, key)
+        with self._lock():
+            added = 0
+            if os.path.isdir(entryDir):
+                shutil.rmtree(tmpDir)
+            else:
+                added = _dirSize(tmpDir)
+                os.rename(tmpDir, entryDir)
+            os.utime(entryDir, None)
+            self._addSize(added)
+
+    @contextlib.contextmanager
+    def cached(self, key):
+        '''
+        yields: the paths of the files of the entry key, sorted, which are not
+        removed until the context exits, or None if the entry does not exist.
+        '''
+        entryDir = os.path.join(self.dir, key)
+        entryLock = None
+        with self._lock():
+            if os.path.isdir(entryDir):
+                entryLock = open(entryDir + ENTRY_LOCK_SUFFIX, 'a')
+                fcntl.flock(entryLock, fcntl.LOCK_SH)
+                os.utime(entryDir, None)
+        if entryLock is None:
+            self.misses += 1
+            yield None
+            return
+        self.hits += 1
+        try:
+            yield [os.path.join(entryDir, f) for f in sorted(os.listdir(entryDir))]
+        finally:
+            fcntl.flock(entryLock, fcntl.LOCK_UN)
+            entryLock.close()
+
+    def remove(self, key):
+        '''
+        Remove the entry key, waiting until it is no longer in use.  The cache
+        is not locked while waiting, so other entries can be used meanwhile.
+        '''
+        entryDir = os.path.join(self.dir, key)
+        while True:
+            with self._lock():
+                if not os.path.isdir(entryDir):
+                    return
+                entryLock = open(entryDir + ENTRY_LOCK_SUFFIX, 'a')
+                size = self._removeEntry(key, entryLock)
+                if size is not None:
+                    entryLock.close()
+                    self._addSize(-size, evict=False)
+                    return
+            # wait until the entry is not in use, then try again.
+            fcntl.flock(entryLock, fcntl.LOCK_EX)
+            fcntl.flock(entryLock, fcntl.LOCK_UN)
+            entryLock.close()
+
+    def _makeDir(self):
+        if not os.path.isdir(self.dir):
+            try:
+                os.makedirs(self.dir)
+            except OSError:
+                if not os.path.isdir(self.dir): # another process made it
+                    raise
+
+    def _copy(self, paths):
+        self._makeDir()
+        tmpDir = os.path.join(self.dir, TMP_PREFIX + uuid.uuid4().hex)
+        os.mkdir(tmpDir)
+        try:
+            for path in paths:
+                shutil.copy(path, tmpDir)
+        except:
+            shutil.rmtree(tmpDir)
+            raise
+        return tmpDir
+
+    @contextlib.contextmanager
+    def _lock(self):
+        self._makeDir()
+        with open(os.path.join(self.dir, LOCK_FILENAME), 'a') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def entries(self):
+        '''
+        returns: a list of (last used time, number of bytes, key) tuples of the
+        entries in the cache, least recently used first.
+        '''
+        entries = []
+        for name in os.listdir(self.dir):
+            entryDir = os.path.join(self.dir, name)
+            if name.startswith('.') or not os.path.isdir(entryDir):
+                continue
+            entries.append((os.path.getmtime(entryDir), _dirSize(entryDir), name))
+        return sorted(entries)
+
+    def totalBytes(self):
+        '''
+        returns: the total size of the entries in bytes, as kept by the cache.
+        '''
+        with self._lock():
+            return self._readSize()
+
+    def _addSize(self, delta, evict=True):
+        '''
+        Add delta bytes to the total size of the entries, after the entries
+        have changed, and evict entries if the total is over maxBytes, e.g.
+        because entries in use could not be removed before.  The total is
+        counted from the entries if it has not been kept yet.  Must be called
+        with the cache locked.
+        '''
+        kept = os.path.exists(os.path.join(self.dir, SIZE_FILENAME))
+        total = self._readSize() + (delta if kept else 0)
+        if evict and total > self.maxBytes:
+            total = self._evict()
+        elif kept and not delta:
+            return
+        path = os.path.join(self.dir, SIZE_FILENAME)
+        with open(path + '.tmp', 'w') as fh:
+            fh.write(str(max(0, total)))
+        os.rename(path + '.tmp', path)
+
+    def _readSize(self):
+        path = os.path.join(self.dir, SIZE_FILENAME)
+        if not os.path.exists(path):
+            return sum(size for mtime, size, key in self.entries())
+        with open(path) as fh:
+            return int(fh.read() or 0)
+
+    def _evict(self):
+        '''
+        Remove least recently used entries not in use until the cache uses at
+        most maxBytes.  Must be called with the cache locked.
+        returns: the total size of the remaining entries.
+        '''
+        entries = self.entries()
+        total = sum(size for mtime, size, key in entries)
+        for mtime, size, key in entries:
+            if total <= self.maxBytes:
+                break
+            with open(os.path.join(self.dir, key) + ENTRY_LOCK_SUFFIX, 'a') as entryLock:
+                if self._removeEntry(key, entryLock) is not None:
+                    total -= size
+        return total
+
+    def _removeEntry(self, key, entryLock):
+        '''
+        Remove the entry key unless it is in use.  Must be called with the
+        cache locked.
+        entryLock: the open lock file of the entry.
+        returns: the number of bytes removed, or None if the entry is in use.
+        '''
+        try:
+            fcntl.flock(entryLock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError: # in use
+            return None
+        entryDir = os.path.join(self.dir, key)
+        size = _dirSize(entryDir)
+        shutil.rmtree(entryDir)
+        os.remove(entryDir + ENTRY_LOCK_SUFFIX)
+        return size
+
+
+def _dirSize(dir):
+    '''
+    returns: the total size in bytes of the files in dir.
+    '''
+    return sum(os.path.getsize(os.path.join(dir, f)) for f in os.listdir(dir))
@@ -0,0 +1,108 @@
+import contextlib
+import sqlite3
+
+import batchdones
+
+
+class FakeDones(object):
+    '''
+    A dones object with only the methods every dones object has.
+    '''
+    def __init__(self):
+        self.keys = set()
+        self.numDone = 0
+
+    def done(self, key):
+        self.numDone += 1
+        return repr(key) in self.keys
+
+    def mark(self, key):
+        self.keys.add(repr(key))
+
+    def unmark(self, key):
+        self.keys.discard(repr(key))
+
+
+class FakeStore(object):
+    def __init__(self, connect, table):
+        self.connect = connect
+        self.table = table
+
+
+class FakeDbDones(FakeDones):
+    '''
+    Like a dones.DbDones, keeps json encoded keys in the table of a store.
+    '''
+    def __init__(self, connect, table):
+        super(FakeDbDones, self).__init__()
+        self.store = FakeStore(connect, table)
+
+    def _get_k(self):
+        return self.store
+
+
+class SqliteConn(object):
+    '''
+    A sqlite connection using the %s parameter style, like MySQLdb.
+    '''
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self):
+        return SqliteCursor(self.conn.cursor())
+
+
+class SqliteCursor(object):
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, sql, args=None):
+        return self.cursor.execute(sql.replace('%s', '?'), args or [])
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+
+
+def make_connect(tables):
+    conn = sqlite3.connect(':memory:')
+    for table in tables:
+        conn.execute('CREATE TABLE {} (name VARCHAR(255) PRIMARY KEY)'.format(table))
+
+    @contextlib.contextmanager
+    def connect():
+        yield SqliteConn(conn)
+    return connect, conn
+
+
+def test_done_many_with_done_only():
+    d = FakeDones()
+    d.mark(('blast', 'A', 'B'))
+    assert batchdones.done_many(d, [('blast', 'A', 'B'), ('blast', 'B', 'A')]) == [True, False]
+    d.unmark(('blast', 'A', 'B'))
+    assert batchdones.done_many(d, [('blast', 'A', 'B')]) == [False]
+
+
+def test_done_many_with_db_dones():
+    connect, conn = make_connect(['old_dones'])
+    conn.execute('INSERT INTO old_dones VALUES (?)', ['["blast", "A", "B"]'])
+    d = FakeDbDones(connect, 'old_dones')
+    keys = [('blast', 'A', 'B'), ('blast', 'B', 'A'), ['blast', 'A', 'B']]
+    assert batchdones.done_many(d, keys) == [True, False, True]
+    assert d.numDone == 0 # one query, not a done() per key
+
+
+def test_batch_dones_fallback():
+    connect, conn = make_connect(['batch_dones'])
+    conn.execute('INSERT INTO batch_dones VALUES (?)', ['"new"'])
+    fallback = FakeDones()
+    fallback.mark('old')
+    d = batchdones.BatchDones(connect, fallback=fallback)
+    d.ready = True # the table is made above, since create() is mysql sql.
+    d.mark('pending')
+    assert d.done_many(['new', 'old', 'pending', 'none']) == [True, True, True, False]
+    # only keys not done in the batch table or pending are checked in the fallback.
+    assert fallback.numDone == 2
+    assert d.done('old') and not d.done('none')
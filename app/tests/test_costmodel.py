@@ -0,0 +1,28 @@
+
+import math
+
+from roundup import costmodel
+
+
+def test_fit_model():
+    # running times that grow with the product of the genome residues.
+    sizes = [(n, n * l) for n in (100, 1000, 5000, 20000) for l in (200, 300, 500)]
+    samples = [(q, s, 1e-6 * q[1] * s[1]) for q in sizes for s in sizes if q != s]
+    model = costmodel.fitModel(samples)
+    assert model.numSamples == len(samples)
+    assert model.r2 > 0.999
+    for q, s, seconds in samples:
+        assert abs(model.predict(q, s) - seconds) / seconds < 0.01
+
+    model = costmodel.modelFromData(model.toData(), {'YEAST': (6000, 3e6), 'ECOLI': (4000, 1.3e6)})
+    assert abs(model.predict_pair_cost('YEAST', 'ECOLI') - 1e-6 * 3e6 * 1.3e6) < 0.01 * 3.9e6
+
+
+def test_solve():
+    x = costmodel.solve([[0.0, 2.0], [3.0, 1.0]], [4.0, 5.0])
+    assert [round(v, 9) for v in x] == [1.0, 2.0]
+    try:
+        costmodel.fitModel([])
+        assert False
+    except ValueError:
+        pass
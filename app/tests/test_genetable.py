@@ -0,0 +1,52 @@
+
+import os
+import shutil
+import tempfile
+
+from roundup import genetable
+
+
+GENOMES = [
+    ('559292', [(u'P29311', u'BMH1', u'Protein BMH1', [u'856924'], [u'GO:0005737', u'GO:0006995']),
+                (u'P34730', u'BMH2', u'Protein BMH2', [], [u'GO:0005737'])]),
+    ('284593', [(u'Q6FJ19', u'', u'Similar to uniprot|P29311 \xe9', [u'1', u'2'], [])]),
+    ('340016', []),
+]
+
+
+def setup_module():
+    global TMP_DIR
+    TMP_DIR = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(TMP_DIR)
+
+
+def test_gene_table():
+    path = os.path.join(TMP_DIR, 'genes.table')
+    writer = genetable.GeneTableWriter(path)
+    for genome, geneDatas in GENOMES:
+        writer.addGenome(genome)
+        for geneData in geneDatas:
+            writer.addGene(*geneData)
+    writer.close()
+    assert os.listdir(TMP_DIR) == ['genes.table']
+
+    table = genetable.GeneTable(path)
+    try:
+        geneDatas = [d for genome, datas in GENOMES for d in datas]
+        assert list(table.geneToName()) == [d[0] for d in geneDatas]
+        for gene, geneName, geneDesc, geneIds, goTerms in geneDatas:
+            assert table.geneToName()[gene] == geneName
+            assert table.geneToDesc()[gene] == geneDesc
+            assert table.geneToGeneIds()[gene] == geneIds
+            assert table.geneToGoTerms()[gene] == goTerms
+        assert dict(table.geneToGenome()) == {d[0]: genome for genome, datas in GENOMES for d in datas}
+        assert dict(table.genomeToGenes()) == {genome: [d[0] for d in datas] for genome, datas in GENOMES}
+        assert 'P29311' in table.geneToName()
+        assert 'missing' not in table.geneToName()
+        assert table.geneToName().get('missing') is None
+        assert len(table.geneToName()) == 3
+    finally:
+        table.close()
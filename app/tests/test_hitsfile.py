@@ -0,0 +1,52 @@
+
+import os
+import shutil
+import tempfile
+
+from roundup import hitsfile
+
+
+def setup_module():
+    global TMP_DIR
+    TMP_DIR = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(TMP_DIR)
+
+
+def test_hits_file():
+    hitsMap = {'Q1': [('S1', 1e-50, 200.0), ('S2', 0.5, 21.5)],
+               'Q2': [],
+               'Q3': [('S2', 1e-200, 800.0)]}
+    path = os.path.join(TMP_DIR, 'hits')
+    hitsfile.writeHits(hitsMap, path)
+    assert os.listdir(TMP_DIR) == ['hits']
+
+    hits = hitsfile.HitsFile(path)
+    try:
+        assert sorted(hits) == ['Q1', 'Q2', 'Q3']
+        assert 'Q2' in hits and 'S1' not in hits
+        assert hits['Q2'] == []
+        assert [(h[0], h[2]) for h in hits['Q1']] == [('S1', 200.0), ('S2', 21.5)]
+        assert hits['Q1'] == hitsMap['Q1']
+        assert hits['Q3'] == [('S2', 1e-200, 800.0)]
+    finally:
+        hits.close()
+    assert len(hitsfile.loadHits(path)) == 3
+    hitsfile.writeHits({}, path)
+    assert hitsfile.loadHits(path) == {}
+
+
+def test_hits_on_evalue_cutoffs():
+    # hits exactly on the standard evalue cutoffs must still pass them.
+    cutoffs = [1e-20, 1e-15, 1e-10, 1e-5]
+    path = os.path.join(TMP_DIR, 'cutoffs')
+    hitsfile.writeHits({'Q1': [('S{}'.format(i), e, 50.0) for i, e in enumerate(cutoffs)]}, path)
+    hits = hitsfile.HitsFile(path)
+    try:
+        assert [h[1] for h in hits['Q1']] == cutoffs
+        for evalue in cutoffs:
+            assert len([h for h in hits['Q1'] if h[1] <= evalue]) == cutoffs.index(evalue) + 1
+    finally:
+        hits.close()
@@ -208,3 +208,55 @@ def test_bsubmany():
     # finally, clean up tables.
     lsfdo.reset(ns)
 
+
+def test_local_executors():
+    '''
+    Test running tasks in local processes and in process, without lsf.
+    '''
+    ns = TEST_NS
+    for executor in [lsfdo.LOCAL_EXECUTOR, lsfdo.INLINE_EXECUTOR]:
+        tasks = get_func_tasks() + get_cmd_tasks()
+        lsfdo.reset(ns)
+        assert not lsfdo.all_done(ns, tasks)
+        lsfdo.bsubmany(ns, tasks, [[] for t in tasks], executor=executor)
+        assert lsfdo.all_done(ns, tasks)
+        # a failing task is not done.
+        failing = lsfdo.CmdTask(name='test_failing_task', cmd='exit 1', shell=True)
+        try:
+            lsfdo.bsubmany(ns, tasks + [failing], [[] for t in tasks] + [[]], executor=executor)
+            assert False, 'expected NotDoneError'
+        except lsfdo.NotDoneError:
+            pass
+        lsfdo.reset(ns)
+
+def test_index_spec():
+    assert lsfdo._index_spec([5, 1, 2, 3, 7, 8]) == '1-3,5,7-8'
+    assert lsfdo._index_spec([4]) == '4'
+
+
+def test_done_names():
+    '''
+    Task dones are checked with whatever methods the dones object has.
+    '''
+    class FakeDones(object):
+        def __init__(self):
+            self.keys = set()
+
+        def done(self, key):
+            return key in self.keys
+
+        def mark(self, key):
+            self.keys.add(key)
+
+        def unmark(self, key):
+            self.keys.discard(key)
+
+    d = FakeDones()
+    d.mark('test_func_task_1')
+    get_dones = lsfdo._get_dones
+    lsfdo._get_dones = lambda ns: d
+    try:
+        assert lsfdo._done_names(TEST_NS, get_func_tasks()) == set(['test_func_task_1'])
+        assert lsfdo._done_names(TEST_NS, ['test_func_task_0']) == set()
+    finally:
+        lsfdo._get_dones = get_dones
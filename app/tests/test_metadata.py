@@ -0,0 +1,97 @@
+
+import os
+import shutil
+import tempfile
+
+from roundup import metadata
+
+
+BIG_KEYS = ['gene_to_name', 'blast_stats']
+
+
+def setup_module():
+    global TMP_DIR
+    TMP_DIR = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(TMP_DIR)
+
+
+def check_backend(backend):
+    ds = os.path.join(TMP_DIR, backend)
+    os.mkdir(ds)
+    md = metadata.openMetadata(ds, BIG_KEYS, backend)
+    assert metadata.getBackendName(ds) == backend
+    assert md.get('genomes', []) == []
+    md.set('genomes', ['YEAST', 'ECOLI'])
+    md.set('blast_stats', [1, 2])
+    assert md.get('genomes') == ['YEAST', 'ECOLI']
+    assert md.get('blast_stats') == [1, 2]
+
+    writer = md.writer('gene_to_name')
+    for i in range(5):
+        writer.write('gene{}'.format(i), 'name{}'.format(i))
+    writer.close()
+    # an aborted writer leaves the data untouched.
+    writer = md.writer('gene_to_name')
+    writer.write('other', 'other')
+    writer.abort()
+    geneToName = md.get('gene_to_name')
+    assert len(geneToName) == 5
+    assert geneToName['gene3'] == 'name3'
+    assert 'other' not in geneToName
+    assert dict(geneToName.items()) == {'gene{}'.format(i): 'name{}'.format(i) for i in range(5)}
+
+    md.setItems('gene_to_name', {'gene3': 'new3', 'gene5': 'name5'})
+    assert md.getItem('gene_to_name', 'gene3') == 'new3'
+    assert md.getItem('gene_to_name', 'gene5') == 'name5'
+    assert md.getItem('gene_to_name', 'missing', 'x') == 'x'
+    assert sorted(md.keys()) == ['blast_stats', 'gene_to_name', 'genomes']
+
+
+def test_json_backend():
+    check_backend(metadata.JSON_BACKEND)
+
+
+def test_sqlite_backend():
+    check_backend(metadata.SQLITE_BACKEND)
+    ds = os.path.join(TMP_DIR, metadata.SQLITE_BACKEND)
+    # data is read lazily from the database by a new backend object.
+    geneToName = metadata.openMetadata(ds, BIG_KEYS).get('gene_to_name')
+    assert isinstance(geneToName, metadata.LazyData)
+    assert geneToName.get('gene1') == 'name1'
+    assert len(list(geneToName)) == 6
+
+
+def test_metadata_cache():
+    ds = os.path.join(TMP_DIR, 'cache')
+    os.mkdir(ds)
+    md = metadata.openMetadata(ds, BIG_KEYS)
+    md.set('gene_to_name', {'gene1': 'name1'})
+    cache = metadata.MetadataCache(maxBytes=10**6)
+    assert cache.get(md, 'gene_to_name') == {'gene1': 'name1'}
+    # big data is shared, small data is copied, so modifying it does not
+    # modify the cached data.
+    assert cache.get(md, 'gene_to_name') is cache.get(md, 'gene_to_name')
+    md.set('job_costs', {'job1': [1, 2]})
+    cache.get(md, 'job_costs')['job1'].append(3)
+    assert cache.get(md, 'job_costs') == {'job1': [1, 2]}
+    assert cache.get(md, 'missing', 'x') == 'x'
+    assert (cache.hits, cache.misses) == (3, 3)
+    # changed data is reread.
+    md.set('gene_to_name', {'gene1': 'name2'})
+    assert cache.get(md, 'gene_to_name') == {'gene1': 'name2'}
+    # unless it was checked recently.
+    cache.checkSeconds = 60
+    md.set('gene_to_name', {'gene1': 'name3'})
+    assert cache.get(md, 'gene_to_name') == {'gene1': 'name2'}
+    cache.invalidate(ds)
+    assert cache.get(md, 'gene_to_name') == {'gene1': 'name3'}
+    # the least recently used data is evicted to stay under maxBytes.
+    md.set('genomes', ['YEAST'])
+    cache = metadata.MetadataCache(maxBytes=max(md.cost('gene_to_name'), md.cost('genomes')))
+    cache.get(md, 'gene_to_name')
+    cache.get(md, 'genomes')
+    assert cache.numBytes <= cache.maxBytes
+    assert [k[2] for k in cache.entries] == ['genomes']
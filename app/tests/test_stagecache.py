@@ -0,0 +1,72 @@
+
+import os
+import shutil
+import tempfile
+
+import stagecache
+
+
+def setup_module():
+    global TMP_DIR
+    TMP_DIR = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(TMP_DIR)
+
+
+def makeFiles(name, numBytes):
+    paths = [os.path.join(TMP_DIR, name + suffix) for suffix in ['.faa', '.faa.pin']]
+    for path in paths:
+        with open(path, 'w') as fh:
+            fh.write(name[0] * numBytes)
+    return paths
+
+
+def test_stage_cache():
+    cache = stagecache.StageCache(os.path.join(TMP_DIR, 'cache'), maxBytes=400)
+    paths = makeFiles('A', 100)
+    with cache.staged('A', paths) as staged:
+        assert [os.path.basename(p) for p in staged] == ['A.faa', 'A.faa.pin']
+        assert open(staged[0]).read() == 'A' * 100
+    with cache.staged('A', paths) as staged:
+        pass
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # B fits in the quota.  C does not, so A, the least recently used entry
+    # not in use, is removed.
+    with cache.staged('A', paths):
+        with cache.staged('B', makeFiles('B', 100)):
+            with cache.staged('C', makeFiles('C', 50)):
+                assert sorted(key for t, n, key in cache.entries()) == ['A', 'B', 'C']
+        with cache.staged('C', makeFiles('C', 50)):
+            pass
+    assert sorted(key for t, n, key in cache.entries()) == ['A', 'C']
+    assert sum(n for t, n, key in cache.entries()) <= cache.maxBytes
+
+
+def test_put_and_cached():
+    cache = stagecache.StageCache(os.path.join(TMP_DIR, 'put'), maxBytes=10**6)
+    with cache.cached('hits') as paths:
+        assert paths is None
+    cache.put('hits', makeFiles('H', 10))
+    with cache.cached('hits') as paths:
+        assert [os.path.basename(p) for p in paths] == ['H.faa', 'H.faa.pin']
+        assert open(paths[1]).read() == 'H' * 10
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.remove('hits')
+    with cache.cached('hits') as paths:
+        assert paths is None
+
+
+def test_size_ledger():
+    cache = stagecache.StageCache(os.path.join(TMP_DIR, 'ledger'), maxBytes=300)
+    cache.put('A', makeFiles('A', 50))
+    cache.put('B', makeFiles('B', 50))
+    assert cache.totalBytes() == 200
+    cache.remove('A')
+    assert cache.totalBytes() == 100
+    # over quota, so the entries are listed and the least recently used removed.
+    cache.put('C', makeFiles('C', 150))
+    assert cache.totalBytes() == 300
+    assert [key for t, n, key in cache.entries()] == ['C']
@@ -0,0 +1,210 @@
+
+import cStringIO
+import gzip
+import os
+import shutil
+import tempfile
+
+import uniprot
+
+
+# Three abbreviated entries in the uniprot dat format.
+# http://web.expasy.org/docs/userman.html
+TEST_DAT = '''ID   1433B_YEAST             Reviewed;         267 AA.
+AC   P29311; D6VRK3;
+DT   01-APR-1993, integrated into UniProtKB/Swiss-Prot.
+DT   01-APR-1993, sequence version 4.
+DT   16-OCT-2013, entry version 140.
+DE   RecName: Full=Protein BMH1;
+GN   Name=BMH1; OrderedLocusNames=YER177W;
+OS   Saccharomyces cerevisiae (strain ATCC 204508 / S288c) (Baker's yeast).
+OC   Eukaryota; Fungi; Dikarya; Ascomycota; Saccharomycotina;
+OX   NCBI_TaxID=559292;
+RN   [1]
+RA   van Heusden G.P.H., Wenzel T.J., Lagendijk E.L.;
+RT   "Characterization of the yeast BMH1 gene encoding a putative protein
+RT   homologous to mammalian protein kinase II activators.";
+CC   -!- FUNCTION: Involved in growth regulation.
+DR   GeneID; 856924; -.
+DR   GO; GO:0005737; C:cytoplasm; IDA:SGD.
+DR   GO; GO:0006995; P:cellular response to nitrogen starvation; IGI:SGD.
+PE   1: Evidence at protein level;
+KW   3D-structure; Acetylation; Complete proteome; Phosphoprotein;
+KW   Reference proteome.
+FT   CHAIN         1    267       Protein BMH1.
+SQ   SEQUENCE   267 AA;  30091 MW;  2F9FC1A77F1B5C4B CRC64;
+     MSTSREDSVY LAKLAEQAER YEEMVENMKT VASSGQELSV EERNLLSVAY KNVIGARRAS
+     WRIVSSIEQK EESKEKSEHQ VELICSYRSK IETELTKISD DILSVLDSHL IPSATTGESK
+     VFYYKMKGDY HRYLAEFSSG DAREKATNAS LEAYKTASEI ATTELPPTHP IRLGLALNFS
+     VFYYEIQNSP DKACHLAKQA FDDAIAELDT LSEESYKDST LIMQLLRDNL TLWTSDMSES
+     GQAEDQQQQQ QHQQQQPPAA AEGEAPK
+//
+ID   Q6FJ19_CANGA            Unreviewed;       120 AA.
+AC   Q6FJ19;
+DT   05-JUL-2004, integrated into UniProtKB/TrEMBL.
+DT   05-JUL-2004, sequence version 1.
+DE   SubName: Full=Similar to uniprot|P29311 Saccharomyces cerevisiae;
+GN   OrderedLocusNames=CAGL0M13211g;
+OS   Candida glabrata (strain ATCC 2001 / CBS 138 / JCM 3761 / NBRC 0622 /
+OS   NRRL Y-65) (Yeast) (Torulopsis glabrata).
+OX   NCBI_TaxID=284593;
+PE   4: Predicted;
+KW   Complete proteome.
+SQ   SEQUENCE   120 AA;  13329 MW;  9A2C3FB6D4C3A2E1 CRC64;
+     MSQSREDSVY LAKLAEQAER YEEMVENMKA VASSGQELSV EERNLLSVAY KNVIGARRAS
+     WRIVSSIEQK EESKEKSEHQ VELIRSYRSK IETELTKISD DILSVLDSHL IPSATTGESK
+//
+ID   A0A023_9VIRU            Unreviewed;        60 AA.
+AC   A0A023;
+DT   09-JUL-2014, sequence version 1.
+DE   SubName: Full=Capsid protein;
+OS   Uncultured virus.
+OX   NCBI_TaxID=340016;
+PE   4: Predicted;
+SQ   SEQUENCE   60 AA;  6721 MW;  0D6F2B3AC5C1E4F1 CRC64;
+     MKRSRSTRRS KKSVKRVVRK KTARRTTARR SSRRSKRVAK PRRTTRRRRR SRRSRKRSRR
+//
+'''
+
+# an entry with surprises: two OX and PE lines and an empty sequence line,
+# and a sequence line with tabs.
+SURPRISE_DAT = '''ID   Q6FJ20_CANGA            Unreviewed;        30 AA.
+AC   Q6FJ20;
+DT   05-JUL-2004, sequence version 1.
+OS   Candida glabrata.
+OX   NCBI_TaxID=284593;
+OX   NCBI_TaxID=284594;
+PE   4: Predicted;
+PE   3: Inferred from homology;
+SQ   SEQUENCE   30 AA;  3329 MW;  9A2C3FB6D4C3A2E2 CRC64;
+     MSQSREDSVY\tLAKLAEQAER\t
+     \n     YEEMVENMKA
+//
+'''
+
+
+def setup_module():
+    global TMP_DIR, DAT_PATH
+    TMP_DIR = tempfile.mkdtemp()
+    DAT_PATH = os.path.join(TMP_DIR, 'test.dat')
+    with open(DAT_PATH, 'w') as fh:
+        fh.write(TEST_DAT)
+
+
+def teardown_module():
+    shutil.rmtree(TMP_DIR)
+
+
+def test_gen_dat_entries():
+    entries = list(uniprot.genDatEntries(DAT_PATH))
+    assert [e[1] for e in entries] == ['P29311', 'Q6FJ19', 'A0A023']
+
+    (ns, acc, orgCode, orgName, taxon, geneName, geneDesc, complete,
+     reference, geneIds, goTerms, fastaLines, surprises) = entries[0]
+    assert ns == 'sp'
+    assert orgCode == 'YEAST'
+    assert orgName == 'Saccharomyces cerevisiae (strain ATCC 204508 / S288c)'
+    assert taxon == '559292'
+    assert geneName == 'BMH1'
+    assert geneDesc == 'Protein BMH1'
+    assert complete and reference
+    assert geneIds == ['856924']
+    assert goTerms == ['GO:0005737', 'GO:0006995']
+    assert fastaLines[0] == '>sp|P29311|1433B_YEAST Protein BMH1 OS=Saccharomyces cerevisiae (strain ATCC 204508 / S288c) GN=BMH1 PE=1 SE=4\n'
+    assert fastaLines[1] == 'MSTSREDSVYLAKLAEQAERYEEMVENMKTVASSGQELSVEERNLLSVAYKNVIGARRAS\n'
+    assert ''.join(fastaLines[1:]).count('\n') == 5
+
+    # trembl entry without a gene name or RecName description.
+    assert entries[1][0] == 'tr'
+    assert entries[1][5] == ''
+    assert entries[1][7] and not entries[1][8]
+    # non-complete entry
+    assert not entries[2][7]
+
+
+def test_parsers_agree():
+    # the block parser yields the same entries as the line-by-line parser.
+    assert uniprot.benchmarkDatParsing(DAT_PATH)['entries'] == 3
+    ranges = uniprot.splitDat(DAT_PATH, 2)
+    byLine = [e[:-1] for e in uniprot.genDatEntriesByLine(DAT_PATH, ranges)]
+    assert [e[:-1] for e in uniprot.genDatEntriesAt(DAT_PATH, ranges)] == byLine
+    # entries split across tiny blocks
+    texts = list(uniprot.genDatEntryTexts(DAT_PATH, blockSize=7))
+    assert [uniprot.parseDatEntry(t)[:-1] for t in texts] == [e[:-1] for e in uniprot.genDatEntries(DAT_PATH)]
+    # no surprises in well-formed entries
+    assert all(not e[-1] for e in uniprot.genDatEntriesAt(DAT_PATH, ranges))
+
+
+def test_split_dat():
+    entries = list(uniprot.genDatEntries(DAT_PATH))
+    for n in range(1, 6):
+        ranges = uniprot.splitDat(DAT_PATH, n)
+        assert ranges[0][0] == 0
+        assert ranges[-1][1] == os.path.getsize(DAT_PATH)
+        # the ranges cover every entry exactly once.
+        rangeEntries = [e for start, end in ranges for e in
+                        uniprot.genDatEntries(DAT_PATH, start, end)]
+        assert [e[1] for e in rangeEntries] == [e[1] for e in entries]
+        assert [e[11] for e in rangeEntries] == [e[11] for e in entries]
+
+
+def test_dat_index():
+    indexPath = DAT_PATH + '.idx'
+    assert uniprot.indexDat(DAT_PATH, indexPath) == 3
+    index = uniprot.DatIndex(indexPath)
+    try:
+        records = list(index)
+        assert [r[2:4] for r in records] == [('559292', 'YEAST'), ('284593', 'CANGA'), ('340016', '9VIRU')]
+        assert records[0][4] == uniprot.COMPLETE_FLAG | uniprot.REFERENCE_FLAG | uniprot.SPROT_FLAG
+        assert records[1][4] == uniprot.COMPLETE_FLAG
+        assert records[-1][0] + records[-1][1] == os.path.getsize(DAT_PATH)
+
+        # adjacent complete entries are merged into one range.
+        ranges = index.ranges(flags=uniprot.COMPLETE_FLAG)
+        assert ranges == [(0, records[1][0] + records[1][1])]
+        ranges = index.ranges(taxons=set(['284593']))
+        entries = list(uniprot.genDatEntriesAt(DAT_PATH, ranges))
+        assert [e[1] for e in entries] == ['Q6FJ19']
+    finally:
+        index.close()
+
+
+def test_gzipped_dat():
+    gzPath = DAT_PATH + '.gz'
+    with open(gzPath, 'wb') as fh:
+        # two gzip members, split in the middle of a line.
+        middle = len(TEST_DAT) // 2
+        fh.write(gzipString(TEST_DAT[:middle]))
+        fh.write(gzipString(TEST_DAT[middle:]))
+    # use tiny blocks and a tiny queue to exercise the decompression thread.
+    assert list(uniprot.genGzipLines(gzPath, blockSize=50, queueSize=2)) == TEST_DAT.splitlines(True)
+    entries = list(uniprot.genDatEntries(DAT_PATH))
+    assert list(uniprot.genDatEntries(gzPath)) == entries
+    assert uniprot.splitDat(gzPath, 4) == [(0, None)]
+
+
+def gzipString(text):
+    out = cStringIO.StringIO()
+    with gzip.GzipFile(fileobj=out, mode='wb') as fh:
+        fh.write(text)
+    return out.getvalue()
+
+
+
+
+def test_parse_dat_surprises():
+    path = os.path.join(TMP_DIR, 'surprise.dat')
+    with open(path, 'w') as fh:
+        fh.write(TEST_DAT + SURPRISE_DAT + SURPRISE_DAT)
+    entries = list(uniprot.genDatEntries(path))
+    assert [s.split('\t')[0] for s in entries[3][-1]] == ['many_OX_lines', 'many_PE_lines', 'empty_seq_line']
+    assert entries[3][-1][0] == '\t'.join(('many_OX_lines', 'Q6FJ20', 'CANGA', path, '4', ''))
+    # surprises are reported with their entry, not accumulated.
+    assert [len(e[-1]) for e in entries] == [0, 0, 0, 3, 3]
+    # all whitespace is removed from sequence lines.
+    assert entries[3][11][1:] == ['MSQSREDSVYLAKLAEQAER\n', 'YEEMVENMKA\n']
+    # the line parser finds the same surprises, accumulated across entries.
+    byLine = [(e[:-1], list(e[-1])) for e in uniprot.genDatEntriesByLine(path, [(0, None)])]
+    assert [e[0] for e in byLine] == [e[:-1] for e in entries]
+    assert byLine[-1][1] == entries[3][-1] + entries[4][-1]
+    assert uniprot.benchmarkDatParsing(path)['entries'] == 5
@@ -0,0 +1,28 @@
+
+import util
+
+
+def test_pack_longest_first():
+    groups, totals = util.packLongestFirst(['a', 'b', 'c', 'd'], [5, 4, 3, 2], 2)
+    assert groups == [['a', 'd'], ['b', 'c']]
+    assert totals == [7, 7]
+    # one very costly element gets a group of its own.
+    costs = [100, 1, 1, 1, 1, 1, 1]
+    groups, totals = util.packLongestFirst(range(7), costs, 3)
+    assert groups[0] == [0]
+    assert sorted(totals) == [3, 3, 100]
+    assert sorted(sum(groups, [])) == range(7)
+    # more groups than elements
+    assert util.packLongestFirst(['a'], [1], 3) == ([['a'], [], []], [1, 0, 0])
+
+
+def test_log_histogram():
+    h = util.LogHistogram()
+    assert h.percentile(50) is None
+    for x in range(1, 1001):
+        h.add(x)
+    h.add(0)
+    for p, exact in [(50, 500), (90, 900), (100, 1000)]:
+        assert abs(h.percentile(p) / exact - 1) < 0.03
+    assert h.percentile(0) == 0.0
+    assert len(h.binToCount) <= 302
@@ -0,0 +1,66 @@
+
+import os
+import shutil
+import tempfile
+import threading
+
+import workqueue
+
+
+def setup_module():
+    global TMP_DIR
+    TMP_DIR = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(TMP_DIR)
+
+
+def test_sqlite_work_queue():
+    queue = workqueue.SqliteWorkQueue(os.path.join(TMP_DIR, 'queue.sqlite')).reset()
+    queue.putMany([['A', 'B'], ['A', 'C'], ['B', 'C']])
+    assert queue.counts() == {'unclaimed': 3, 'claimed': 0, 'done': 0}
+
+    id1, item1, numClaims = queue.claim('w1')
+    assert (item1, numClaims) == (['A', 'B'], 1)
+    id2, item2, numClaims = queue.claim('w2')
+    assert item2 == ['A', 'C']
+    queue.done(id1)
+    assert queue.isDone(id1) and not queue.isDone(id2)
+    assert queue.counts() == {'unclaimed': 1, 'claimed': 1, 'done': 1}
+
+    # w2 died.  its claim is released and claimed again, after the items
+    # before it in the queue.
+    assert queue.release(worker='w2') == 1
+    id3, item3, numClaims = queue.claim('w1')
+    assert (id3, item3, numClaims) == (id2, ['A', 'C'], 2)
+    queue.done(id3)
+    assert queue.items(worker='w1', done=True) == [(id1, ['A', 'B']), (id2, ['A', 'C'])]
+    id4, item4, numClaims = queue.claim('w1')
+    queue.done(id4)
+    assert queue.claim('w1') is None
+    assert queue.release() == 0
+    assert queue.counts() == {'unclaimed': 0, 'claimed': 0, 'done': 3}
+
+
+def test_concurrent_claims():
+    queue = workqueue.SqliteWorkQueue(os.path.join(TMP_DIR, 'concurrent.sqlite')).reset()
+    queue.putMany(range(100))
+    workerToItems = {}
+
+    def work(worker):
+        items = workerToItems[worker] = []
+        while True:
+            claimed = queue.claim(worker)
+            if claimed is None:
+                break
+            items.append(claimed[1])
+            queue.done(claimed[0])
+
+    threads = [threading.Thread(target=work, args=['w{}'.format(i)]) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # every item is claimed by exactly one worker.
+    assert sorted(item for items in workerToItems.values() for item in items) == range(100)
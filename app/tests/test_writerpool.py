@@ -0,0 +1,47 @@
+
+import os
+import shutil
+import tempfile
+
+import writerpool
+
+
+def setup_module():
+    global TMP_DIR
+    TMP_DIR = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(TMP_DIR)
+
+
+def test_writer_pool():
+    paths = [os.path.join(TMP_DIR, 'file{}.txt'.format(i)) for i in range(5)]
+    with open(paths[0], 'w') as fh:
+        fh.write('old contents\n')
+    # a tiny buffer and pool, so files are flushed often and closed and reopened.
+    with writerpool.WriterPool(bufBytes=10, maxOpen=2) as pool:
+        for i in range(20):
+            for path in paths:
+                pool.write(path, '{}\n'.format(i))
+            assert len(pool.handles) <= 2
+    # files are truncated when first opened and appended to when reopened.
+    for path in paths:
+        with open(path) as fh:
+            assert fh.read() == ''.join('{}\n'.format(i) for i in range(20))
+    stats = pool.stats()
+    assert stats['bytes'] == 5 * len(''.join('{}\n'.format(i) for i in range(20)))
+    assert stats['opens'] > 5
+    assert not pool.handles
+
+
+def test_writer_pool_keeps_files_open():
+    path = os.path.join(TMP_DIR, 'open.txt')
+    pool = writerpool.WriterPool(bufBytes=1)
+    for i in range(10):
+        pool.writelines(path, ['a', 'b\n'])
+    pool.close()
+    assert pool.stats()['flushes'] == 10
+    assert pool.stats()['opens'] == 1
+    with open(path) as fh:
+        assert fh.read() == 'ab\n' * 10
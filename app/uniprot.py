@@ -2,13 +2,27 @@
 Code for parsing uniprot files.
 '''
 
+import Queue
+import contextlib
+import cStringIO
 import datetime
+import itertools
+import mmap
+import os
 import re
+import struct
+import threading
+import time
+import zlib
 
 
 COMPLETE_PROTEOME_KW = 'Complete proteome'
 REFERENCE_PROTEOME_KW = 'Reference proteome'
 
+GZIP_BLOCK_SIZE = 4 * 2**20 # read gzipped dat files 4MB at a time
+GZIP_QUEUE_SIZE = 16 # number of decompressed blocks to buffer ahead of the parser
+DAT_BLOCK_SIZE = 8 * 2**20 # read uncompressed dat files 8MB at a time
+
 
 def parseRelease(path):
     '''
@@ -25,11 +39,246 @@ def parseRelease(path):
         return match.group(1)
 
 
-def genDatEntries(path):
+def splitDat(path, n):
     '''
     path: uniprot dat file
+    n: the number of byte ranges to split the file into.
+    Split an uncompressed dat file into up to n byte ranges of about the same size.  Every
+    range starts at the beginning of an entry (an ID line) and ends just after
+    the '//' line of an entry, so each range can be parsed independently, e.g.
+    by a different process.  A gzipped dat file is not split.
+    returns: a list of (start, end) byte offsets.
+    '''
+    if isGzipped(path):
+        # a gzipped file can not be seeked into, so it is parsed whole.
+        return [(0, None)]
+    size = os.path.getsize(path)
+    boundaries = [0]
+    with open(path, 'rb') as fh:
+        for i in range(1, n):
+            offset = size * i // n
+            if offset <= boundaries[-1]:
+                continue # the previous entry extends past this offset
+            fh.seek(offset)
+            fh.readline() # skip the (probably partial) line at offset
+            for line in iter(fh.readline, ''):
+                if line.startswith('//'):
+                    break
+            boundary = fh.tell()
+            if boundary >= size:
+                break
+            boundaries.append(boundary)
+    boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries[:-1], boundaries[1:]) if start < end]
+
+
+def genDatEntries(path, start=0, end=None):
+    '''
+    path: uniprot dat file
+    start: byte offset of the first entry to parse.  Should be the start of an
+    entry, e.g. an offset from splitDat().
+    end: byte offset of the end of the last entry to parse, e.g. an offset from
+    splitDat().  If None, parse to the end of the file.
     parses a uniprot dat file, yielding data about each entry.
     '''
+    return genDatEntriesAt(path, [(start, end)])
+
+
+def genDatEntriesAt(path, ranges):
+    '''
+    path: uniprot dat file
+    ranges: a list of (start, end) byte offsets of the entries to parse, e.g.
+    from splitDat() or DatIndex.ranges().  See genDatEntries().
+    parses the byte ranges of a uniprot dat file, yielding data about each
+    entry: (fastaNS, acc, orgCode, orgName, taxon, geneName, geneDesc,
+    complete, reference, geneIds, goTerms, fastaLines, surprises).
+    '''
+    print 'gathering ids in {} from {} byte ranges...'.format(path, len(ranges)), datetime.datetime.now()
+    entryNum = 0 # count entries
+    with contextlib.closing(genDatEntryTexts(path, ranges)) as texts:
+        for text in texts:
+            entryNum += 1
+            if entryNum % 100000 == 0: print 'entry count:', entryNum
+            yield parseDatEntry(text, path, entryNum)
+
+
+# The lines of a dat entry are in a fixed order: ID, AC, DT, DE, GN, OS, OG,
+# OC, OX, OH, references (RN, RP, ...), CC, DR, PE, KW, FT, SQ, sequence, //.
+# http://web.expasy.org/docs/userman.html is indispensible for parsing Uniprot DAT files
+# parseDatEntry() uses that order to jump to the few lines it needs, so the
+# many lines it does not need (OC, references, CC, most DR, FT) are skipped by
+# fast string searches and never split into lines or looked at in python.
+DAT_DESC_RE = re.compile('DE   RecName: Full=([^;\n]+)')
+# Gene Name is optional.  There can only be one.
+DAT_NAME_RE = re.compile('Name=([^;]+)')
+DAT_TAXON_RE = re.compile('NCBI_TaxID=([^;\n]+)')
+DAT_GENE_ID_RE = re.compile('\nDR   GeneID; ([^;\n]*)')
+DAT_GO_TERM_RE = re.compile('\nDR   GO; ([^;\n]*)')
+# the whitespace removed from sequence lines, except the newlines between them.
+DAT_SEQ_SPACE = ' \t\r\x0b\x0c'
+
+
+def parseDatEntry(text, path='', entryNum=0):
+    '''
+    text: the lines of one dat entry, from its ID line up to, but not
+    including, its '//' line.
+    path: the dat file of the entry, for reporting surprises.
+    entryNum: the number of the entry in the file, for reporting surprises.
+    returns: data about the entry.  See genDatEntriesAt().  The surprises
+    are those of this entry only.
+    '''
+    surprises = [] # exceptions to my assumptions about DAT format.
+
+    # e.g. ID   1A01_HUMAN              Reviewed;         365 AA.
+    splits = text.split(None, 3)
+    fastaNS = 'sp' if splits[2] == 'Reviewed;' else 'tr' # namespace of fasta name line for this seq.
+    entryId = splits[1]
+    orgCode = entryId.split('_')[1] # uniprot organism code.  subspecies sometimes share this, e.g. TRYCR.
+
+    # find the boundaries of the groups of lines used.  Search backwards from
+    # the end for the lines near the end, to not scan the whole entry.
+    sqPos = text.rfind('\nSQ   ')
+    if sqPos == -1:
+        sqPos = len(text)
+    pePos = text.rfind('\nPE   ', 0, sqPos)
+    drEnd = sqPos if pePos == -1 else pePos # DR lines are before the PE line
+    ocPos = text.find('\nOC   ', 0, drEnd)
+    oxPos = text.find('\nOX   ', max(ocPos, 0), drEnd)
+    topEnd = max(ocPos, oxPos) if ocPos == -1 else ocPos # end of the lines before OC
+    if topEnd == -1:
+        topEnd = drEnd
+
+    # e.g. AC   Q16653; O00713; O00714; O00715; Q13054; Q13055; Q14855; Q92891;
+    # get first accession from first line.
+    pos = text.find('\nAC   ', 0, topEnd)
+    acc = text[pos + 6:text.find(';', pos)] if pos != -1 else '' # uniprot entry primary accession number, used as our sequence id.
+
+    # e.g. DT   01-DEC-2001, sequence version 1.
+    seqVersion = ''
+    pos = text.find('sequence version', 0, topEnd)
+    if pos != -1:
+        eol = text.find('\n', pos)
+        seqVersion = text[pos:eol].rsplit(None, 1)[1][:-1] # remove trailing period.
+        if text.find('sequence version', eol, topEnd) != -1:
+            surprises.append('\t'.join(('many_sequence_version_lines', acc, orgCode, path, str(entryNum), '')))
+
+    # e.g. DE   RecName: Full=Uncharacterized protein 002R;
+    # includes 'DE   ' to avoid matching rec names from 'Includes' or 'Contains' lines.
+    # See http://web.expasy.org/docs/userman.html#DE_line.
+    pos = text.find('\nDE   RecName: Full=', 0, topEnd)
+    match = DAT_DESC_RE.match(text, pos + 1) if pos != -1 else None
+    geneDesc = match.group(1) if match else ''
+
+    # e.g. GN   Name=GRF7; OrderedLocusNames=At3g02520; ORFNames=F16B3.15;
+    geneName = ''
+    pos = text.find('\nGN   ', 0, topEnd)
+    while pos != -1: # collect first gene name
+        eol = text.find('\n', pos + 1)
+        match = DAT_NAME_RE.search(text, pos, eol)
+        if match:
+            geneName = match.group(1)
+            break
+        pos = eol if text.startswith('\nGN   ', eol) else -1
+
+    # e.g. 1 line: OS   Homo sapiens (Human).
+    # or >1 lines: OS   Chlorobaculum parvum (strain NCIB 8327) (Chlorobium vibrioforme subsp.
+    #              OS   thiosulfatophilum (strain DSM 263 / NCIB 8327)).
+    osLines = []
+    pos = text.find('\nOS   ', 0, topEnd)
+    while pos != -1:
+        eol = text.find('\n', pos + 1)
+        osLines.append(text[pos + 6:eol].strip())
+        pos = eol if text.startswith('\nOS   ', eol) else -1
+    orgName = parseParens(' '.join(osLines))
+
+    # e.g. OX   NCBI_TaxID=9606;
+    taxon = '' # ncbi taxon id.  should be unique to an organism.
+    if oxPos != -1:
+        eol = text.find('\n', oxPos + 1)
+        match = DAT_TAXON_RE.match(text, oxPos + 6, eol)
+        taxon = match.group(1) if match else ''
+        if text.startswith('\nOX   ', eol):
+            surprises.append('\t'.join(('many_OX_lines', acc, orgCode, path, str(entryNum), '')))
+
+    # e.g. DR   GeneID; 2947774; -.
+    # e.g. DR   GO; GO:0006351; P:transcription, DNA-dependent; IEA:UniProtKB-KW.
+    geneIds = _findDatLineValues(text, '\nDR   GeneID; ', DAT_GENE_ID_RE, topEnd, drEnd)
+    goTerms = _findDatLineValues(text, '\nDR   GO; ', DAT_GO_TERM_RE, topEnd, drEnd)
+
+    evidence = ''
+    complete = False # complete proteome
+    reference = False # reference proteome. should be a subset of complete proteomes. http://www.uniprot.org/faq/47
+    if pePos != -1:
+        # e.g. PE   2: Evidence at transcript level;
+        evidence = text[pePos + 6:text.find(':', pePos)]
+        if text.startswith('\nPE   ', text.rfind('\n', 0, pePos)):
+            surprises.append('\t'.join(('many_PE_lines', acc, orgCode, path, str(entryNum), '')))
+        # KW lines are after the PE line, before any FT lines.
+        kwPos = text.find('\nKW   ', pePos, sqPos)
+        if kwPos != -1:
+            ftPos = text.find('\nFT   ', kwPos, sqPos)
+            keywords = text[kwPos:sqPos if ftPos == -1 else ftPos]
+            complete = COMPLETE_PROTEOME_KW in keywords
+            reference = REFERENCE_PROTEOME_KW in keywords
+
+    # construct fasta nameline
+    # e.g. >sp|Q197F8|002R_IIV3 Uncharacterized protein 002R OS=Invertebrate iridescent virus 3 GN=IIV3-002R PE=4 SV=1
+    # generic: >{source}|{accession}|{entry_id} {gene_desc} OS={organism_name}[ GN={gene_name}] PE={protein_evidence} SV={seq_version}
+    nameline = '>' + fastaNS + '|' + acc + '|' + entryId
+    if geneDesc:
+        nameline += ' ' + geneDesc
+    if orgName:
+        nameline += ' OS=' + orgName
+    if geneName:
+        nameline += ' GN=' + geneName
+    if evidence:
+        nameline += ' PE=' + evidence
+    if seqVersion:
+        nameline += ' SE=' + seqVersion
+    fastaLines = [nameline + '\n']
+
+    # remove whitespace b/c uniprot fasta file does not have whitespace and b/c rsd (blast, kalign, codeml) not tested w/ whitespace
+    # the sequence lines of the entry have 60 residues, like the lines of a fasta file.
+    seqPos = text.find('\n', sqPos + 1) + 1
+    if seqPos:
+        seqLines = text[seqPos:].translate(None, DAT_SEQ_SPACE).split('\n')
+        if '' in seqLines: # rare, so only then look at the lines one by one.
+            seqLines = [''.join(line.split()) for line in text[seqPos:].split('\n') if line.startswith('  ')]
+            for seqLine in seqLines:
+                if not seqLine:
+                    surprises.append('\t'.join(('empty_seq_line', acc, orgCode, path, str(entryNum), '')))
+        fastaLines += [seqLine + '\n' for seqLine in seqLines if seqLine]
+    return (fastaNS, acc, orgCode, orgName, taxon, geneName, geneDesc, complete,
+            reference, geneIds, goTerms, fastaLines, surprises)
+
+
+def _findDatLineValues(text, prefix, regex, start, end):
+    '''
+    text: a dat entry
+    prefix: the start of a group of consecutive lines, e.g. '\nDR   GO; '
+    regex: matches a line starting with prefix, capturing the value of the line.
+    start: where to start looking for the lines
+    end: where to stop looking for the lines
+    returns: the list of values of the lines.
+    '''
+    first = text.find(prefix, start, end)
+    if first == -1:
+        return []
+    # only run the regex over the group of lines, not the whole entry.
+    last = text.rfind(prefix, first, end)
+    return regex.findall(text, first, text.find('\n', last + 1))
+
+
+def genDatEntriesByLine(path, ranges):
+    '''
+    path: uniprot dat file
+    ranges: a list of (start, end) byte offsets.  See genDatEntriesAt().
+    The original line-by-line parser, which dispatches on the code of every
+    line of every entry.  genDatEntriesAt() yields the same entries much
+    faster.  Kept as a reference for testing and benchmarking it.  Unlike
+    genDatEntriesAt(), the surprises yielded with each entry are one list,
+    which accumulates the surprises of all the entries so far.
+    '''
     # http://web.expasy.org/docs/userman.html is indispensible for parsing Uniprot DAT files
 
     # regular expressions for parsing dat lines
@@ -56,11 +305,11 @@ def genDatEntries(path):
     # an entry always starts with one ID line and ends with one // line.
     # some lines can occur 0 or 1 times, some 0+ times, some 1+ times, some exactly 1 time.
     # take this into account when parsing lines.
-    print 'gathering ids in {}...'.format(path), datetime.datetime.now()
-    with open(path) as fh:
+    print 'gathering ids in {} from {} byte ranges...'.format(path, len(ranges)), datetime.datetime.now()
+    with contextlib.closing(genDatLines(path, ranges)) as lines:
         inEntry = False
         entryNum = 0 # count entries
-        for i, line in enumerate(fh):
+        for i, line in enumerate(lines):
             code = line[:2]
             if code == 'ID': # occurs 1 time.
                 inEntry = True
@@ -102,12 +351,12 @@ def genDatEntries(path):
                     taxon = match.group(1) if match else ''
                 else:
                     surprises.append('\t'.join(('many_OX_lines',
-                                                acc, orgCode, path, i, '')))
+                                                acc, orgCode, path, str(entryNum), '')))
             elif code == 'PE': # occurs exactly 1 time?
                 # e.g. PE   2: Evidence at transcript level;
                 if evidence:
                     surprises.append('\t'.join(('many_PE_lines',
-                                                acc, orgCode, path, i, '')))
+                                                acc, orgCode, path, str(entryNum), '')))
                 evidence = line.split()[1][:-1] # remove trailing colon
             elif code == 'DT': # occurs 3 times?
                 # e.g. DT   01-DEC-2001, sequence version 1.
@@ -116,7 +365,7 @@ def genDatEntries(path):
                         seqVersion = line.rsplit(None, 1)[1][:-1] # remove trailing period.
                     else:
                         surprises.append('\t'.join(('many_sequence_version_lines',
-                                                    acc, orgCode, path, i, '')))
+                                                    acc, orgCode, path, str(entryNum), '')))
             elif code == 'DE': # can occur >1 times
                 # http://web.expasy.org/docs/userman.html#DE_line
                 # e.g. DE   RecName: Full=Uncharacterized protein 002R;
@@ -154,11 +403,11 @@ def genDatEntries(path):
                     seqLines.append(seqLine+'\n') # "MTMDKSELVQKAKLAEQAERYDDMAAAMKAVTEQGHELSNEERNLLSVAYKNVVGARRSS\n"
                 else:
                     surprises.append('\t'.join(('empty_seq_line',
-                                                acc, orgCode, path, i, '')))
+                                                acc, orgCode, path, str(entryNum), '')))
             elif code == '//': # occurs 1 time.  end of sequence
                 if not inEntry:
                     surprises.append('\t'.join(('end_without_beginning',
-                                                acc, orgCode, path, i, '// line with unmatched ID line found.')))
+                                                acc, orgCode, path, str(entryNum), '// line with unmatched ID line found.')))
                 inEntry == False
 
                 orgName = parseParens(' '.join(osLines))
@@ -213,6 +462,323 @@ def genDatEntries(path):
                        reference, geneIds, goTerms, fastaLines, surprises)
 
 
+def genDatEntryTexts(path, ranges=None, blockSize=DAT_BLOCK_SIZE):
+    '''
+    path: uniprot dat file, either uncompressed or gzipped (ending in '.gz').
+    ranges: a list of (start, end) byte offsets.  See genDatEntriesAt().
+    blockSize: the number of bytes to read at a time.
+    Read the file in large blocks and split the blocks into entries, so the
+    parser is not handed one line at a time.
+    yields: the text of each entry, from its ID line up to, but not including,
+    its '//' line.
+    '''
+    partial = '' # text after the last complete entry in the last block
+    for block in genDatBlocks(path, ranges, blockSize):
+        texts = (partial + block).split('\n//\n')
+        partial = texts.pop()
+        for text in texts:
+            yield text
+    if partial.strip():
+        raise ValueError('Dat file does not end with a complete entry.', path, ranges)
+
+
+def genDatBlocks(path, ranges=None, blockSize=DAT_BLOCK_SIZE):
+    '''
+    path: uniprot dat file, either uncompressed or gzipped (ending in '.gz').
+    ranges: a list of (start, end) byte offsets.  See genDatEntriesAt().  If
+    None, the whole file is read.  A gzipped file can only be read whole.
+    blockSize: the number of bytes to read at a time.
+    yields: blocks of the dat file.  Blocks do not necessarily end at the end
+    of a line.
+    '''
+    if ranges is None:
+        ranges = [(0, None)]
+    if isGzipped(path):
+        if ranges != [(0, None)]:
+            raise ValueError('Byte ranges of a gzipped dat file can not be read.', path, ranges)
+        return genGzipBlocks(path)
+    return _genRangeBlocks(path, ranges, blockSize)
+
+
+def _genRangeBlocks(path, ranges, blockSize):
+    with open(path, 'rb') as fh:
+        for start, end in ranges:
+            fh.seek(start)
+            remaining = None if end is None else end - start
+            while remaining is None or remaining > 0:
+                block = fh.read(blockSize if remaining is None else min(blockSize, remaining))
+                if not block:
+                    break
+                if remaining is not None:
+                    remaining -= len(block)
+                yield block
+
+
+def benchmarkDatParsing(path, ranges=None):
+    '''
+    path: uniprot dat file
+    ranges: a list of (start, end) byte offsets.  If None, parse the whole file.
+    Time parsing path with genDatEntriesAt() and with the line-by-line parser,
+    genDatEntriesByLine(), and check that they yield the same entries.
+    returns: a dict of the number of entries and entries/sec for each parser.
+    '''
+    if ranges is None:
+        ranges = [(0, None)]
+    stats = {}
+    for name, func in [('by_line', genDatEntriesByLine), ('by_block', genDatEntriesAt)]:
+        start = time.time()
+        numEntries = sum(1 for entry in func(path, ranges))
+        seconds = time.time() - start
+        stats[name + '_entries_per_sec'] = numEntries / max(seconds, 1e-6)
+    # the line parser accumulates surprises across entries, so compare only
+    # the surprises it added for each entry.
+    numSurprises = 0
+    for entry1, entry2 in itertools.izip_longest(genDatEntriesByLine(path, ranges),
+                                                 genDatEntriesAt(path, ranges)):
+        if entry1 is None or entry2 is None or entry1[:-1] != entry2[:-1] or \
+                entry1[-1][numSurprises:] != entry2[-1]:
+            raise Exception('Parsers yielded different entries.', path, entry1, entry2)
+        numSurprises = len(entry1[-1])
+    stats['entries'] = numEntries
+    stats['speedup'] = stats['by_block_entries_per_sec'] / stats['by_line_entries_per_sec']
+    print 'benchmark of parsing {}:'.format(path), stats
+    return stats
+
+
+def genDatLines(path, ranges=None):
+    '''
+    path: uniprot dat file, either uncompressed or gzipped (ending in '.gz').
+    ranges: a list of (start, end) byte offsets.  See genDatEntriesAt().  If
+    None, the whole file is read.  A gzipped file can only be read whole.
+    yields: the lines of the dat file.
+    '''
+    if ranges is None:
+        ranges = [(0, None)]
+    if isGzipped(path):
+        if ranges != [(0, None)]:
+            raise ValueError('Byte ranges of a gzipped dat file can not be read.', path, ranges)
+        return genGzipLines(path)
+    return _genRangeLines(path, ranges)
+
+
+def isGzipped(path):
+    return path.endswith('.gz')
+
+
+def _genRangeLines(path, ranges):
+    '''
+    path: uncompressed dat file
+    ranges: a list of (start, end) byte offsets.  See genDatEntriesAt().
+    yields: the lines in each byte range, stopping after the '//' line of
+    the entry that ends at or past end.
+    '''
+    with open(path) as fh:
+        for start, end in ranges:
+            fh.seek(start)
+            if end is None:
+                for line in fh:
+                    yield line
+                continue
+            pos = start # byte offset of the end of the current line
+            for line in fh:
+                pos += len(line)
+                yield line
+                if pos >= end and line.startswith('//'):
+                    break
+
+
+def genGzipLines(path, blockSize=GZIP_BLOCK_SIZE, queueSize=GZIP_QUEUE_SIZE):
+    '''
+    path: a gzipped file, possibly with several concatenated gzip members.
+    See genGzipBlocks().
+    yields: the lines of the decompressed file.
+    '''
+    with contextlib.closing(genGzipBlocks(path, blockSize, queueSize)) as blocks:
+        for block in blocks:
+            for line in cStringIO.StringIO(block):
+                yield line
+
+
+def genGzipBlocks(path, blockSize=GZIP_BLOCK_SIZE, queueSize=GZIP_QUEUE_SIZE):
+    '''
+    path: a gzipped file, possibly with several concatenated gzip members.
+    blockSize: the number of compressed bytes to read at a time.
+    queueSize: the maximum number of decompressed blocks waiting to be parsed.
+    Decompress path in a separate thread, which feeds blocks of whole lines
+    through a bounded queue.  zlib releases the GIL while it decompresses, so
+    parsing the lines overlaps decompressing the next blocks, and no
+    uncompressed copy of the file is ever written.
+    yields: blocks of whole lines of the decompressed file.
+    '''
+    blocks = Queue.Queue(queueSize)
+    stopping = threading.Event()
+
+    def put(item):
+        # give up if the consumer stopped reading lines, e.g. on an exception
+        while not stopping.is_set():
+            try:
+                blocks.put(item, timeout=1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def decompress():
+        try:
+            with open(path, 'rb') as fh:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) # 16 + MAX_WBITS for the gzip header
+                partial = '' # text after the last newline in the last block
+                for data in iter(lambda: fh.read(blockSize), ''):
+                    text = decompressor.decompress(data)
+                    while decompressor.unused_data: # start of the next gzip member
+                        data = decompressor.unused_data
+                        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                        text += decompressor.decompress(data)
+                    end = text.rfind('\n') + 1
+                    if end:
+                        if not put(partial + text[:end]):
+                            return
+                        partial = text[end:]
+                    else:
+                        partial += text
+                text = partial + decompressor.flush()
+                if text and not put(text):
+                    return
+            put(None)
+        except Exception as e:
+            put(e)
+
+    thread = threading.Thread(target=decompress, name='gunzip {}'.format(path))
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            block = blocks.get()
+            if block is None:
+                break
+            if isinstance(block, Exception):
+                raise block
+            yield block
+    finally:
+        stopping.set()
+        thread.join()
+
+
+###################
+# DAT FILE INDEXING
+
+# An index of a dat file is a file of fixed-size records, one per entry, in
+# the order of the entries.  Each record packs the byte offset and byte length
+# of the entry, its ncbi taxon id, its organism code (null-padded) and flags.
+DAT_INDEX_FORMAT = '<QII5sB'
+DAT_INDEX_RECORD_SIZE = struct.calcsize(DAT_INDEX_FORMAT)
+COMPLETE_FLAG = 1 # entry is in a complete proteome
+REFERENCE_FLAG = 2 # entry is in a reference proteome
+SPROT_FLAG = 4 # entry is from Swiss-Prot (reviewed), not TrEMBL
+
+
+def indexDat(path, indexPath):
+    '''
+    path: uncompressed uniprot dat file.  The offsets in the index of a
+    gzipped file would be useless, since it can not be seeked into.
+    indexPath: where to write the index.
+    Scan a dat file once, only looking at the ID, OX, and KW lines, and write
+    an index record for every entry.  See DatIndex.
+    returns: the number of entries indexed.
+    '''
+    if isGzipped(path):
+        raise ValueError('Can not index a gzipped dat file.', path)
+    taxonRE = re.compile(r'^OX   NCBI_TaxID=(\d+)')
+    record = struct.Struct(DAT_INDEX_FORMAT)
+    print 'indexing {} to {}...'.format(path, indexPath), datetime.datetime.now()
+    tmpPath = indexPath + '.tmp'
+    count = 0
+    with open(path) as fh, open(tmpPath, 'wb') as out:
+        pos = 0 # byte offset of the start of the current line
+        for line in fh:
+            code = line[:2]
+            if code == 'ID':
+                # e.g. ID   1A01_HUMAN              Reviewed;         365 AA.
+                offset = pos
+                splits = line.split()
+                orgCode = splits[1].split('_')[1]
+                flags = SPROT_FLAG if splits[2] == 'Reviewed;' else 0
+                taxon = 0
+            elif code == 'OX' and not taxon:
+                match = taxonRE.search(line)
+                taxon = int(match.group(1)) if match else 0
+            elif code == 'KW':
+                if COMPLETE_PROTEOME_KW in line:
+                    flags |= COMPLETE_FLAG
+                if REFERENCE_PROTEOME_KW in line:
+                    flags |= REFERENCE_FLAG
+            elif code == '//':
+                out.write(record.pack(offset, pos + len(line) - offset, taxon, orgCode, flags))
+                count += 1
+                if count % 1000000 == 0: print 'index count:', count
+            pos += len(line)
+    os.rename(tmpPath, indexPath)
+    return count
+
+
+class DatIndex(object):
+    '''
+    Read-only, memory-mapped access to the records of a dat file index written
+    by indexDat().  A record is a tuple of (offset, length, taxon, orgCode,
+    flags).  Taxon is a string, like the taxon from genDatEntries().
+    '''
+    def __init__(self, indexPath):
+        self.indexPath = indexPath
+        self.record = struct.Struct(DAT_INDEX_FORMAT)
+        self.size = os.path.getsize(indexPath)
+        self.mm = None
+        if self.size:
+            with open(indexPath, 'rb') as fh:
+                self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    def __len__(self):
+        return self.size // self.record.size
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError(i)
+        offset, length, taxon, orgCode, flags = self.record.unpack_from(self.mm, i * self.record.size)
+        return offset, length, str(taxon), orgCode.rstrip('\x00'), flags
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def ranges(self, taxons=None, flags=0):
+        '''
+        taxons: if not None, only select entries of these taxons.
+        flags: only select entries with all of these flags set, e.g.
+        COMPLETE_FLAG.
+        Select entries, ignoring those with organism codes starting with '9',
+        which are not a species or subspecies.
+        returns: a list of (start, end) byte offsets of the selected entries,
+        suitable for genDatEntriesAt().  Adjacent entries are merged into one
+        range.
+        '''
+        ranges = []
+        for offset, length, taxon, orgCode, entryFlags in self:
+            if (orgCode[:1] == '9' or (entryFlags & flags) != flags or
+                (taxons is not None and taxon not in taxons)):
+                continue
+            if ranges and ranges[-1][1] == offset:
+                ranges[-1][1] = offset + length
+            else:
+                ranges.append([offset, offset + length])
+        return [tuple(r) for r in ranges]
+
+
 def testParseParens():
     goodStrings = ["foo (bar (baz)) (wiz)", "foo bar", "(foo) holla"]
     badStrings = ["foo bar (baz)) (wiz)", "foo bar ((baz) (wiz)", "foo bar))(baz)"]
@@ -226,6 +792,9 @@ def testParseParens():
             print string, 'Good: found exception'
             
         
+PARENS_RE = re.compile('[()]')
+
+
 def parseParens(string):
     '''
     Returns everything up to and including the first set of parentheses.
@@ -233,13 +802,14 @@ def parseParens(string):
     Example: "Frog virus 3 (isolate Goorha) (FV-3)" -> "Frog virus 3 (isolate Goorha)"
     '''
     count = 0
-    for i, c in enumerate(string):
-        if c == '(':
+    # only look at the parentheses, not every character.
+    for match in PARENS_RE.finditer(string):
+        if match.group() == '(':
             count += 1
-        if c == ')':
+        else:
             count -= 1
             if count == 0:
-                return string[:i+1]
+                return string[:match.end()]
             elif count < 0:
                 raise Exception('Mismatched parentheses', string, count)
     if count > 0:
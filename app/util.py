@@ -8,6 +8,7 @@ ONLY DEPENDENCIES ON STANDARD LIBRARY MODULES ALLOWED.
 '''
 
 import datetime
+import heapq
 import math
 import hashlib # sha
 import itertools
@@ -346,6 +347,31 @@ def splitIntoN(input, n, exact=False):
         end = end + size
 
 
+def packLongestFirst(input, costs, n):
+    '''
+    input: a sequence
+    costs: the cost (e.g. running time) of each element of input.
+    n: the number of groups to pack input into.  must be an integer > 0.
+    Pack input into n groups with about the same total cost, using the longest
+    processing time first heuristic: from most to least costly, each element
+    is added to the group with the least total cost so far.  The most costly
+    group costs at most 4/3 of the most costly group of an optimal packing.
+    e.g. if input was [a,b,c,d] with costs [5,4,3,2] and n=2, input would be
+    packed into these groups: [a,d],[b,c]
+    returns: a list of n lists of elements of input, some of which might be
+    empty, and a list of the total cost of each list.
+    '''
+    groups = [[] for i in range(n)]
+    totals = [0] * n
+    heap = [(0, i) for i in range(n)] # (total cost, group)
+    for j in sorted(range(len(input)), key=lambda j: costs[j], reverse=True):
+        total, i = heap[0]
+        groups[i].append(input[j])
+        totals[i] = total + costs[j]
+        heapq.heapreplace(heap, (totals[i], i))
+    return groups, totals
+
+
 def isInteger(num):
     '''
     num: possibly an integer
@@ -403,6 +429,40 @@ def stddev(nums):
     return math.sqrt(variance(nums))
 
 
+class LogHistogram(object):
+    '''
+    Approximate percentiles of a stream of numbers in bounded memory, by
+    counting positive numbers in bins spaced logarithmically, binsPerDecade
+    per power of ten.  Percentiles are within a factor of
+    10**(1.0/binsPerDecade) of the exact value.  Numbers <= 0 count as 0.
+    usage: h = LogHistogram(); for x in xs: h.add(x); print h.percentile(50)
+    '''
+    def __init__(self, binsPerDecade=100):
+        self.binsPerDecade = binsPerDecade
+        self.binToCount = {}
+        self.count = 0
+
+    def add(self, x):
+        b = int(math.floor(math.log10(x) * self.binsPerDecade)) if x > 0 else None
+        self.binToCount[b] = self.binToCount.get(b, 0) + 1
+        self.count += 1
+
+    def percentile(self, p):
+        '''
+        p: a percent, from 0 to 100.
+        returns: the approximate p-th percentile, or None if no numbers were added.
+        '''
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(p / 100.0 * self.count)))
+        total = 0
+        for b in sorted(self.binToCount): # None sorts first
+            total += self.binToCount[b]
+            if total >= rank:
+                break
+        return 0.0 if b is None else 10 ** ((b + 0.5) / self.binsPerDecade)
+
+
 #######################################
 # COMBINATORICS FUNCTIONS
 #######################################
@@ -491,6 +551,17 @@ def readFromFile(filename, mode='r'):
     return data
 
 
+def fileDigest(filename, bufsize=2**20):
+    '''
+    returns: the hex SHA digest of the contents of the file.
+    '''
+    s = hashlib.sha1()
+    with open(filename, 'rb') as fh:
+        for data in iter(lambda: fh.read(bufsize), ''):
+            s.update(data)
+    return s.hexdigest()
+
+
 def differentFiles(filename1, filename2):
     '''
     compares the contents of the two files using the SHA digest algorithm.
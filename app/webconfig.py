@@ -21,6 +21,8 @@ RT_EMAIL = 'submit-cbi@rt.med.harvard.edu'
 
 # CACHE CONFIGURATION
 CACHE_TABLE = 'roundup_cache'
+# Seconds between checks for changes to dataset metadata cached in memory.
+METADATA_CACHE_CHECK_SECONDS = 300
 
 
 # The physical location of static files served under the '/static/' url.
@@ -0,0 +1,240 @@
+'''
+A queue of work items backed by a relational database, from which many
+workers (e.g. lsf jobs) atomically claim items until the queue is empty, so
+workers that finish early keep working instead of idling while others
+straggle.
+
+Items are serialized as json and claimed in the order they were put.  A
+claimed item is done when its worker calls done().  If a worker dies, its
+claimed items can be released to be claimed again.
+
+WorkQueue uses MySQL (or another database using the %s parameter style).
+SqliteWorkQueue uses a sqlite file, which is handy for testing and for
+workers on a single machine.
+
+usage:
+
+    queue = WorkQueue(connect, ns='my_queue').create()
+    queue.putMany(items)
+    # in each worker
+    while True:
+        claimed = queue.claim(worker)
+        if claimed is None:
+            break
+        itemId, item, numClaims = claimed
+        process(item)
+        queue.done(itemId)
+'''
+
+import contextlib
+import json
+import sqlite3
+import time
+import uuid
+
+import dbutil
+
+
+class WorkQueue(object):
+    '''
+    A work queue in a table of a MySQL database.  Call create() before using
+    a queue for the first time and drop() when done with it.
+    '''
+    param = '%s' # sql parameter placeholder
+    startSQL = 'START TRANSACTION'
+
+    def __init__(self, connect, ns='work_queue'):
+        '''
+        connect: A function which returns a context manager for getting a
+        DBAPI 2.0 connection.  See kvstore.KVStore.
+        ns: The "namespace" of the queue.  Should be a valid table name.
+        '''
+        self.connect = connect
+        self.table = ns
+
+    def create(self):
+        sql = '''CREATE TABLE IF NOT EXISTS ''' + self.table + ''' (
+                 id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+                 item blob,
+                 claim VARCHAR(255) DEFAULT NULL,
+                 worker VARCHAR(255) DEFAULT NULL,
+                 claim_time DOUBLE DEFAULT NULL,
+                 num_claims INT UNSIGNED NOT NULL DEFAULT 0,
+                 done TINYINT NOT NULL DEFAULT 0,
+                 INDEX claim_index (claim),
+                 INDEX worker_index (worker)
+                 ) ENGINE = InnoDB '''
+        self._execute(sql)
+        return self
+
+    def drop(self):
+        self._execute('DROP TABLE IF EXISTS ' + self.table)
+        return self
+
+    def reset(self):
+        return self.drop().create()
+
+    def putMany(self, items):
+        '''
+        Add items to the end of the queue.
+        '''
+        sql = 'INSERT INTO {} (item) VALUES ({})'.format(self.table, self.param)
+        with self.connect() as conn:
+            with self._transaction(conn):
+                with dbutil.doCursor(conn) as cursor:
+                    cursor.executemany(sql, [[json.dumps(item)] for item in items])
+
+    def claim(self, worker):
+        '''
+        Atomically claim the first unclaimed item for worker.
+        returns: a tuple of the id of the item, the item, and the number of
+        times it has been claimed (more than 1 if it was released), or None if
+        there are no unclaimed items.
+        '''
+        claim = '{}:{}'.format(worker, uuid.uuid4().hex)
+        p = self.param
+        with self.connect() as conn:
+            with self._transaction(conn):
+                with dbutil.doCursor(conn) as cursor:
+                    cursor.execute(self._claimSQL(), [claim, worker, time.time()])
+                    cursor.execute('SELECT id, item, num_claims FROM {} WHERE claim = {}'.format(self.table, p), [claim])
+                    row = cursor.fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), row[2]
+
+    def _claimSQL(self):
+        # a locking update, so concurrent workers never claim the same item.
+        p = self.param
+        return '''UPDATE {} SET claim = {p}, worker = {p}, claim_time = {p}, num_claims = num_claims + 1
+                  WHERE claim IS NULL ORDER BY id LIMIT 1'''.format(self.table, p=p)
+
+    def done(self, itemId):
+        '''
+        Mark the claimed item with id itemId done.
+        '''
+        sql = 'UPDATE {} SET done = 1 WHERE id = {}'.format(self.table, self.param)
+        self._execute(sql, [itemId])
+
+    def release(self, worker=None, olderThan=None):
+        '''
+        Release the claimed items that are not done, so they can be claimed
+        again, e.g. when the worker that claimed them died.
+        worker: only release items claimed by this worker.
+        olderThan: only release items claimed more than this many seconds ago.
+        returns: the number of items released.
+        '''
+        sql = 'UPDATE {} SET claim = NULL WHERE claim IS NOT NULL AND done = 0'.format(self.table)
+        args = []
+        if worker is not None:
+            sql += ' AND worker = {}'.format(self.param)
+            args.append(worker)
+        if olderThan is not None:
+            sql += ' AND claim_time < {}'.format(self.param)
+            args.append(time.time() - olderThan)
+        return self._execute(sql, args)
+
+    def items(self, worker=None, done=None):
+        '''
+        worker: only return items last claimed by this worker.
+        done: if not None, only return items that are done (True) or not (False).
+        returns: a list of (id, item) tuples, in queue order.
+        '''
+        sql = 'SELECT id, item FROM {} WHERE 1 = 1'.format(self.table)
+        args = []
+        if worker is not None:
+            sql += ' AND worker = {}'.format(self.param)
+            args.append(worker)
+        if done is not None:
+            sql += ' AND done = {}'.format(self.param)
+            args.append(1 if done else 0)
+        sql += ' ORDER BY id'
+        with self.connect() as conn:
+            with dbutil.doCursor(conn) as cursor:
+                cursor.execute(sql, args)
+                return [(itemId, json.loads(item)) for itemId, item in cursor.fetchall()]
+
+    def isDone(self, itemId):
+        sql = 'SELECT done FROM {} WHERE id = {}'.format(self.table, self.param)
+        with self.connect() as conn:
+            with dbutil.doCursor(conn) as cursor:
+                cursor.execute(sql, [itemId])
+                row = cursor.fetchone()
+        return bool(row and row[0])
+
+    def counts(self):
+        '''
+        returns: a dict of the number of items that are 'unclaimed', 'claimed'
+        (but not done) and 'done'.
+        '''
+        sql = '''SELECT SUM(claim IS NULL), SUM(claim IS NOT NULL AND done = 0), SUM(done)
+                 FROM {}'''.format(self.table)
+        with self.connect() as conn:
+            with dbutil.doCursor(conn) as cursor:
+                cursor.execute(sql)
+                row = cursor.fetchone()
+        return dict(zip(['unclaimed', 'claimed', 'done'], [int(n or 0) for n in row]))
+
+    @contextlib.contextmanager
+    def _transaction(self, conn):
+        # sqlite cursors do not accept None args, so do not use executeSQL
+        # to start the transaction.
+        with dbutil.doTransaction(conn, start=False):
+            with dbutil.doCursor(conn) as cursor:
+                cursor.execute(self.startSQL)
+            yield conn
+
+    def _execute(self, sql, args=None):
+        '''
+        returns: the number of rows affected.
+        '''
+        with self.connect() as conn:
+            with self._transaction(conn):
+                with dbutil.doCursor(conn) as cursor:
+                    cursor.execute(sql, args or [])
+                    return cursor.rowcount
+
+
+class SqliteWorkQueue(WorkQueue):
+    '''
+    A work queue in a sqlite file.  Sqlite locking is unreliable on some
+    network filesystems, so workers should be on the machine with the file.
+    '''
+    param = '?'
+    # lock the database for writing at the start of a transaction, so two
+    # workers never read the same unclaimed item.
+    startSQL = 'BEGIN IMMEDIATE'
+
+    def __init__(self, path, ns='work_queue'):
+        self.path = path
+
+        @contextlib.contextmanager
+        def connect():
+            # isolation_level=None, so transactions are started explicitly.
+            conn = sqlite3.connect(path, timeout=600, isolation_level=None)
+            try:
+                yield conn
+            finally:
+                conn.close()
+
+        WorkQueue.__init__(self, connect, ns)
+
+    def create(self):
+        sql = '''CREATE TABLE IF NOT EXISTS ''' + self.table + ''' (
+                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 item TEXT,
+                 claim TEXT DEFAULT NULL,
+                 worker TEXT DEFAULT NULL,
+                 claim_time REAL DEFAULT NULL,
+                 num_claims INTEGER NOT NULL DEFAULT 0,
+                 done INTEGER NOT NULL DEFAULT 0)'''
+        self._execute(sql)
+        self._execute('CREATE INDEX IF NOT EXISTS {0}_claim_index ON {0} (claim)'.format(self.table))
+        self._execute('CREATE INDEX IF NOT EXISTS {0}_worker_index ON {0} (worker)'.format(self.table))
+        return self
+
+    def _claimSQL(self):
+        # sqlite does not support UPDATE ... ORDER BY ... LIMIT by default.
+        p = self.param
+        return '''UPDATE {0} SET claim = {p}, worker = {p}, claim_time = {p}, num_claims = num_claims + 1
+                  WHERE id = (SELECT id FROM {0} WHERE claim IS NULL ORDER BY id LIMIT 1)'''.format(self.table, p=p)
@@ -0,0 +1,143 @@
+'''
+A pool of buffered writers for writing to many files at once, e.g. splitting
+the sequences of uniprot dat files into thousands of genome fasta files.
+
+Data written to a file is buffered in memory.  When the total buffered data of
+all the files exceeds a limit, every buffer is written out.  Files are kept
+open between flushes in a least-recently-used pool, bounded by the limit on
+open file descriptors, so a flush does not open and close every file, which
+is slow on a network fileserver like Isilon.
+'''
+
+import collections
+import datetime
+import resource
+import time
+
+import util
+
+
+DEFAULT_BUF_BYTES = 64 * 2**20 # flush when 64MB of data is buffered
+FD_HEADROOM = 64 # file descriptors left for the rest of the process
+
+
+def getMaxOpenFiles(headroom=FD_HEADROOM):
+    '''
+    headroom: the number of file descriptors to leave for other uses.
+    returns: the number of files a pool can keep open without exceeding the
+    (soft) limit on open file descriptors of the process.
+    '''
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        soft = 4096
+    return max(1, soft - headroom)
+
+
+class WriterPool(object):
+    '''
+    Buffer data written to many files and write it out, through a pool of open
+    file handles, whenever the total buffered data exceeds bufBytes.  The
+    first time the pool opens a file, the file is truncated, unless truncate
+    is False.  Use as a context manager, or call close() when done, to write
+    out the remaining data and close the files.
+    '''
+    def __init__(self, bufBytes=DEFAULT_BUF_BYTES, maxOpen=None, truncate=True):
+        '''
+        bufBytes: flush all buffers when this many bytes are buffered.
+        maxOpen: the maximum number of files to keep open.  Defaults to, and
+        is capped by, getMaxOpenFiles().
+        truncate: if False, append to files that already exist.
+        '''
+        self.bufBytes = bufBytes
+        self.maxOpen = min(maxOpen, getMaxOpenFiles()) if maxOpen else getMaxOpenFiles()
+        self.truncate = truncate
+        self.buffers = collections.defaultdict(list)
+        self.numBuffered = 0 # bytes in buffers
+        self.handles = collections.OrderedDict() # open files, least recently used first
+        self.openedPaths = set() # paths opened by this pool
+        # stats
+        self.numFlushes = 0
+        self.numOpens = 0
+        self.bytesWritten = 0
+        self.flushSeconds = 0.0
+
+    def write(self, path, data):
+        '''
+        Buffer data to be written to the file at path.
+        '''
+        self.buffers[path].append(data)
+        self.numBuffered += len(data)
+        if self.numBuffered >= self.bufBytes:
+            self.flush()
+
+    def writelines(self, path, lines):
+        self.write(path, ''.join(lines))
+
+    def flush(self):
+        '''
+        Write the buffered data of every file.
+        '''
+        if not self.buffers:
+            return
+        start = time.time()
+        # write to the files that are already open first, so they are not
+        # closed to make room for others and then reopened.
+        paths = sorted(self.buffers, key=lambda path: path not in self.handles)
+        for path in paths:
+            self._getHandle(path).write(''.join(self.buffers[path]))
+        for fh in self.handles.itervalues():
+            fh.flush()
+        self.numFlushes += 1
+        self.bytesWritten += self.numBuffered
+        self.flushSeconds += time.time() - start
+        print 'flushed {} to {} files in {:.1f}s.'.format(util.humanBytes(self.numBuffered), len(paths),
+                                                          time.time() - start), datetime.datetime.now()
+        self.buffers.clear()
+        self.numBuffered = 0
+
+    def _getHandle(self, path):
+        fh = self.handles.pop(path, None)
+        if fh is None:
+            if len(self.handles) >= self.maxOpen:
+                lruPath, lruFh = self.handles.popitem(last=False)
+                lruFh.close()
+            mode = 'w' if self.truncate and path not in self.openedPaths else 'a'
+            fh = open(path, mode)
+            self.openedPaths.add(path)
+            self.numOpens += 1
+        self.handles[path] = fh # most recently used
+        return fh
+
+    def close(self):
+        '''
+        Write the remaining buffered data and close all files.
+        '''
+        try:
+            self.flush()
+        finally:
+            while self.handles:
+                path, fh = self.handles.popitem()
+                fh.close()
+        if self.openedPaths:
+            print self.report()
+
+    def stats(self):
+        '''
+        returns: a dict of the number of flushes, file opens, bytes written and
+        seconds spent flushing, and the flush throughput in bytes/second.
+        '''
+        return {'flushes': self.numFlushes, 'opens': self.numOpens,
+                'bytes': self.bytesWritten, 'seconds': self.flushSeconds,
+                'bytes_per_sec': self.bytesWritten / self.flushSeconds if self.flushSeconds else 0.0}
+
+    def report(self):
+        stats = self.stats()
+        return 'wrote {} to {} files in {} flushes, {} opens, {:.1f}s ({}/s).'.format(
+            util.humanBytes(stats['bytes']), len(self.openedPaths), stats['flushes'],
+            stats['opens'], stats['seconds'], util.humanBytes(stats['bytes_per_sec']))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()